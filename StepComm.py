@@ -33,21 +33,52 @@
 # In addition, the cap/send screen can send text strings, multiline macros, as well
 # as send entire text files or capture the data to a file.
 #
-#There are two special self calling routines. One is used for transmitting strings,
-# and one is used to capture the data received on the comport. These routines will
-# call themselves after a fixed delay, causing an endless series of paced executions
-# of the routines. The capture data routine is necessary because there is no tkinter
+#There is a special self calling routine used to capture the data received on the
+# comport. It calls itself after a delay, causing an endless series of paced
+# executions. The capture data routine is necessary because there is no tkinter
 # event for a received character on a comport, so the comport must be polled.
 # This is the only way to handle this in a tkinter project since any call to sleep
-# effectively kills the GUI.
-# The second routine is used in the transmission of strings to the serial port. A handy
+# effectively kills the GUI. The delay adapts to the traffic: it doubles on every idle
+# tick up to poll_max_ms, so an idle terminal hardly wakes up, and drops back to
+# poll_min_ms as soon as anything is received, sent or typed. A busy tick keeps reading
+# until the driver is empty or poll_budget_ms is used up.
+#Transmission of strings to the serial port is done by the tx_engine thread. A handy
 # feature of a good comm program is to have an adjustable pacing of the data going
-# out the comport. This take the form of a character delay and a line delay. To create
-# the delays (again, without using sleep()) the txstring routine sets up the data,
-# and the txchar loop outputs a single char and calls itself until the string is 
-# finished. During the transmission of the string, no other string or char can be sent.
+# out the comport. This take the form of a character delay and a line delay. The
+# stringout routine translates the newlines of the whole string once and queues it,
+# the engine writes it in large chunks, or paced char by char on a monotonic clock
+# when delays are set. Since it runs in its own thread it can sleep() between chars.
+# Strings sent while another one is going out are queued behind it.
+#Other threads can talk to the device through two queues given to pycom_tk:
+# data_from_device_q gets every chunk read from the port, and items put on
+# data_to_device_q are sent out the port by a queue_feeder thread, in batches, through
+# the same transmit engine the GUI uses. A device_queue can be used for either one to
+# choose what happens when it is full.
+#The comport polling can optionally be replaced by a background reader thread (-r option).
+# The thread does blocking reads, pushes the data to data_from_device_q right away, and
+# hands it to the GUI through a deque that the port_in routine drains on its next tick.
+#Everything shown is also appended to a stepcomm_search index, including the text
+# trimmed off the top, so the Search panel (Ctrl+Shift+F) finds old output without
+# searching the widget; only the matches on screen get a highlight tag.
+#Highlight rules (Settings, Highlight) color lines or tokens as they arrive. After each
+# batch of inserts the new text goes through the one regex all the rules compile to
+# and each rule's ranges are added with a single tag_add call. Only the part of the
+# batch that can still be on screen is looked at.
+#The VT100 display mode runs everything received through a stepcomm_vt screen, a grid
+# of rows x cols cells the escape sequences of full screen programs draw on. The
+# textarea shows the grid as its last rows lines; port_in repaints only the lines that
+# changed, once per tick, and lines scrolling off the top of the grid are appended
+# above it, so they become normal scrollback.
+#All the port handling above lives in stepcomm_engine.py, which doesn't need tkinter.
+# pycom_tk drives a serial_engine, and --headless runs one without any GUI.
+import sys
+if __name__ == "__main__" and '--headless' in sys.argv[1:]:
+    #headless mode must not even import tkinter
+    import stepcomm_engine
+    sys.exit(stepcomm_engine.main())
 import os.path
 import time
+import collections
 import tkinter as tk
 from tkinter import ttk
 import tkinter.scrolledtext as tkst
@@ -55,17 +86,179 @@ from tkinter import filedialog,TOP,BOTTOM,LEFT,RIGHT
 from tkinter import X,Y,N,S,E,W,END,BOTH,VERTICAL,HORIZONTAL,DISABLED
 from tkinter import font
 import serial
-from serial.tools.list_ports import comports
 import re
-import sys
 import json
 import argparse
-import queue
+import tempfile
+import codecs
+import stepcomm_engine
+import stepcomm_macro
+import stepcomm_search
+import stepcomm_frames
+import stepcomm_vt
+from stepcomm_engine import serial_engine
+
+
+class text_history:
+    #transcript of the text trimmed off the top of the textarea. It is kept either in a
+    # ring of chunks that drops the oldest text past max_chars, or spilled to a
+    # temporary file on disk that only grows. Textarea contents are not included.
+    def __init__(self,max_chars=64*1024*1024,spill=False):
+        self.max_chars = max_chars
+        self.spill = spill
+        self.chunks = collections.deque()
+        self.size = 0 # characters currently held
+        self.file = tempfile.TemporaryFile() if spill else None
+    def append(self,text):
+        if not text:
+            return
+        self.size += len(text)
+        if self.file is not None:
+            self.file.seek(0,os.SEEK_END)
+            self.file.write(text.encode('utf-8'))
+        else:
+            self.chunks.append(text)
+            while self.size > self.max_chars and len(self.chunks) > 1:
+                self.size -= len(self.chunks.popleft())
+    def clear(self):
+        self.chunks.clear()
+        self.size = 0
+        if self.file is not None:
+            self.file.seek(0)
+            self.file.truncate()
+    def get(self):
+        if self.file is not None:
+            self.file.seek(0)
+            return self.file.read().decode('utf-8')
+        return ''.join(self.chunks)
+    def write_to(self,f):
+        #copy the history to an open text file without building one big string
+        if self.file is not None:
+            self.file.seek(0)
+            dec = codecs.getincrementaldecoder('utf-8')(errors='replace')
+            while True:
+                b = self.file.read(1<<20)
+                f.write(dec.decode(b,final=not b))
+                if not b:
+                    break
+        else:
+            for t in self.chunks:
+                f.write(t)
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+
+class byte_format:
+    #formats raw bytes for the HEX, HEX+ASCII and RAW display modes, a whole chunk at a
+    # time: bytes.hex() makes the hex digits of the chunk in one call, translate tables
+    # make the ASCII column and the RAW text, only full 16 byte lines are put together
+    # in Python. A partial last line is shown too, format() returns how many characters
+    # of it are on screen so display() can take them back and show the completed line.
+    display_modes = ('TEXT','HEX','HEX+ASCII','RAW')
+    ascii_table = bytes(c if 0x20 <= c < 0x7f else 0x2e for c in range(256))
+    raw_table = bytes(c if c >= 0x20 or c in (0x09,0x0a) else 0x2e for c in range(256))
+    def __init__(self,mode='HEX'):
+        self.mode = mode
+        self.offset = 0 # count of bytes before the current line
+        self.partial = b'' # bytes of the current line, less than 16
+        self.shown = 0 # characters of the current line on screen
+    def lines(self,data,offset):
+        h = data.hex(' ')
+        if self.mode == 'HEX':
+            return ''.join(h[i:i+47] + '\n' for i in range(0,len(h),48))
+        a = data.translate(self.ascii_table).decode('latin-1')
+        return ''.join('{:08x}  {:<47}  |{}|\n'.format(offset + i,h[i*3:i*3+47],a[i:i+16])
+                for i in range(0,len(data),16))
+    def format(self,data):
+        #returns (characters to take back,text to insert)
+        if self.mode == 'RAW':
+            return 0,data.translate(self.raw_table).decode('latin-1')
+        data = self.partial + data
+        retract = self.shown
+        full = len(data) - len(data) % 16
+        text = self.lines(data[:full],self.offset)
+        self.offset += full
+        self.partial = data[full:]
+        line = self.lines(self.partial,self.offset)[:-1] if self.partial else ''
+        self.shown = len(line)
+        return retract,text + line
+    def commit(self):
+        #leave a partial line as it is, the next data starts a new line. Returns the
+        # text that ends the line
+        end = '\n' if self.shown else ''
+        self.offset += len(self.partial)
+        self.partial = b''
+        self.shown = 0
+        return end
+
+
+class highlight_rules:
+    #user rules coloring the text shown. All the rules are compiled into one alternation
+    # of named groups, so the text is searched once however many rules there are.
+    # A rule is {'pattern':regex,'color':tk color,'scope':'line' or 'match'}, a line
+    # rule colors the whole line it matches in. Line rules are anchored at the line
+    # start so a line without a match costs one pass. Where rules overlap the first
+    # match wins, a pattern can use scoped flags like (?i:warn) but not global ones
+    scopes = ('line','match')
+    defaults = [{'pattern':'PANIC|[Pp]anic','color':'magenta','scope':'line'},
+            {'pattern':'ERROR|[Ee]rror','color':'red','scope':'line'},
+            {'pattern':'WARN|[Ww]arning','color':'dark orange','scope':'line'}]
+    def __init__(self,rules=()):
+        self.set(rules)
+    def set(self,rules):
+        #raises ValueError naming the rule that does not compile
+        parts = []
+        for i,rule in enumerate(rules):
+            if not rule.get('color'):
+                raise ValueError('highlight rule {!r} has no color'.format(rule.get('pattern')))
+            try:
+                re.compile(rule['pattern'])
+            except re.error as err:
+                raise ValueError('highlight rule {!r}: {}'.format(rule['pattern'],err))
+            p = '(?:{})'.format(rule['pattern'])
+            if rule.get('scope','match') == 'line':
+                p = '^[^\n]*?' + p + '[^\n]*'
+            parts.append('(?P<hl{:d}>{})'.format(i,p))
+        regex = re.compile('|'.join(parts),re.MULTILINE) if parts else None
+        self.rules = [dict(rule) for rule in rules]
+        self.tags = ['hl{:d}'.format(i) for i in range(len(rules))]
+        self.regex = regex
+    def ranges(self,text):
+        #{tag:[(start,end),...]} of the matches in text
+        out = {}
+        if self.regex is None:
+            return out
+        for m in self.regex.finditer(text):
+            tag = m.lastgroup
+            if tag not in self.tags:
+                #a named group inside a pattern
+                tag = next(t for t in self.tags if m.group(t) is not None)
+            if m.end() > m.start():
+                out.setdefault(tag,[]).append((m.start(),m.end()))
+        return out
+    def text(self):
+        #one rule per line: color scope pattern
+        return ''.join('{} {} {}\n'.format(r['color'].replace(' ','_'),r.get('scope','match'),
+                r['pattern']) for r in self.rules)
+    def parse(self,text):
+        #rules from text(), raises ValueError
+        rules = []
+        for n,line in enumerate(text.split('\n'),1):
+            if not line.strip() or line.lstrip().startswith('#'):
+                continue
+            parts = line.strip().split(None,2)
+            if len(parts) < 3 or parts[1] not in self.scopes:
+                raise ValueError('line {:d}: expected color line|match pattern'.format(n))
+            rules.append({'color':parts[0].replace('_',' '),'scope':parts[1],'pattern':parts[2]})
+        return rules
 
 
 class pycom_tk(tk.Frame):
-    
-    def __init__(self,parent=None,data_from_device_q=None):
+    display_modes = byte_format.display_modes + ('VT100',)
+
+    def __init__(self,parent=None,data_from_device_q=None,data_to_device_q=None):
         #tk.Frame.__init__(self,parent)
         tk.Frame.__init__(self,parent)
         self.root = parent
@@ -73,6 +266,41 @@ class pycom_tk(tk.Frame):
         self.grid_rowconfigure(0, weight=1) # resizable main frame
         self.grid_columnconfigure(0, weight=1) # resizable main frame
         self.data_from_device_q = data_from_device_q # queue; bytes from device are writtem there
+        self.data_to_device_q = data_to_device_q # queue; str or bytes put there are sent to the device
+        self.display_pending = collections.deque() # (tag,bytes,time) waiting to be shown in the textarea
+        #the engine does all the port I/O, on_rx and on_sent are called from its threads
+        self.engine = serial_engine(data_from_device_q,data_to_device_q,
+                on_rx=lambda l: self.display_pending.append(('rxtext',l,time.monotonic())),
+                on_sent=self.tx_sent)
+        self.engine.detect_nl = False # display() feeds engine.rx_nl
+        self.tx_nl = stepcomm_engine.newline_state() # newline state of the TX echo
+        self.frame_ms = 20 # display frame time, textarea scrolling is coalesced to this rate
+        self.poll_min_ms = 10 # port_in interval while there is traffic
+        self.poll_max_ms = 200 # port_in interval it backs off to when idle
+        self.poll_budget_ms = 8 # most time one port_in tick spends reading the port
+        self.poll_ms = self.poll_min_ms
+        self.port_in_id = None # after() id of the next port_in tick
+        self.see_pending = False
+        self.scrollback = tk.IntVar() # max lines kept in the textarea, 0 for no limit
+        self.scrollback.set(10000)
+        self.display_mode = tk.StringVar() # TEXT, or one of the byte_format modes
+        self.display_mode.set('TEXT')
+        self.byte_fmt = {'rxtext':byte_format(),'txtext':byte_format()}
+        self.history = text_history() # text trimmed off the top of the textarea
+        self.search = stepcomm_search.search_index() # index of all the text shown
+        self.trimmed_lines = 0 # lines trimmed off the top, line 1 is this index line
+        self.search_query = None # stepcomm_search.search_query of the last search
+        self.search_key = None # (text,regex,case) it was made from
+        self.search_hit = None # (offset,length) of the current match
+        self.search_view_pending = False
+        self.highlight = highlight_rules(highlight_rules.defaults)
+        self.vt = None # stepcomm_vt.vt_screen of the VT100 display mode
+        self.vt_tags = set() # style ids with a tag configured for the current screen
+        self.vt_bold = None # font for bold text
+        self.livecap = tk.IntVar() # Capture button starts a live capture instead of a dump
+        self.cap_fsync = 0 # seconds between fsync calls of a live capture, 0 for never
+        self.cap_rotate_mb = 0 # start a new live capture file at this size, 0 for never
+        self.cap_rotate_min = 0 # start a new live capture file at this age, 0 for never
 
 
         #####################################
@@ -115,7 +343,12 @@ Use the settings menu to select bring up additional options
   at the bottom of the window. Settings include port, cap/send, and options.
 Port options allow you to control serial port settings.
 cap/send options let you capture data, or send common commands or files.
-options menu allows you to change the way things are displayed."""
+options menu allows you to change the way things are displayed.
+A macro starting with a line @script is a script, see stepcomm_macro.py
+  for send, wait, delay, repeat and include.
+Ctrl+Shift+F searches everything shown, F3 and Shift+F3 go to older and newer matches.
+Settings, Highlight colors received lines or words matching your own regexes.
+Display VT100 in the options is a terminal screen for full screen programs and menus."""
         #####################################
         ##         global variables        ##
         #####################################
@@ -132,21 +365,15 @@ options menu allows you to change the way things are displayed."""
         self.rows = 40
         self.cols = 80
 
-        self.parity_strings = ('NONE','EVEN','ODD','MARK','SPACE')
-        self.bauds=('300','600','1200','2400','4800','9600','14400','19200',
-            '28800','38400','57600','115200','230400','46800')
-        self.parity_consts= (serial.PARITY_NONE,serial.PARITY_EVEN,serial.PARITY_ODD,
-                        serial.PARITY_MARK,serial.PARITY_SPACE)
-        self.databit_strings=('5','6','7','8')
-        self.databit_consts=(serial.FIVEBITS,serial.SIXBITS,serial.SEVENBITS,serial.EIGHTBITS)
-        self.stopbit_strings=('1','1.5','2')
-        self.stopbit_consts=(serial.STOPBITS_ONE,serial.STOPBITS_ONE_POINT_FIVE,serial.STOPBITS_TWO)
+        self.parity_strings = stepcomm_engine.parity_strings
+        self.bauds = stepcomm_engine.bauds
+        self.databit_strings = stepcomm_engine.databit_strings
+        self.stopbit_strings = stepcomm_engine.stopbit_strings
         self.echo = tk.StringVar()
-        self.comport = serial.Serial()
         #self.newline_file = '\r\n'
         #self.newline_tx = '\r\n'
         #self.newline_rx = '\r\n'
-        self.nl_styles = ('WINDOWS','UNIX   ','OLD MAC','AUTO   ')
+        self.nl_styles = stepcomm_engine.nl_styles
         self.nl_desc = (r'NL=\r\n',r'NL=\n',r'NL=\r','Mimic RX')
         #self.rxnl=tk.StringVar()
         #self.rxnl.set(self.nl_styles[0])
@@ -158,10 +385,7 @@ options menu allows you to change the way things are displayed."""
         #self.txnlcr.set(1)
         #self.txnllf = tk.IntVar()
         #self.txnllf.set(1)
-        self.txnl_autostyle = "WINDOWS"
         #self.txnl_lastchar.set('NO')
-        self.txnl_ignore = ' '
-        self.rxnl_ignore = ' '
         self.send_cnt = 4
         self.send_text = [tk.StringVar() for i in range(self.send_cnt)]
         self.send_hist = [[""] for i in range(self.send_cnt)]
@@ -170,13 +394,23 @@ options menu allows you to change the way things are displayed."""
         self.macro_sel = tk.IntVar()
         self.macro_sel.set(1)
         self.macro_oldsel = self.macro_sel.get()
+        #@script macros are compiled once per slot, and run by a macro_runner thread
+        self.macros = stepcomm_macro.macro_library(lambda i: self.macro_text[i-1])
+        self.macro_run = None
         self.txfilename = tk.StringVar()
         self.rxfilename = tk.StringVar()
         #self.cap_file = [tk.StringVar() for i in range(self.send_cnt)]
         self.char_delay = tk.IntVar()
         self.line_delay = tk.IntVar()
-        self.txbuf = ''
-        self.txptr = 0
+        self.tx_reported = None # job shown on the status bar by tx_tick
+        self.txbinary = tk.IntVar() # send files as raw bytes, no newline translation or echo
+        self.txmmap = False # read files to send through mmap instead of read()
+        self.encoding = tk.StringVar() # codec of the text sent and shown
+        self.encoding.set(self.engine.encoding)
+        self.rx_decoder = self.engine.decoder() # keeps split characters between reads
+        self.tx_decoder = self.engine.decoder() # for TX echo
+        self.show_perf = tk.IntVar() # perf counters on the status bar
+        self.perf_text = tk.StringVar()
         
 
         self.test_text = tk.StringVar()
@@ -208,6 +442,8 @@ options menu allows you to change the way things are displayed."""
         menu.add_radiobutton(label="Port Settings",command=self.show_porttab)
         menu.add_radiobutton(label="Cap/Send Settings",command=self.show_sendtab)
         menu.add_radiobutton(label="Options",command=self.show_opttab)
+        menu.add_radiobutton(label="Search",command=self.show_searchtab)
+        menu.add_radiobutton(label="Highlight",command=self.show_hltab)
 
         #help menu
         menu = tk.Menu(self.menubar, tearoff=0)
@@ -230,6 +466,18 @@ options menu allows you to change the way things are displayed."""
         self.textarea.tag_configure('txtext',foreground=self.txcolor)
         self.textarea.tag_configure('rxtext',foreground=self.rxcolor)
         self.textarea.bind('<Key>', lambda e: self.typed_char(e))
+        #Ctrl+F is left to the device, the shifted one opens the search panel
+        self.textarea.bind('<Control-F>', lambda e: self.show_searchtab() or 'break')
+        self.textarea.bind('<F3>', lambda e: self.search_step(False) or 'break')
+        self.textarea.bind('<Shift-F3>', lambda e: self.search_step(True) or 'break')
+        self.text_font = font.Font(font=self.textarea['font']) # for the line height
+        self.set_highlight_tags()
+        self.textarea.tag_configure('searchhit',background='yellow')
+        self.textarea.tag_configure('searchcur',background='orange')
+        self.textarea.tag_configure('vtcursor',background=self.rxcolor,foreground=self.bgcolor)
+        #repaint the highlights when the view moves
+        self.textarea.configure(yscrollcommand=lambda *a: (self.textarea.vbar.set(*a),
+                self.search_view_changed()))
 
 
         #self.textframe = tk.Frame(self, bg=self.bgcolor, 
@@ -251,7 +499,13 @@ options menu allows you to change the way things are displayed."""
         #create a control frame for holding all the port controls
         self.port_frame = tk.Frame(self,height=10,bg=self.bordcolor,bd=5)
         self.port_frame.grid(row=1,column=0,sticky=S+E+W)
-        self.comslist = [a[0] for a in comports()]
+        #the port list comes from the watcher thread, through ports_pending and ports_tick
+        self.comslist = []
+        self.ports_pending = collections.deque()
+        self.ports_first = True # the first list picks a port if there is none yet
+        self.port_watch = stepcomm_engine.port_watcher()
+        self.port_watch.subscribers.append(self.ports_pending.append)
+        self.port_watch.start()
         self.port_label=tk.Label(self.port_frame,text="Port",bg=self.bordcolor,)
         self.port_label.grid(row=0,column=0,sticky=W)
         self.port_combo=ttk.Combobox(self.port_frame,width=12,
@@ -401,7 +655,7 @@ options menu allows you to change the way things are displayed."""
         self.macro_spin.grid_columnconfigure(0, weight = 1)
         self.macro_btn = tk.Button(self.send_frame,width=4,height=1,bg="snow",
                 text='Send',font=self.controlFont, 
-                command = lambda: self.stringout(self.macroedit.get(1.0,END),1))
+                command = self.macro_send)
         self.macro_btn.grid(row=0,column=6,sticky=tk.W)
         self.macroedit = tkst.ScrolledText(self.send_frame, width=40,height=6)
         self.macroedit.grid(row=1,column=4,rowspan=3,columnspan=4,sticky=N+E+S+W)
@@ -426,6 +680,17 @@ options menu allows you to change the way things are displayed."""
                 text='Send',font=self.controlFont,
                 command = self.txsendfile)
         self.txsend_btn.grid(row=0,column=3,padx=4)
+        self.txbinary_cbox = tk.Checkbutton(self.csfile_frame,variable=self.txbinary,
+                text="Binary",bg=self.bordcolor,font=self.controlFont)
+        self.txbinary_cbox.grid(row=1,column=1,sticky=tk.W)
+        self.txpause_btn = tk.Button(self.csfile_frame,width=6,height=1,bg="snow",
+                text='Pause',font=self.controlFont,
+                command = self.txpause)
+        self.txpause_btn.grid(row=1,column=2,padx=4)
+        self.txcancel_btn = tk.Button(self.csfile_frame,width=6,height=1,bg="snow",
+                text='Cancel',font=self.controlFont,
+                command = self.txcancel)
+        self.txcancel_btn.grid(row=1,column=3,padx=4)
         tk.Frame(self.csfile_frame,width=20,bg=self.bordcolor).grid(row=0,column=4,
                 sticky=E+W)        
 
@@ -439,6 +704,9 @@ options menu allows you to change the way things are displayed."""
                 text='Capture',font=self.controlFont,
                 command = self.rxbrowse)
         self.rxcap_btn.grid(row=0,column=7,padx=4)
+        self.livecap_cbox = tk.Checkbutton(self.csfile_frame,variable=self.livecap,
+                text="Live",bg=self.bordcolor,font=self.controlFont)
+        self.livecap_cbox.grid(row=0,column=8,sticky=tk.W)
         #self.rxcap_btn = tk.Button(self.csfile_frame,width=6,height=1,bg="snow",
         #        text='Capture',font=self.controlFont,
         #        command = self.rxcapfile)
@@ -455,7 +723,78 @@ options menu allows you to change the way things are displayed."""
         #self.opt_frame = tk.Frame(self,height=10,width=300,bg=self.bordcolor)
         self.opt_frame = tk.Frame(self,height=20,bg=self.bordcolor)
         self.opt_frame.grid(row=1,column=0,sticky=S+E+W)
-        
+        tk.Label(self.opt_frame,text="Scrollback lines",
+                bg=self.bordcolor,font=self.controlFont).grid(row=0,column=0,sticky=W)
+        self.scrollback_spin=tk.Spinbox(self.opt_frame,bg="snow",width=7,
+                from_=0,to=1000000,increment=1000,textvariable=self.scrollback)
+        self.scrollback_spin.grid(row=0,column=1,sticky=W)
+        tk.Label(self.opt_frame,text="Display",
+                bg=self.bordcolor,font=self.controlFont).grid(row=0,column=2,sticky=W,padx=(10,0))
+        self.display_combo = ttk.Combobox(self.opt_frame,width=10,state='readonly',
+                textvariable=self.display_mode,values=self.display_modes)
+        self.display_combo.grid(row=0,column=3,sticky=W)
+        self.display_combo.bind('<<ComboboxSelected>>',self.set_display_mode)
+        tk.Label(self.opt_frame,text="Encoding",
+                bg=self.bordcolor,font=self.controlFont).grid(row=0,column=4,sticky=W,padx=(10,0))
+        self.encoding_combo = ttk.Combobox(self.opt_frame,width=10,textvariable=self.encoding,
+                values=('utf-8','latin-1','ascii','cp437','cp1252','utf-16-le','shift_jis','gb18030'))
+        self.encoding_combo.grid(row=0,column=5,sticky=W)
+        self.encoding_combo.bind('<<ComboboxSelected>>',self.set_encoding)
+        self.encoding_combo.bind('<Return>',self.set_encoding)
+        tk.Checkbutton(self.opt_frame,variable=self.show_perf,text="Perf counters",
+                bg=self.bordcolor,font=self.controlFont,
+                command=self.set_show_perf).grid(row=0,column=6,sticky=W,padx=(10,0))
+        tk.Label(self.opt_frame,text="Frames",
+                bg=self.bordcolor,font=self.controlFont).grid(row=1,column=0,sticky=W)
+        self.frames_combo = ttk.Combobox(self.opt_frame,width=10,state='readonly',
+                values=stepcomm_frames.decoder_names)
+        self.frames_combo.set('NONE')
+        self.frames_combo.grid(row=1,column=1,sticky=W)
+        self.frames_combo.bind('<<ComboboxSelected>>',self.set_frames)
+
+        #################################
+        ##        Search Panel         ##
+        #################################
+        self.search_frame = tk.Frame(self,height=20,bg=self.bordcolor)
+        self.search_frame.grid(row=1,column=0,sticky=S+E+W)
+        self.search_text = tk.StringVar()
+        self.search_regex = tk.IntVar()
+        self.search_case = tk.IntVar()
+        tk.Label(self.search_frame,text="Search",
+                bg=self.bordcolor,font=self.controlFont).grid(row=0,column=0,sticky=W)
+        self.search_entry = tk.Entry(self.search_frame,width=40,
+                font=self.controlFont,textvariable=self.search_text)
+        self.search_entry.grid(row=0,column=1,sticky=W)
+        self.search_entry.bind('<Return>',lambda e: self.search_step(True))
+        self.search_entry.bind('<Shift-Return>',lambda e: self.search_step(False))
+        tk.Checkbutton(self.search_frame,variable=self.search_regex,text="Regex",
+                bg=self.bordcolor,font=self.controlFont).grid(row=0,column=2,sticky=W)
+        tk.Checkbutton(self.search_frame,variable=self.search_case,text="Case",
+                bg=self.bordcolor,font=self.controlFont).grid(row=0,column=3,sticky=W)
+        tk.Button(self.search_frame,width=6,height=1,bg="snow",text='Older',
+                font=self.controlFont,command=lambda: self.search_step(True)).grid(row=0,column=4,padx=4)
+        tk.Button(self.search_frame,width=6,height=1,bg="snow",text='Newer',
+                font=self.controlFont,command=lambda: self.search_step(False)).grid(row=0,column=5,padx=4)
+        self.search_lab = tk.Label(self.search_frame,text="",anchor=W,
+                bg=self.bordcolor,font=self.controlFont)
+        self.search_lab.grid(row=0,column=6,sticky=W)
+
+        #################################
+        ##       Highlight Panel       ##
+        #################################
+        self.hl_frame = tk.Frame(self,height=20,bg=self.bordcolor)
+        self.hl_frame.grid(row=1,column=0,sticky=S+E+W)
+        self.hl_frame.grid_columnconfigure(1, weight = 1)
+        tk.Label(self.hl_frame,text="Rules\ncolor line|match regex",justify=LEFT,
+                bg=self.bordcolor,font=self.controlFont).grid(row=0,column=0,sticky=N+W)
+        self.hledit = tkst.ScrolledText(self.hl_frame, width=60,height=5)
+        self.hledit.grid(row=0,column=1,rowspan=2,sticky=E+W)
+        self.hledit.insert("1.0",self.highlight.text())
+        tk.Button(self.hl_frame,width=6,height=1,bg="snow",text='Apply',
+                font=self.controlFont,command=self.apply_highlight).grid(row=0,column=2,padx=4,sticky=N)
+        tk.Button(self.hl_frame,width=6,height=1,bg="snow",text='Defaults',
+                font=self.controlFont,command=self.default_highlight).grid(row=1,column=2,padx=4,sticky=N)
+
 
         #################################
         ##         Status Line         ##
@@ -467,25 +806,81 @@ options menu allows you to change the way things are displayed."""
         self.status_lab = tk.Label(self.status_frame,textvariable=self.status_text,
                 justify=LEFT,bg=self.bordcolor,font=self.screenFont)
         self.status_lab.pack(fill=X,expand=True,side=BOTTOM)
+        self.perf_lab = tk.Label(self.status_frame,textvariable=self.perf_text,anchor=W,
+                justify=LEFT,bg=self.bordcolor,font=self.screenFont)
         #parse the command line arguments to see if an init file was passed
         ##########################################
         ##     Command Line Argument Parsing    ##
         ##########################################
         parser = argparse.ArgumentParser(description='StepComm - Simple Terminal Emulator in Python')
-        parser.add_argument('-b','--baud', help='baud rate',choices=self.bauds)
-        parser.add_argument('-p','--port', help='port name')
-        parser.add_argument('-e','--echo', help='echo ON or OFF')
-        parser.add_argument('-i','--ini', help='ini file name')
+        stepcomm_engine.add_arguments(parser)
+        parser.add_argument('-s','--scrollback', help='lines kept on screen, 0 for no limit',type=int)
+        parser.add_argument('--history', help='MB of trimmed text kept in memory',type=int)
+        parser.add_argument('--spill', help='keep trimmed text in a temp file instead of memory',
+                action='store_true')
+        parser.add_argument('-d','--display', help='how received data is shown',
+                choices=self.display_modes)
+        parser.add_argument('--perf', help='show the perf counters on the status bar',
+                action='store_true')
+        parser.add_argument('--poll-min-ms', help='port polling interval with traffic',type=int)
+        parser.add_argument('--poll-max-ms', help='port polling interval when idle',type=int)
         args = parser.parse_args()
         if args.ini != None:
             print(f'ini file is {args.ini}')
             self.fileparse(args.ini)
         #command line options override the ini file
+        if args.scrollback != None:
+            self.scrollback.set(args.scrollback)
+        if args.display != None:
+            self.display_mode.set(args.display)
+            self.set_display_mode()
+        if args.encoding != None:
+            self.encoding.set(args.encoding)
+            self.set_encoding()
+        if args.history != None or args.spill:
+            self.history.close()
+            self.history = text_history(max_chars=(args.history or 64)*1024*1024,spill=args.spill)
+        if args.rxthread:
+            self.engine.set_rxthread(True)
+        if args.mmap:
+            self.txmmap = True
+        if args.capsync != None:
+            self.cap_fsync = args.capsync
+        if args.caprotate_mb != None:
+            self.cap_rotate_mb = args.caprotate_mb
+        if args.caprotate_min != None:
+            self.cap_rotate_min = args.caprotate_min
+        if args.capture != None:
+            self.rxfilename.set(args.capture)
+            self.livecap.set(1)
+            self.start_capture()
+        if args.eventlog != None:
+            try:
+                self.engine.start_eventlog(args.eventlog)
+            except OSError:
+                self.status('failed to open event log ' + args.eventlog)
+        if args.perflog != None:
+            try:
+                self.engine.perf.hooks.append(stepcomm_engine.perf_logger(args.perflog))
+            except OSError:
+                self.status('failed to open perf log ' + args.perflog)
+        if args.frames != None:
+            self.frames_combo.set(args.frames)
+            self.set_frames()
+        if args.perf:
+            self.show_perf.set(1)
+        if args.poll_min_ms != None:
+            self.poll_min_ms = max(1,args.poll_min_ms)
+        if args.poll_max_ms != None:
+            self.poll_max_ms = args.poll_max_ms
+        self.poll_max_ms = max(self.poll_min_ms,self.poll_max_ms)
+        self.poll_ms = self.poll_min_ms
+        self.set_show_perf()
         if args.baud != None:
             self.baud_combo.delete(0,"end");self.baud_combo.insert(0,args.baud)
         if args.echo == 'ON' or args.echo == 'OFF':
-            print('setting echo to ' +  jdict['echo'] + ' due to command line argument')
-            self.echo.set(jdict['echo'])
+            print('setting echo to ' +  args.echo + ' due to command line argument')
+            self.echo.set(args.echo)
         if args.port != None:
             self.port_combo.set(args.port)
 
@@ -493,19 +888,19 @@ options menu allows you to change the way things are displayed."""
         ##         Finish Init         ##
         #################################
         self.hide_tabs()
-        self.scan_port('<Double-Button-1>')
-        if len(self.comslist) == 0:
-            self.port_combo.set("")
-        elif self.port_combo.get() not in self.comslist:
-            self.port_combo.set(self.comslist[0])
-        self.root.after(50, self.set_port)
-        self.root.after(100, self.port_in)
+        if self.port_combo.get():
+            self.root.after(50, self.set_port)
+        self.root.after(100, self.ports_tick)
+        self.port_in_id = self.root.after(100, self.port_in)
+        self.root.after(250, self.tx_tick)
+        self.root.after(1000, self.perf_tick)
         self.root.protocol("WM_DELETE_WINDOW", self.exitapp)
         
         #self.helpabout()
     def status(self,t):
         self.status_text.set(t)
     def update_newline(self,a):
+        self.engine.txnl = self.txnl.get()
         #t=self.nl_desc[self.nl_styles.index(self.txnl.get())]
         #print("update_newline TX is {:s}".format(t))
         self.txnlos_lab.configure(text=self.nl_desc[self.nl_styles.index(self.txnl.get())])
@@ -515,6 +910,8 @@ options menu allows you to change the way things are displayed."""
     def hide_tabs(self):
         #print("Hide all tabs")
         self.opt_frame.grid_remove()
+        self.search_frame.grid_remove()
+        self.hl_frame.grid_remove()
         self.capsend_frame.grid_remove()
         self.port_frame.grid_remove()
         #self.update()
@@ -535,70 +932,158 @@ options menu allows you to change the way things are displayed."""
         self.opt_frame.grid()
         self.update()
         #print("show options tab")
+    def show_searchtab(self):
+        self.hide_tabs()
+        self.search_frame.grid()
+        self.search_entry.focus_set()
+        self.search_entry.select_range(0,END)
+    def show_hltab(self):
+        self.hide_tabs()
+        self.hl_frame.grid()
     def txbrowse(self):
         fname = filedialog.askopenfilename(title='Select file to send',filetypes = (("text files","*.txt"),("all files","*.*")))
         if fname != '':
             self.txfilename.set(fname)
             print ('TX browse got {:s}'.format(fname))
     def txsendfile(self):
+        #the file is streamed from disk by the transmit engine, tx_tick reports when it is done
         try:
-            file = open(self.txfilename.get(), 'r') 
-            str = file.read()
-            file.close()
-            print('file is {:d} chars long'.format(len(str)))
-            self.status("sending file{:s}".format(self.txfilename.get()))
-            self.stringout(str,1)
-            self.status("sent file {:s}".format(self.txfilename.get()))
-        except:
+            cd = self.char_delay.get()
+            ld = self.line_delay.get()
+        except tk.TclError:
+            cd = ld = 0 # spinbox is being edited
+        if not self.engine.comport.is_open:
+            self.status("port not open, file not sent")
+            return
+        try:
+            job = self.engine.send_file(self.txfilename.get(),binary=self.txbinary.get(),
+                    use_mmap=self.txmmap,char_delay=cd/1000,line_delay=ld/1000)
+        except OSError:
             self.status("Failed to open file{:s}".format(self.txfilename.get()))
+            return
+        print('file is {:d} bytes long'.format(job.total))
+        self.status("sending file{:s}".format(self.txfilename.get()))
+        self.poll_soon()
+    def txpause(self):
+        if self.engine.tx.running.is_set():
+            self.engine.tx.pause()
+            self.txpause_btn.configure(text='Resume')
+        else:
+            self.engine.tx.resume()
+            self.txpause_btn.configure(text='Pause')
+    def txcancel(self):
+        self.engine.tx.cancel()
+        self.txpause_btn.configure(text='Pause')
     def rxbrowse(self):
+        if self.engine.capture is not None:
+            self.stop_capture()
+            return
         fname = filedialog.asksaveasfilename(title='Select capture file',initialdir ='.',filetypes = (("text files","*.txt"),("all files","*.*")))
         if fname != '':
             self.rxfilename.set(fname)
             print ('Capture browse got {:s}'.format(fname))
+        if self.livecap.get():
+            self.start_capture()
+            return
         try:
+            #trimmed scrollback first, then what is still on the screen
             file = open(self.rxfilename.get(), 'w')
+            self.history.write_to(file)
             str = self.textarea.get(1.0, END)
             file.write(str)
+            size = self.history.size + len(str)
             file.close()
-            print(f'captured file {self.rxfilename.get()}, wrote {len(str)} bytes')
-            self.status(f'captured file {self.rxfilename.get()}, wrote {len(str)} bytes')
+            print(f'captured file {self.rxfilename.get()}, wrote {size} bytes')
+            self.status(f'captured file {self.rxfilename.get()}, wrote {size} bytes')
         except:
             self.status("Failed to write capture file ")
+    def start_capture(self):
+        #live capture, every raw byte read from the port is appended to the capture file
+        try:
+            self.engine.start_capture(self.rxfilename.get(),fsync_s=self.cap_fsync,
+                    rotate_bytes=self.cap_rotate_mb*1024*1024,rotate_s=self.cap_rotate_min*60)
+        except OSError:
+            self.status("Failed to open capture file {:s}".format(self.rxfilename.get()))
+            return
+        self.rxcap_btn.configure(text='Stop')
+        self.status('live capture to {:s}'.format(self.rxfilename.get()))
+    def stop_capture(self):
+        cap = self.engine.stop_capture()
+        self.rxcap_btn.configure(text='Capture')
+        if cap.error:
+            self.status('live capture to {:s} failed: {}'.format(cap.filename,cap.error))
+        else:
+            self.status('captured file {:s}, wrote {:d} bytes'.format(cap.filename,cap.written))
     def set_port(self):
 
         port = self.port_combo.get()
         bs = self.baud_combo.get()
-        bv = int(bs)
         ps = self.parity_combo.get()
-        pv = self.parity_consts[self.parity_strings.index(ps)]
         ds = self.databits_combo.get()
-        dv = self.databit_consts[self.databit_strings.index(ds)]
         ss = self.stopbits_combo.get()
-        sv = self.stopbit_consts[self.stopbit_strings.index(ss)]
         print('port settings are now {:s},{:s},{:s},{:s},{:s}'.format(
                     port,bs,ps,ds,ss))
         sys.stdout.flush()
-        if self.comport.is_open:
-            self.comport.close()
         try:
-            self.comport = serial.Serial(port=port,baudrate=bv,bytesize=dv,
-                    stopbits=sv, parity=pv, timeout=0, write_timeout=0.2)
+            self.engine.open(port,bs,ps,ds,ss)
             self.status('port {:s},{:s},{:s},{:s},{:s}'.format(port,bs,ps,ds,ss))
         except:
             self.status("Failed to open port '{:s}'".format(self.port_combo.get()))
     def scan_port(self,event):
-        #get a fresh list of comports every time the port is updated
-        self.comslist = [a[0] for a in comports()]
+        #ask the watcher for a fresh list, ports_tick shows it when it's done
+        self.port_watch.refresh()
+        self.status("Scanning ports...")
+    def ports_tick(self):
+        #take the newest list from the port watcher, if it sent one
+        if self.ports_pending:
+            ports = self.ports_pending.pop()
+            self.ports_pending.clear()
+            self.ports_changed(ports)
+        self.root.after(250,self.ports_tick)
+    def ports_changed(self,ports):
+        self.comslist = ports
         self.port_combo.configure(values=self.comslist)
         if len(self.comslist) == 0:
             self.status("No Serial Ports Found!")
         else:
             self.status("Found ports: {}".format(', '.join(map(str, self.comslist))))
+        if self.ports_first:
+            #startup: open the first port found unless one was given that exists
+            self.ports_first = False
+            if self.comslist and self.port_combo.get() not in self.comslist:
+                self.port_combo.set(self.comslist[0])
+                self.set_port()
     def set_portparm(self,e):
         self.set_port()
     def clrscr(self):
        self.textarea.delete(1.0,END)
+       self.history.clear()
+       self.search.clear()
+       self.trimmed_lines = 0
+       self.search_hit = None
+       for fmt in self.byte_fmt.values():
+           fmt.commit()
+       if self.vt is not None:
+           #a blank area for the screen, which is redrawn as it is
+           self.textarea.insert(tk.END,'\n'*(self.vt.rows - 1))
+           self.vt.dirty.update(range(self.vt.rows))
+    def trim_scrollback(self):
+        #move lines past the scrollback limit from the top of the textarea to the history.
+        # Trimming waits for a batch of extra lines so the cost is spread over many inserts
+        try:
+            limit = self.scrollback.get()
+        except tk.TclError:
+            return # spinbox is being edited
+        if limit <= 0:
+            return
+        if self.vt is not None:
+            limit = max(limit,self.vt.rows) # never trim the screen
+        lines = int(self.textarea.index('end-1c').split('.')[0])
+        if lines > limit + max(100,limit//10):
+            cut = '{:d}.0'.format(lines - limit + 1)
+            self.history.append(self.textarea.get('1.0',cut))
+            self.textarea.delete('1.0',cut)
+            self.trimmed_lines += lines - limit
     def send_btnsel (self,i):
         t=self.send_text[i].get()
         s=self.send_snl[i].get()
@@ -623,67 +1108,340 @@ options menu allows you to change the way things are displayed."""
         self.macroedit.delete("1.0", END) 
         self.macroedit.insert("1.0",self.macro_text[self.macro_sel.get()-1])
     def port_in(self):
-        if self.comport.isOpen():
-            inlen = self.comport.in_waiting
-            if inlen > 0:
-                l = self.comport.read(inlen)
-                # write bytes from device to other thread(s)
-                if l is not None and len(l) > 0 and self.data_from_device_q:
-                    try:
-                        self.data_from_device_q.put_nowait(l)
-                    except queue.Full:
-                        print('data_from_device_q full: {} bytes dropped'.format(len(l)))
-                # write bytes from device to the screen
-                #print(f'port_in: l type={type(l)},len={len(l)}')
-                for c in l:
-                    #print('port_in: char = {:02x}, rxnl style is {:s}'.format(ord(c),self.rxnl.get())) 
-                    #print(f'port_in: c type={type(c)},c={c:x}="{chr(c)}"')
-                    if c == b'\l' :
-                        #print('CHAR=LF')
-                        if self.rxnl_ignore=='LF':
-                            #print('{} LF, ignored LF'.format(self.rxnl.get()))
-                            self.rxnl_ignore = ' '
-                            self.txnl_autostyle = "WINDOWS"  #save auto txnl style
-                        else:
-                            #print('{} LF, used LF'.format(self.rxnl.get())
-                            self.textarea.insert(tk.END, "\n",'rxtext')
-                            self.rxnl_ignore = 'CR'                    
-                    elif c == b'\r':
-                        if self.rxnl_ignore=='CR':
-                            #print('{} CR, ignored CR'.format(self.rxnl.get()))
-                            self.rxnl_ignore = ' '
-                            self.txnl_autostyle = "WINDOWS"  #save auto txnl style
-        
-                        else:
-                            self.textarea.insert(tk.END, "\n",'rxtext')
-                            #print('{} CR, used CR'.format(self.rxnl.get()))
-                            self.rxnl_ignore = 'LF'
-                    elif c == b'\b':
-                        #print('RX CHAR=BS')
-                        self.rxnl_ignore = ' '
-                        try:
-                            prevtagchar = self.textarea.index("rxtext.last-1c")
-                            #print('last rxchar at {}'.format(prevtagchar))
-                            #print('last char ascii is "{}"'.format(self.textarea.get(prevtagchar)))
-                            #print('delete ascii char{} at index {}'.format(ord(self.textarea.get(prevtagchar)),prevtagchar))
-                            self.textarea.delete(prevtagchar)
-                        except tk.TclError:
-                            pass
-                            #print('no RX text to backspace over')
-                    else:
-                        #print('port_in = ASCII {:x}'.format(ord(c)))
-                        char = chr(c)
-                        self.textarea.insert(tk.END, char,'rxtext')
-                        #record the auto detected TX NL style
-                        if self.rxnl_ignore == 'CR':
-                            self.txnl_autostyle = "OLD MAC"
-                        elif self.rxnl_ignore == 'LF':
-                            self.txnl_autostyle = "UNIX   "
-                        self.rxnl_ignore = ' '
-                self.textarea.see("end")
-        self.root.after(10,self.port_in)
+        start = time.monotonic()
+        got = 0
+        try:
+            got = self.engine.poll(self.poll_budget_ms/1000)
+        except (serial.SerialException,OSError):
+            self.status('port read failed')
+        busy = got or self.display_pending or self.engine.tx.job is not None or \
+                self.macro_run is not None
+        if self.display_pending:
+            perf = self.engine.perf
+            mark = self.textarea.index('end-1c linestart')
+            while self.display_pending:
+                tag,l,t = self.display_pending.popleft()
+                self.display(tag,l)
+                perf.render(time.monotonic() - t)
+            if self.vt is not None:
+                self.vt_paint()
+            else:
+                self.highlight_from(mark)
+            self.trim_scrollback()
+        self.engine.perf.tick(time.monotonic() - start)
+        if busy:
+            self.poll_ms = self.poll_min_ms
+        else:
+            self.poll_ms = min(self.poll_max_ms,self.poll_ms*2)
+        self.port_in_id = self.root.after(self.poll_ms,self.port_in)
         #self.after(100,self.port_in)
+    def poll_soon(self):
+        #something is about to happen, don't wait out a long idle interval
+        if self.poll_ms > self.poll_min_ms and self.port_in_id is not None:
+            self.root.after_cancel(self.port_in_id)
+            self.poll_ms = self.poll_min_ms
+            self.port_in_id = self.root.after(self.poll_min_ms,self.port_in)
+    def display(self,tag,l):
+        # write bytes from or to the device to the screen, tag is 'rxtext' or 'txtext'
+        #the newline state splits the chunk into runs of text with the newlines already
+        # collapsed, each run is inserted with one call, only a backspace forces a flush
+        mode = self.display_mode.get()
+        if self.vt is not None:
+            if isinstance(l,stepcomm_frames.frame):
+                l = stepcomm_frames.frame_bytes(l)[:-1] + b'\r\n'
+            decoder = self.rx_decoder if tag == 'rxtext' else self.tx_decoder
+            self.vt.feed(decoder.decode(l))
+            return
+        if isinstance(l,stepcomm_frames.frame):
+            #a frame from the frame decoder gets a line of its own
+            if mode != 'TEXT':
+                self.display_bytes(mode,tag,l)
+                end = self.byte_fmt[tag].commit() or ('\n' if mode == 'RAW' else '')
+                self.textarea.insert(tk.END,end,tag)
+                self.search.append(end)
+                self.see_end()
+                return
+            l = stepcomm_frames.frame_bytes(l)
+        elif mode != 'TEXT':
+            self.display_bytes(mode,tag,l)
+            self.see_end()
+            return
+        if tag == 'rxtext':
+            #the decoder holds back the start of a character split across reads
+            runs = self.engine.rx_nl.feed(self.rx_decoder.decode(l))
+        else:
+            runs = self.tx_nl.feed(self.tx_decoder.decode(l))
+        for run in runs:
+            if run == '\b':
+                try:
+                    prevtagchar = self.textarea.index(tag + ".last-1c")
+                    at_end = self.textarea.compare(prevtagchar,'==','end-2c')
+                    self.textarea.delete(prevtagchar)
+                    if not (at_end and self.search.retract(1)):
+                        self.search_resync(prevtagchar)
+                except tk.TclError:
+                    pass
+                    #print('no text to backspace over')
+            else:
+                self.textarea.insert(tk.END, run,tag)
+                self.search.append(run)
+        self.see_end()
+    def display_bytes(self,mode,tag,l):
+        #HEX, HEX+ASCII and RAW modes. RX and TX each have a byte_format, the partial line
+        # of one direction is closed when data of the other one shows up
+        other = 'txtext' if tag == 'rxtext' else 'rxtext'
+        end = self.byte_fmt[other].commit()
+        if end:
+            self.textarea.insert(tk.END,end,other)
+            self.search.append(end)
+        fmt = self.byte_fmt[tag]
+        fmt.mode = mode
+        retract,text = fmt.format(l)
+        if retract:
+            start = self.textarea.index('end-{:d}c'.format(retract + 1))
+            self.textarea.delete(start,'end-1c')
+            if not self.search.retract(retract):
+                self.search_resync(start)
+        self.textarea.insert(tk.END,text,tag)
+        self.search.append(text)
+    def search_resync(self,index):
+        #the textarea changed at index, not just at its end: the search index is taken
+        # back to the start of that line and the widget text from there added again. If
+        # that line is gone from the index it is built again from the textarea alone
+        row = int(self.textarea.index(index).split('.')[0])
+        start = self.search.line_offset(self.trimmed_lines + row - 1)
+        if start is None or not self.search.truncate(start):
+            self.search.clear()
+            self.trimmed_lines = 0
+            self.search_hit = None
+            row = 1
+        self.search.append(self.textarea.get('{:d}.0'.format(row),'end-1c'))
+    def set_display_mode(self,event=None):
+        #close the partial lines, the new mode starts on a fresh line
+        if self.vt is not None:
+            self.vt_stop()
+        for tag,fmt in self.byte_fmt.items():
+            end = fmt.commit()
+            if end:
+                self.textarea.insert(tk.END,end,tag)
+                self.search.append(end)
+        if self.display_mode.get() == 'VT100':
+            self.vt_start()
+        self.see_end()
+    def vt_start(self):
+        #the screen takes the last rows lines of the textarea, starting on a fresh line
+        if not self.textarea.index('end-1c').endswith('.0'):
+            self.textarea.insert(tk.END,'\n')
+            self.search.append('\n')
+        self.vt = stepcomm_vt.vt_screen(self.rows,self.cols)
+        self.vt_tags = set()
+        self.textarea.insert(tk.END,'\n'*(self.rows - 1))
+        self.textarea.configure(wrap=tk.NONE)
+    def vt_stop(self):
+        #the screen stays as it is and the text that follows starts below it
+        self.vt_paint()
+        self.textarea.tag_remove('vtcursor','1.0',END)
+        top = int(self.textarea.index('end-1c').split('.')[0]) - self.vt.rows + 1
+        self.search.append(self.textarea.get('{:d}.0'.format(top),'end-1c') + '\n')
+        self.textarea.insert(tk.END,'\n')
+        self.textarea.configure(wrap=tk.WORD)
+        self.vt = None
+    def vt_paint(self):
+        #bring the last rows lines of the textarea up to date with the screen: lines
+        # that scrolled off are added above it, then only the changed lines are redrawn
+        scr = self.vt
+        scrolled,dirty = scr.take()
+        for reply in scr.replies:
+            self.stringout(reply,1)
+        scr.replies = []
+        rows = scr.rows
+        n = len(scrolled)
+        top = int(self.textarea.index('end-1c').split('.')[0]) - rows + 1
+        lines = []
+        args = []
+        for j,(chars,attrs,changed) in enumerate(scrolled):
+            runs = stepcomm_vt.row_runs(chars,attrs)
+            lines.append(''.join(t for t,a in runs))
+            if j < rows:
+                if changed:
+                    self.vt_line(top + j,runs)
+            else:
+                #never shown on the screen, a flood of lines in one tick goes in with one insert
+                args += ['\n','rxtext']
+                for t,a in runs:
+                    args += [t,self.vt_tag(a)]
+        if n > rows:
+            self.textarea.insert(tk.END,*args)
+        if n:
+            self.textarea.insert(tk.END,'\n'*min(n,rows))
+            self.search.append('\n'.join(lines) + '\n')
+        top += n
+        for y in dirty:
+            self.vt_line(top + y,scr.runs(y))
+        self.textarea.tag_remove('vtcursor','1.0',END)
+        if scr.cursor_visible:
+            line = top + scr.y
+            col = min(scr.x,scr.cols - 1)
+            end = int(self.textarea.index('{:d}.end'.format(line)).split('.')[1])
+            if end <= col:
+                self.textarea.insert('{:d}.end'.format(line),' '*(col + 1 - end))
+            self.textarea.tag_add('vtcursor','{:d}.{:d}'.format(line,col))
+        if n or dirty:
+            self.see_end()
+    def vt_line(self,line,runs):
+        self.textarea.delete('{:d}.0'.format(line),'{:d}.end'.format(line))
+        args = []
+        for t,a in runs:
+            args += [t,self.vt_tag(a)]
+        if args:
+            self.textarea.insert('{:d}.0'.format(line),*args)
+    def vt_tag(self,attr):
+        #the tag of a screen style, configured the first time it is used
+        if attr == 0:
+            return 'rxtext'
+        tag = 'vt{:d}'.format(attr)
+        if attr not in self.vt_tags:
+            fg,bg,bold,underline,reverse = self.vt.styles[attr]
+            fg = fg or self.rxcolor
+            if reverse:
+                fg,bg = bg or self.bgcolor,fg
+            if bold and self.vt_bold is None:
+                self.vt_bold = font.nametofont(self.textarea.cget('font')).copy()
+                self.vt_bold.configure(weight='bold')
+            self.textarea.tag_configure(tag,foreground=fg,background=bg or '',
+                    underline=underline,font=self.vt_bold if bold else '')
+            self.textarea.tag_raise('vtcursor')
+            self.vt_tags.add(attr)
+        return tag
+    def set_frames(self,event=None):
+        #received data is shown one frame per line, and queued as frames
+        self.engine.set_frames(self.frames_combo.get())
+        self.status('frames ' + self.engine.frames_name)
+    def set_encoding(self,event=None):
+        #new decoders, bytes of a character held by the old ones are dropped
+        try:
+            self.engine.set_encoding(self.encoding.get().strip())
+        except LookupError:
+            self.status('unknown encoding {}'.format(self.encoding.get()))
+            self.encoding.set(self.engine.encoding)
+            return
+        self.rx_decoder = self.engine.decoder()
+        self.tx_decoder = self.engine.decoder()
+        self.status('encoding ' + self.engine.encoding)
+    def see_end(self):
+        #scroll to the end at most once per display frame, no matter how many inserts
+        if not self.see_pending:
+            self.see_pending = True
+            self.root.after(self.frame_ms,self.see_flush)
+    def see_flush(self):
+        self.see_pending = False
+        self.textarea.see("end")
+    def highlight_from(self,mark):
+        #apply the highlight rules to the text from the start of line mark to the end,
+        # skipping what already scrolled off the screen when a lot came in at once
+        if self.highlight.regex is None:
+            return
+        rows = self.textarea.winfo_height()//max(1,self.text_font.metrics('linespace')) + 1
+        first = self.textarea.index('end-1c -{:d} lines linestart'.format(rows))
+        if self.textarea.compare(first,'>',mark):
+            mark = first
+        for tag,ranges in self.highlight.ranges(self.textarea.get(mark,'end-1c')).items():
+            idx = []
+            for start,end in ranges:
+                idx.append('{} + {:d} chars'.format(mark,start))
+                idx.append('{} + {:d} chars'.format(mark,end))
+            self.textarea.tag_add(tag,*idx)
+    def set_highlight_tags(self):
+        #one tag per rule, above rxtext and txtext and below the search tags
+        for tag in self.textarea.tag_names():
+            if tag.startswith('hl') and tag not in self.highlight.tags:
+                self.textarea.tag_delete(tag)
+        for tag,rule in zip(self.highlight.tags,self.highlight.rules):
+            try:
+                self.textarea.tag_configure(tag,foreground=rule['color'])
+            except tk.TclError:
+                self.status('unknown highlight color {}'.format(rule['color']))
+            self.textarea.tag_raise(tag)
+        for tag in ('searchhit','searchcur'):
+            if tag in self.textarea.tag_names():
+                self.textarea.tag_raise(tag)
+    def set_highlight(self,rules):
+        #raises ValueError when a rule does not compile. Text already shown keeps its
+        # colors, the new rules apply to what comes in next
+        self.highlight.set(rules)
+        self.set_highlight_tags()
+        self.hledit.delete("1.0",END)
+        self.hledit.insert("1.0",self.highlight.text())
+    def apply_highlight(self):
+        try:
+            self.set_highlight(self.highlight.parse(self.hledit.get("1.0",END)))
+        except ValueError as err:
+            self.status(str(err))
+            return
+        self.status('{:d} highlight rules'.format(len(self.highlight.rules)))
+    def default_highlight(self):
+        self.set_highlight(highlight_rules.defaults)
+    def search_step(self,older):
+        #find the next match of the search entry, older goes back towards the start.
+        # A new query starts from the end, the most recent output
+        text = self.search_text.get()
+        if not text:
+            return
+        key = (text,self.search_regex.get(),self.search_case.get())
+        if self.search_query is None or self.search_key != key:
+            try:
+                self.search_query = stepcomm_search.search_query(text,
+                        regex=bool(key[1]),case=bool(key[2]))
+            except re.error as err:
+                self.search_lab.configure(text='bad regex: {}'.format(err))
+                return
+            self.search_key = key
+            self.search_hit = None
+        hit = self.search_hit
+        if hit is None:
+            pos = self.search.end
+        else:
+            pos = hit[0] if older else hit[0] + max(1,hit[1])
+        found = self.search.search(self.search_query,pos,backwards=older)
+        if found is None:
+            self.search_lab.configure(text='no older match' if older else 'no newer match')
+            return
+        self.search_hit = found
+        line,col = self.search.position(found[0])
+        row = line - self.trimmed_lines + 1
+        self.textarea.tag_remove('searchcur','1.0',END)
+        if row >= 1:
+            start = '{:d}.{:d}'.format(row,col)
+            self.textarea.tag_add('searchcur',start,'{} + {:d} chars'.format(start,found[1]))
+            self.textarea.see(start)
+            self.search_lab.configure(text='line {:d}'.format(line + 1))
+        else:
+            #trimmed off the screen, show the line it is in
+            self.search_lab.configure(text='line {:d} (trimmed): {}'.format(line + 1,
+                    self.search.line_text(found[0])[:80]))
+        self.search_highlight()
+    def search_view_changed(self):
+        #called on every scroll, the highlights are redone once the view settles
+        if self.search_query is not None and not self.search_view_pending:
+            self.search_view_pending = True
+            self.root.after_idle(self.search_highlight)
+    def search_highlight(self):
+        #tag the matches in the lines on screen, the rest of the scrollback is not touched
+        self.search_view_pending = False
+        self.textarea.tag_remove('searchhit','1.0',END)
+        if self.search_query is None:
+            return
+        first = self.textarea.index('@0,0 linestart')
+        last = self.textarea.index('@0,{:d} lineend'.format(self.textarea.winfo_height()))
+        for m in self.search_query.pattern.finditer(self.textarea.get(first,last)):
+            if m.end() > m.start():
+                self.textarea.tag_add('searchhit','{} + {:d} chars'.format(first,m.start()),
+                        '{} + {:d} chars'.format(first,m.end()))
     def typed_char(self,event):
+        if self.vt is not None and self.vt.key(event.keysym) is not None:
+            #cursor and editing keys send their VT100 sequences
+            self.charout(self.vt.key(event.keysym))
+            return("break")
         if len(event.char) == 1:
             #print ('character {}'.format(ord(event.char)))
             if ord(event.char) == 3:
@@ -704,86 +1462,103 @@ options menu allows you to change the way things are displayed."""
             else:
                 self.charout(event.char)
         return("break")
+    def macro_send(self):
+        #plain macros are sent as they are, scripts are run from their compiled program.
+        # Send stops a script that is still running
+        if self.macro_run is not None:
+            self.macro_run.stop()
+            return
+        txt = self.macroedit.get(1.0,END)
+        if not stepcomm_macro.is_script(txt):
+            self.stringout(txt,1)
+            return
+        self.macro_text[self.macro_sel.get()-1] = txt[:-1]
+        if not self.engine.comport.is_open:
+            self.status("port not open, macro not run")
+            return
+        try:
+            program = self.macros.program(self.macro_sel.get())
+        except stepcomm_macro.macro_error as err:
+            self.status('macro error: {}'.format(err))
+            return
+        try:
+            cd = self.char_delay.get()
+            ld = self.line_delay.get()
+        except tk.TclError:
+            cd = ld = 0 # spinbox is being edited
+        self.macro_run = stepcomm_macro.macro_runner(self.engine,program,
+                char_delay=cd/1000,line_delay=ld/1000)
+        self.macro_run.start()
+        self.macro_btn.config(text='Stop')
+        self.poll_soon()
     def stringout(self,txt,snl):
-        if self.txbuf != '':
+        if int(snl) != 1:
+            txt = txt + '\n'
+        try:
+            cd = self.char_delay.get()
+            ld = self.line_delay.get()
+        except tk.TclError:
+            cd = ld = 0 # spinbox is being edited
+        self.poll_soon()
+        if not self.engine.comport.is_open:
+            #nothing to send to, but still echo like a dumb terminal
+            self.tx_sent(self.engine.tx_translate(txt))
             return
-        else:
-            if int(snl) == 1:
-                self.txbuf = txt
-            else:
-                self.txbuf = txt + '\n'
-            self.txptr = 0
-            self.stringloop()
-    def stringloop(self):
-        if self.txptr < len(self.txbuf):
-            c= self.txbuf[self.txptr]
-            self.charout(c)
-            self.txptr += 1
-            if ord(c) == '\n':
-                self.root.after(self.line_delay.get(),self.stringloop)
-            else:
-                self.root.after(self.char_delay.get(),self.stringloop)
-        else:
-            self.txbuf=''
-            self.txptr=0
+        self.engine.send_text(txt,char_delay=cd/1000,line_delay=ld/1000)
     def charout(self,c):
-        #called from stringout/stringloop or typedchar, all line endings are already '\n' except for paste
-        if c == '\n' or c == '\r':
-            #print('CHAR=\\r or \\n')
-            if self.txnl_ignore=='LF':
-                #print('{} LF, ignored LF'.format(self.rxnl.get()))
-                self.txnl_ignore = ' '
-            else:
-                #print('{} LF, used LF'.format(self.rxnl.get())
-                self.echochar('\n')
-                self.comnewline()
-                self.txnl_ignore = 'CR'
-        elif c == '\r':
-            if self.txnl_ignore=='CR':
-                #print('{} CR, ignored CR'.format(self.rxnl.get()))
-                self.txnl_ignore = ' '
+        #called from typed_char, goes through the transmit engine like any other string
+        self.stringout(c,1)
+    def tx_sent(self,data):
+        #called by the transmit engine thread with every block written to the port
+        if self.echo.get() == 'ON':
+            self.display_pending.append(('txtext',data,time.monotonic()))
+    def tx_tick(self):
+        #report the progress of the transmit engine on the status bar. A job only counts
+        # as sent once the engine is done with it, for files that includes the drain
+        job = self.tx_reported
+        if job is not None and job.done.is_set():
+            self.tx_reported = None
+            label = job.label + ', ' if job.label else ''
+            if job.cancelled:
+                self.status('cancelled {:s}{:d} bytes sent'.format(label,job.sent))
+            elif job.error is None:
+                self.status('sent {:s}{:d} bytes'.format(label,job.sent))
+        job = self.engine.tx.job
+        if job is not None and job.total > 1:
+            label = job.label + ': ' if job.label else ''
+            rate = job.sent/max(time.monotonic() - job.started,0.001)
+            eta = (job.total - job.sent)/rate if rate > 0 else 0
+            state = ' (paused)' if not self.engine.tx.running.is_set() else ''
+            self.status('sending {:s}{:d}/{:d} bytes, {:.1f} kB/s, ETA {:.0f}s{:s}'.format(
+                    label,job.sent,job.total,rate/1000,max(eta,0),state))
+            self.tx_reported = job
+        run = self.macro_run
+        if run is not None and not run.is_alive():
+            self.macro_run = None
+            self.macro_btn.config(text='Send')
+            if run.error is None:
+                self.status('macro done')
+            elif isinstance(run.error,stepcomm_macro.macro_stopped):
+                self.status('macro stopped at {} line {:d}'.format(*run.line))
             else:
-                #print('{} CR, used CR'.format(self.rxnl.get()))
-                self.echochar('\n')
-                self.comnewline()
-                self.txnl_ignore = 'LF'
-        elif ord(c) == 8:
-            self.txnl_ignore = ' '
-            self.echobackspace()
-            self.comchar(c)
+                self.status('macro failed: {}'.format(run.error))
+        elif run is not None and run.line is not None and job is None:
+            self.status('macro running, {} line {:d}'.format(*run.line))
+        if self.engine.tx.error is not None:
+            self.status('txwrite failed: {}'.format(self.engine.tx.error))
+            self.engine.tx.error = None
+        self.root.after(250,self.tx_tick)
+    def perf_tick(self):
+        #sample the perf counters once a second, for the status bar and the export hooks
+        s = self.engine.perf_sample()
+        if self.show_perf.get():
+            self.perf_text.set(self.engine.perf.summary(s))
+        self.root.after(1000,self.perf_tick)
+    def set_show_perf(self):
+        if self.show_perf.get():
+            self.perf_lab.pack(fill=X,expand=True,side=BOTTOM)
         else:
-            self.txnl_ignore = ' '
-            self.echochar(c)
-            self.comchar(c)
-        self.textarea.see("end")
-    def echochar(self,c):
-        if self.echo.get() == 'ON':
-            self.textarea.insert(tk.END, c,'txtext')
-    def echobackspace(self):
-        if self.echo.get() == 'ON':
-            try:
-                prevtagchar = self.textarea.index("txtext.last-1c")
-                #print('last txchar at {}'.format(prevtagchar))
-                #print('last char ascii is "{}"'.format(self.textarea.get(prevtagchar)))
-                #print('delete ascii char{} at index {}'.format(ord(self.textarea.get(prevtagchar)),prevtagchar))
-                self.textarea.delete(prevtagchar)
-            except tk.TclError:
-                pass
-    def comchar(self,c):
-        if self.comport.isOpen():
-            try:
-                self.comport.write(c.encode('utf-8'))
-            except:
-                self.status('txwrite timeout')
-                
-    def comnewline(self):
-        if self.txnl.get() == "WINDOWS" or (self.txnl.get()== "AUTO   " and self.txnl_autostyle =="WINDOWS"):
-            self.comchar('\r')
-            self.comchar('\n')
-        elif self.txnl.get() == 'UNIX   ' or (self.txnl.get()== "AUTO   " and self.txnl_autostyle =="UNIX   "):
-            self.comchar('\n')
-        elif self.txnl.get() == 'OLD MAC' or (self.txnl.get()== "AUTO   " and self.txnl_autostyle =="OLD MAC"):
-            self.comchar('\r')
+            self.perf_lab.pack_forget()
 
     def helpabout(self):
         popup_about = tk.Tk()
@@ -816,7 +1591,14 @@ options menu allows you to change the way things are displayed."""
                'stopbits':self.stopbits_combo.get(),'echo':self.echo.get(),
                'sendhist':self.send_hist,'send_macro':self.macro_text,'send_snls':snls,
                'capfile':self.rxfilename.get(),
-               'txnl':self.txnl.get(),'txnl_autostyle':self.txnl_autostyle}
+               'txnl':self.txnl.get(),'txnl_autostyle':self.engine.rx_nl.autostyle,
+               'rxthread':self.engine.rx_reader is not None,'txbinary':self.txbinary.get(),'scrollback':self.scrollback.get(),
+               'display':self.display_mode.get(),'encoding':self.engine.encoding,
+               'perf':self.show_perf.get(),'frames':self.engine.frames_name,'poll_min_ms':self.poll_min_ms,
+               'highlight':self.highlight.rules,
+               'poll_max_ms':self.poll_max_ms,
+               'livecap':self.livecap.get(),'capsync':self.cap_fsync,
+               'caprotate_mb':self.cap_rotate_mb,'caprotate_min':self.cap_rotate_min}
         txt = json.dumps(jdict)
         file = filedialog.asksaveasfile(mode='w',title='Select file for saving',
                 filetypes = (("Config Files","*.ini"),("all files","*.*")))
@@ -892,15 +1674,54 @@ options menu allows you to change the way things are displayed."""
             self.rxfilename.set(jdict['capfile'])
         if 'txnl' in jdict:
             self.txnl.set(jdict['txnl'])
+            self.engine.txnl = jdict['txnl']
         if 'txnl_autostyle' in jdict:
-            self.txnl_autostyle = jdict['txnl_autostyle']
+            self.engine.rx_nl.autostyle = jdict['txnl_autostyle']
+        if 'rxthread' in jdict:
+            self.engine.set_rxthread(bool(jdict['rxthread']))
+        if 'scrollback' in jdict:
+            self.scrollback.set(jdict['scrollback'])
+        if jdict.get('display') in self.display_modes:
+            self.display_mode.set(jdict['display'])
+            self.set_display_mode()
+        if 'encoding' in jdict:
+            self.encoding.set(jdict['encoding'])
+            self.set_encoding()
+        if jdict.get('frames') in stepcomm_frames.decoder_names:
+            self.frames_combo.set(jdict['frames'])
+            self.set_frames()
+        if 'highlight' in jdict:
+            try:
+                self.set_highlight(jdict['highlight'])
+            except (ValueError,KeyError,TypeError):
+                self.status('bad highlight rules in settings file')
+        if 'poll_min_ms' in jdict:
+            self.poll_min_ms = max(1,int(jdict['poll_min_ms']))
+        if 'poll_max_ms' in jdict:
+            self.poll_max_ms = max(self.poll_min_ms,int(jdict['poll_max_ms']))
+        if 'perf' in jdict:
+            self.show_perf.set(jdict['perf'])
+            self.set_show_perf()
+        if 'txbinary' in jdict:
+            self.txbinary.set(jdict['txbinary'])
+        if 'livecap' in jdict:
+            self.livecap.set(jdict['livecap'])
+        if 'capsync' in jdict:
+            self.cap_fsync = jdict['capsync']
+        if 'caprotate_mb' in jdict:
+            self.cap_rotate_mb = jdict['caprotate_mb']
+        if 'caprotate_min' in jdict:
+            self.cap_rotate_min = jdict['caprotate_min']
         self.status("loaded settings from " + file.name)
     
     def exitapp(self):
-        try:
-            self.comport.close()
-        except:
-            pass
+        if self.macro_run is not None:
+            self.macro_run.stop()
+        if self.engine.capture is not None:
+            self.stop_capture()
+        self.engine.stop()
+        self.port_watch.stop()
+        self.history.close()
         self.root.destroy()
         
         
@@ -908,14 +1729,121 @@ options menu allows you to change the way things are displayed."""
         self.textarea.itemconfigure(self,width=self.cols, height=self.rows)
 
         
-def main():
+class sessions_tk(tk.Frame):
+    #tabbed view of a sessions file, one tab per port with its own text area and send
+    # line. All the ports are read by the session_manager io threads, which only queue
+    # the data; one after() loop shows whatever arrived, so idle tabs cost nothing.
+    def __init__(self,parent,fn,threads=1,scrollback=10000):
+        tk.Frame.__init__(self,parent)
+        import stepcomm_sessions
+        self.root = parent
+        self.root.wm_title("StepComm - sessions " + os.path.basename(fn))
+        self.txcolor = 'red'
+        self.rxcolor = 'blue'
+        self.frame_ms = 20
+        self.idle_ms = self.frame_ms # backs off to 200ms while no tab gets anything
+        self.scrollback = scrollback # max lines kept in each tab, 0 for no limit
+        self.status_text = tk.StringVar()
+        self.notebook = ttk.Notebook(self)
+        self.notebook.pack(fill=BOTH,expand=True)
+        tk.Label(self,textvariable=self.status_text,anchor=W).pack(side=BOTTOM,fill=X)
+        self.tabs = {} # name: tab dict, see add_tab()
+        self.manager = stepcomm_sessions.session_manager(threads=threads)
+        try:
+            failed = self.manager.load(fn,hooks=self.add_tab)
+        except (OSError,ValueError) as err:
+            failed = [(fn,err)]
+        for name,err in failed:
+            if name in self.tabs:
+                self.notebook.forget(self.tabs.pop(name)['frame'])
+        self.status(', '.join('{} failed: {}'.format(name,err) for name,err in failed) or
+                '{:d} sessions open'.format(len(self.tabs)))
+        self.root.after(self.frame_ms,self.port_in)
+        self.root.protocol("WM_DELETE_WINDOW", self.exitapp)
+    def status(self,t):
+        self.status_text.set(t)
+    def add_tab(self,name):
+        #called by session_manager.load() before each port is opened, returns the
+        # callbacks for its engine
+        frame = tk.Frame(self.notebook)
+        textarea = tkst.ScrolledText(frame, wrap = tk.WORD, width=60,height=20)
+        textarea.pack(fill=tk.BOTH, expand=True)
+        textarea.tag_configure('txtext',foreground=self.txcolor)
+        textarea.tag_configure('rxtext',foreground=self.rxcolor)
+        entry = tk.Entry(frame)
+        entry.pack(side=BOTTOM,fill=X)
+        entry.bind('<Return>', lambda e: self.send(name))
+        self.notebook.add(frame,text=name)
+        pending = collections.deque() # (tag,bytes) waiting to be shown
+        self.tabs[name] = {'frame':frame,'textarea':textarea,'entry':entry,
+                'pending':pending,'rx_nl':stepcomm_engine.newline_state(),
+                'tx_nl':stepcomm_engine.newline_state(),'reported':False,
+                'rx_dec':None,'tx_dec':None}
+        return {'on_rx':lambda l: pending.append(('rxtext',l)),
+                'on_sent':lambda l: pending.append(('txtext',l))}
+    def send(self,name):
+        entry = self.tabs[name]['entry']
+        self.manager.sessions[name].send_text(entry.get() + '\n')
+        entry.delete(0,END)
+    def port_in(self):
+        busy = False
+        for name,tab in self.tabs.items():
+            if tab['pending']:
+                busy = True
+                if tab['rx_dec'] is None:
+                    tab['rx_dec'] = self.manager.sessions[name].decoder()
+                    tab['tx_dec'] = self.manager.sessions[name].decoder()
+                self.display(tab)
+            if not tab['reported'] and self.manager.error(name) is not None:
+                tab['reported'] = True
+                self.status('{} stopped: {}'.format(name,self.manager.error(name)))
+                self.notebook.tab(tab['frame'],text=name + ' (closed)')
+        self.idle_ms = self.frame_ms if busy else min(200,self.idle_ms*2)
+        self.root.after(self.idle_ms,self.port_in)
+    def display(self,tab):
+        #same as pycom_tk.display() for a whole queue at once, decoded with the
+        # encoding of the session
+        textarea = tab['textarea']
+        pending = tab['pending']
+        while pending:
+            tag,l = pending.popleft()
+            if isinstance(l,stepcomm_frames.frame):
+                l = stepcomm_frames.frame_bytes(l)
+            dec,nl = (tab['rx_dec'],tab['rx_nl']) if tag == 'rxtext' else (tab['tx_dec'],tab['tx_nl'])
+            for run in nl.feed(dec.decode(l)):
+                if run == '\b':
+                    try:
+                        textarea.delete(textarea.index(tag + ".last-1c"))
+                    except tk.TclError:
+                        pass
+                else:
+                    textarea.insert(tk.END, run,tag)
+        if self.scrollback > 0:
+            lines = int(textarea.index('end-1c').split('.')[0])
+            if lines > self.scrollback + max(100,self.scrollback//10):
+                textarea.delete('1.0','{:d}.0'.format(lines - self.scrollback))
+        textarea.see("end")
+    def exitapp(self):
+        self.manager.stop()
+        self.root.destroy()
 
+
+def main():
+    #parsed here only to pick the mode, so --sessions=file and abbreviations work too.
+    # The GUI options and -h are left for pycom_tk
+    parser = argparse.ArgumentParser(add_help=False)
+    stepcomm_engine.add_arguments(parser)
+    args,unknown = parser.parse_known_args()
+    if args.headless:
+        return stepcomm_engine.main()
     root = tk.Tk()
     #root.wm_geometry("1000x500+100+100")
-    app = pycom_tk(root)
+    if args.sessions:
+        app = sessions_tk(root,args.sessions,threads=args.iothreads)
+    else:
+        app = pycom_tk(root)
     app.pack(fill=BOTH,expand=True,padx=5,pady=5)
     root.mainloop()
     
 if __name__ == "__main__":
     main()
-
@@ -0,0 +1,228 @@
+#StepComm async, asyncio streams over the StepComm serial engine
+#
+#Copyright (C) 2018  William B Hunter
+#
+#This program is free software: you can redistribute it and/or modify
+#it under the terms of the GNU General Public License as published by
+#the Free Software Foundation, either version 3 of the License, or
+#(at your option) any later version.
+#
+#This program is distributed in the hope that it will be useful,
+#but WITHOUT ANY WARRANTY; without even the implied warranty of
+#MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#GNU General Public License for more details.
+#
+#You should have received a copy of the GNU General Public License
+#along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+#construction Notes:
+#async_serial gives a serial_engine the interface of asyncio's StreamReader/StreamWriter:
+#    port = await stepcomm_async.open_serial('/dev/ttyUSB0','115200')
+#    port.write('version\n')
+#    await port.drain()
+#    line = await port.readline()
+#    async for chunk in port: ...
+# On POSIX the port's file descriptor is handed to the event loop (loop.add_reader), so
+# the loop itself reads the port when it is ready and a waiting coroutine costs nothing;
+# any number of ports can share one loop without a thread each. Where there is no file
+# descriptor (Windows, url handlers like loop://) the engine's reader thread is used and
+# its data is passed into the loop with call_soon_threadsafe.
+#Writes go through the engine's tx_engine like everything else sent, so they are queued
+# in order with GUI/queue sends, and drain() waits for the tx thread to finish them.
+#Received data is buffered up to limit bytes, after that the port is not read until the
+# buffer is drained again (with the reader thread, the data is still buffered).
+import asyncio
+import serial
+from stepcomm_engine import serial_engine,tx_job,port_fd
+
+
+class async_serial:
+    def __init__(self,engine,limit=1<<20,owned=False):
+        self.engine = engine
+        self.loop = asyncio.get_running_loop()
+        self.limit = limit
+        self.owned = owned # stop the engine on close()
+        self.buf = bytearray()
+        self.eof = False
+        self.error = None # the read error that ended the stream
+        self.waiter = None # future of the coroutine waiting for data
+        self.jobs = [] # (tx_job,future) not drained yet
+        self.prev_on_rx = engine.on_rx
+        self.fd = port_fd(engine.comport) if engine.rx_reader is None else None
+        self.reading = False
+        if self.fd is not None:
+            engine.on_rx = self.rx
+            self.resume_reading()
+        else:
+            engine.on_rx = self.rx_threadsafe
+            engine.set_rxthread(True)
+    #####################################
+    ##             RX side             ##
+    #####################################
+    def resume_reading(self):
+        if self.fd is not None and not self.reading and not self.eof:
+            self.loop.add_reader(self.fd,self.readable)
+            self.reading = True
+    def pause_reading(self):
+        if self.reading:
+            self.loop.remove_reader(self.fd)
+            self.reading = False
+    def readable(self):
+        #called by the event loop when the port has data
+        try:
+            if self.engine.poll() == 0:
+                #readable but nothing waiting is how a hangup looks, read() tells which
+                l = self.engine.comport.read(1)
+                if l:
+                    self.engine.rx_dispatch(l)
+        except (serial.SerialException,OSError,TypeError,AttributeError) as err:
+            self.error = err
+            self.feed_eof()
+    def rx(self,l):
+        if self.prev_on_rx is not None:
+            self.prev_on_rx(l)
+        self.buf += l
+        if len(self.buf) > self.limit:
+            self.pause_reading()
+        self.wakeup()
+    def rx_threadsafe(self,l):
+        #the reader thread calls this, the buffer is only touched by the loop
+        if self.prev_on_rx is not None:
+            self.prev_on_rx(l)
+        self.loop.call_soon_threadsafe(self.rx_from_thread,l)
+    def rx_from_thread(self,l):
+        self.buf += l
+        self.wakeup()
+    def feed_eof(self):
+        self.eof = True
+        self.pause_reading()
+        self.wakeup()
+    def wakeup(self):
+        waiter = self.waiter
+        if waiter is not None:
+            self.waiter = None
+            if not waiter.done():
+                waiter.set_result(None)
+    async def wait_for_data(self):
+        if self.waiter is not None:
+            raise RuntimeError('another coroutine is already waiting for data from this port')
+        self.resume_reading()
+        self.waiter = self.loop.create_future()
+        try:
+            await self.waiter
+        finally:
+            self.waiter = None
+    def consume(self,n):
+        data = bytes(self.buf[:n])
+        del self.buf[:n]
+        if len(self.buf) <= self.limit:
+            self.resume_reading()
+        return data
+    def raise_error(self):
+        if self.error is not None:
+            raise self.error
+    async def read(self,n=-1):
+        #up to n bytes (everything buffered for n<0), waits for at least one byte.
+        # b'' means the port is closed
+        if n == 0:
+            return b''
+        while not self.buf and not self.eof:
+            await self.wait_for_data()
+        if not self.buf:
+            self.raise_error()
+        return self.consume(len(self.buf) if n < 0 else n)
+    async def readexactly(self,n):
+        while len(self.buf) < n:
+            if self.eof:
+                self.raise_error()
+                raise asyncio.IncompleteReadError(self.consume(len(self.buf)),n)
+            await self.wait_for_data()
+        return self.consume(n)
+    async def readuntil(self,separator=b'\n'):
+        #data up to and including separator. Every byte is searched once, the next search
+        # starts where the last one gave up
+        start = 0
+        while True:
+            i = self.buf.find(separator,start)
+            if i >= 0:
+                return self.consume(i + len(separator))
+            start = max(0,len(self.buf) - len(separator) + 1)
+            if self.eof:
+                self.raise_error()
+                raise asyncio.IncompleteReadError(self.consume(len(self.buf)),None)
+            if len(self.buf) > self.limit:
+                raise asyncio.LimitOverrunError('separator not found within the buffer limit',
+                        len(self.buf))
+            await self.wait_for_data()
+    async def readline(self):
+        #like readuntil(b'\n'), but returns the partial line at the end of the stream
+        try:
+            return await self.readuntil(b'\n')
+        except asyncio.IncompleteReadError as err:
+            return err.partial
+    def __aiter__(self):
+        return self
+    async def __anext__(self):
+        #every chunk received, as it arrives
+        data = await self.read()
+        if not data:
+            raise StopAsyncIteration
+        return data
+    #####################################
+    ##             TX side             ##
+    #####################################
+    def write(self,data,char_delay=0,line_delay=0):
+        #queue data on the transmit engine. str gets the TX newline translation and is
+        # encoded like typed text, bytes are sent as they are. Returns the tx_job
+        nl = self.engine.tx_newline()
+        if isinstance(data,str):
+            data = self.engine.tx_translate(data,nl)
+        job = tx_job(bytes(data),char_delay=char_delay,line_delay=line_delay,nl=self.engine.encode_nl(nl))
+        job.drain = True
+        fut = self.loop.create_future()
+        def done(job):
+            self.loop.call_soon_threadsafe(lambda: fut.done() or fut.set_result(job))
+        job.on_done = done
+        self.jobs.append((job,fut))
+        return self.engine.tx.send(job)
+    async def drain(self):
+        #wait until everything written so far is out of the port. Raises the write error
+        # of a job that failed
+        jobs = self.jobs
+        self.jobs = []
+        for job,fut in jobs:
+            await fut
+            if job.error is not None:
+                raise job.error
+    def close(self):
+        self.pause_reading()
+        self.eof = True
+        self.wakeup()
+        self.engine.on_rx = self.prev_on_rx
+        if self.owned:
+            self.engine.stop()
+    async def wait_closed(self):
+        await self.drain()
+    async def expect(self,patterns,timeout=None):
+        #wait for one of patterns in the data received from now on, returns the
+        # stepcomm_engine.expect_result. The data is still there for read() too
+        return await asyncio.wrap_future(self.engine.expect(patterns,timeout=timeout))
+    async def __aenter__(self):
+        return self
+    async def __aexit__(self,*exc):
+        self.close()
+
+
+async def open_serial(port,baud='115200',parity='NONE',databits='8',stopbits='1',
+        txnl='WINDOWS',limit=1<<20):
+    #open a port with a new serial_engine, settings are the strings shown in the GUI.
+    # Raises serial.SerialException or ValueError when the port can't be opened
+    engine = serial_engine()
+    engine.txnl = txnl
+    try:
+        engine.open(port,baud,parity,databits,stopbits)
+    except:
+        engine.stop()
+        raise
+    return async_serial(engine,limit=limit,owned=True)
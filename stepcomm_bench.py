@@ -0,0 +1,415 @@
+#StepComm bench, throughput/latency/memory benchmarks against a virtual device
+#
+#Copyright (C) 2018  William B Hunter
+#
+#This program is free software: you can redistribute it and/or modify
+#it under the terms of the GNU General Public License as published by
+#the Free Software Foundation, either version 3 of the License, or
+#(at your option) any later version.
+#
+#This program is distributed in the hope that it will be useful,
+#but WITHOUT ANY WARRANTY; without even the implied warranty of
+#MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#GNU General Public License for more details.
+#
+#You should have received a copy of the GNU General Public License
+#along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+#construction Notes:
+#Runs the StepComm hot paths against a virtual device and prints the results as json:
+#    python stepcomm_bench.py [--transport pty|loop] [--quick] [-o results.json]
+#    python stepcomm_bench.py --compare baseline.json [--tolerance 0.2]
+# The device is the master side of a pseudo terminal pair (POSIX), with the engine on the
+# slave side like on a real tty, or pyserial's loop:// port where everything sent comes
+# back as received data (anywhere, but loop:// itself moves one byte at a time).
+#Benchmarks:
+# rx_queue   device -> reader thread -> data_from_device_q -> consumer thread
+# rx_poll    device -> serial_engine.poll() every 10ms like a busy port_in -> queue
+# rx_screen  device -> pycom_tk display into the Tk text widget (needs a display)
+# tx         send_text unpaced, and with a char delay to check the pacing
+# latency    one byte from the device until on_rx sees it, reader thread and polling
+# memory     tracemalloc and max RSS while receiving for a while
+#Metric names end in their unit: _mbps (more is better), _ms and _kb (less is better).
+# --compare runs the benchmarks and exits with 1 when a metric is worse than the
+# baseline by more than the tolerance, so regressions in the hot paths get caught.
+import os
+import sys
+import time
+import json
+import queue
+import platform
+import argparse
+import threading
+import tracemalloc
+from stepcomm_engine import serial_engine,device_queue
+
+
+class pty_device:
+    #the master side of a pseudo terminal, the engine opens the slave by name
+    def __init__(self):
+        import pty,tty
+        self.master,self.slave = pty.openpty()
+        tty.setraw(self.master)
+        tty.setraw(self.slave)
+        self.port = os.ttyname(self.slave)
+        self.received = 0
+    def attach(self,engine):
+        pass
+    def inject(self,data):
+        view = memoryview(data)
+        while view:
+            n = os.write(self.master,view)
+            view = view[n:]
+    def start_sink(self):
+        #count everything the engine sends
+        def sink():
+            while True:
+                try:
+                    self.received += len(os.read(self.master,65536))
+                except OSError:
+                    return
+        threading.Thread(target=sink,name='pty_sink',daemon=True).start()
+    def close(self):
+        os.close(self.master)
+        os.close(self.slave)
+
+
+class loop_device:
+    #pyserial loop://, data written to the port is received again. inject() writes to
+    # the same port object the engine reads, what the engine sends is counted from RX
+    def __init__(self):
+        self.port = 'loop://'
+        self.engine = None
+        self.received = 0
+    def attach(self,engine):
+        self.engine = engine
+    def inject(self,data):
+        self.engine.comport.write(data)
+    def start_sink(self):
+        pass
+    def close(self):
+        pass
+
+
+def make_device(transport):
+    return pty_device() if transport == 'pty' else loop_device()
+
+
+def open_engine(dev,rxthread=True,**kw):
+    engine = serial_engine(**kw)
+    engine.set_rxthread(rxthread)
+    engine.open(dev.port,'3000000')
+    dev.attach(engine)
+    return engine
+
+
+def inject_thread(dev,size,chunk=4096):
+    block = (b'0123456789abcdefghijklmnopqrstuvwxyz\r\n'*((chunk//38) + 1))[:chunk]
+    def run():
+        left = size
+        while left > 0:
+            dev.inject(block[:min(left,chunk)])
+            left -= chunk
+    t = threading.Thread(target=run,name='inject',daemon=True)
+    t.start()
+    return t
+
+
+def consume(q,size,timeout):
+    got = 0
+    end = time.monotonic() + timeout
+    while got < size and time.monotonic() < end:
+        try:
+            got += len(q.get(timeout=0.1))
+        except queue.Empty:
+            pass
+    return got
+
+
+def bench_rx_queue(transport,size):
+    dev = make_device(transport)
+    q = device_queue()
+    engine = open_engine(dev,data_from_device_q=q)
+    try:
+        start = time.perf_counter()
+        inject_thread(dev,size)
+        got = consume(q,size,60)
+        elapsed = time.perf_counter() - start
+    finally:
+        engine.stop()
+        dev.close()
+    return {'bytes':got,'rx_queue_mbps':got/elapsed/1e6,'complete':got == size}
+
+
+def bench_rx_poll(transport,size):
+    dev = make_device(transport)
+    q = device_queue()
+    engine = open_engine(dev,rxthread=False,data_from_device_q=q)
+    got = [0]
+    def consumer():
+        got[0] = consume(q,size,60)
+    c = threading.Thread(target=consumer,daemon=True)
+    c.start()
+    try:
+        start = time.perf_counter()
+        inject_thread(dev,size)
+        ticks = 0
+        while c.is_alive():
+            engine.poll(0.008) # the read budget of a port_in tick
+            ticks += 1
+            time.sleep(0.01)
+        elapsed = time.perf_counter() - start
+    finally:
+        engine.stop()
+        dev.close()
+    return {'bytes':got[0],'rx_poll_mbps':got[0]/elapsed/1e6,'ticks':ticks,
+            'complete':got[0] == size}
+
+
+def bench_rx_screen(transport,size):
+    #the whole GUI receive path: port_in, display() and the text widget
+    try:
+        import tkinter
+        root = tkinter.Tk()
+    except Exception as err:
+        return {'skipped':'no display: {}'.format(err)}
+    import StepComm
+    argv = sys.argv
+    sys.argv = argv[:1] # pycom_tk parses the command line
+    try:
+        app = StepComm.pycom_tk(root)
+    finally:
+        sys.argv = argv
+    dev = make_device(transport)
+    app.port_combo.set(dev.port)
+    app.ports_first = False # the port list must not pick another port
+    app.set_port()
+    shown = [0]
+    display = app.display
+    def counting_display(tag,l):
+        if tag == 'rxtext':
+            shown[0] += len(l)
+        display(tag,l)
+    app.display = counting_display
+    try:
+        end = time.monotonic() + 5
+        while not app.engine.comport.is_open and time.monotonic() < end:
+            root.update()
+        dev.attach(app.engine)
+        start = time.perf_counter()
+        inject_thread(dev,size)
+        end = time.monotonic() + 60
+        while shown[0] < size and time.monotonic() < end:
+            root.update()
+        root.update()
+        elapsed = time.perf_counter() - start
+        lines = int(app.textarea.index('end-1c').split('.')[0])
+    finally:
+        app.engine.stop()
+        root.destroy()
+        dev.close()
+    return {'bytes':shown[0],'rx_screen_mbps':shown[0]/elapsed/1e6,'lines_on_screen':lines,
+            'complete':shown[0] == size}
+
+
+def bench_tx(transport,size,paced_chars):
+    dev = make_device(transport)
+    received = [0]
+    engine = open_engine(dev,on_rx=lambda l: received.__setitem__(0,received[0] + len(l)))
+    def sent():
+        return dev.received if transport == 'pty' else received[0]
+    dev.start_sink()
+    result = {}
+    try:
+        text = ('x'*70 + '\n')*(size//72)
+        start = time.perf_counter()
+        job = engine.send_text(text)
+        job.done.wait(60)
+        end = time.monotonic() + 10
+        while sent() < job.total and time.monotonic() < end:
+            time.sleep(0.001)
+        elapsed = time.perf_counter() - start
+        result['bytes'] = sent()
+        result['tx_mbps'] = sent()/elapsed/1e6
+        #paced: 1ms between chars, what it really takes per char shows the overhead of a
+        # paced write on top of the delay
+        start = time.perf_counter()
+        job = engine.send_text('y'*paced_chars,char_delay=0.001)
+        job.done.wait(60)
+        elapsed = time.perf_counter() - start
+        result['tx_paced_chars'] = job.sent
+        result['tx_paced_char_ms'] = elapsed/max(1,job.sent)*1000
+    finally:
+        engine.stop()
+        dev.close()
+    return result
+
+
+def percentiles(samples):
+    samples = sorted(samples)
+    if not samples:
+        return {}
+    pick = lambda p: samples[min(len(samples) - 1,int(p*len(samples)))]*1000
+    return {'p50_ms':pick(0.5),'p90_ms':pick(0.9),'p99_ms':pick(0.99),'max_ms':samples[-1]*1000}
+
+
+def bench_latency(transport,count):
+    result = {}
+    for mode in ('thread','poll'):
+        dev = make_device(transport)
+        arrived = queue.SimpleQueue()
+        engine = open_engine(dev,rxthread=(mode == 'thread'),
+                on_rx=lambda l: arrived.put(time.perf_counter()))
+        samples = []
+        try:
+            for i in range(count + 5): # the first few warm up the threads
+                sent = time.perf_counter()
+                dev.inject(b'!')
+                end = sent + 1
+                while True:
+                    if mode == 'poll':
+                        engine.poll()
+                    try:
+                        samples.append(arrived.get(timeout=0.01 if mode == 'poll' else 1) - sent)
+                        break
+                    except queue.Empty:
+                        if time.perf_counter() > end:
+                            break
+                time.sleep(0.002)
+            del samples[:5]
+        finally:
+            engine.stop()
+            dev.close()
+        result[mode] = percentiles(samples)
+        result[mode]['samples'] = len(samples)
+    return result
+
+
+def bench_memory(transport,seconds):
+    #receive for a while and watch the python heap, steady state should not grow
+    dev = make_device(transport)
+    q = device_queue(maxsize=1000,policy='drop-oldest')
+    engine = open_engine(dev,data_from_device_q=q)
+    stop = threading.Event()
+    def inject():
+        block = b'z'*4096
+        try:
+            while not stop.is_set():
+                dev.inject(block)
+        except (OSError,AttributeError):
+            pass # closed at the end
+    def drain():
+        while not stop.is_set():
+            try:
+                q.get(timeout=0.1)
+            except queue.Empty:
+                pass
+    tracemalloc.start()
+    try:
+        threading.Thread(target=inject,daemon=True).start()
+        threading.Thread(target=drain,daemon=True).start()
+        time.sleep(min(1.0,seconds/4)) # warm up
+        first = tracemalloc.get_traced_memory()[0]
+        time.sleep(seconds)
+        last,peak = tracemalloc.get_traced_memory()
+    finally:
+        stop.set()
+        tracemalloc.stop()
+        engine.stop()
+        time.sleep(0.1)
+        dev.close()
+    result = {'heap_start_kb':first/1024,'heap_end_kb':last/1024,'heap_peak_kb':peak/1024,
+            'heap_growth_kb':(last - first)/1024,'seconds':seconds}
+    try:
+        import resource
+        result['maxrss_kb'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    except ImportError:
+        pass
+    return result
+
+
+def run(args):
+    size = (1 if args.quick else 8)*1024*1024
+    benches = [
+        ('rx_queue',lambda: bench_rx_queue(args.transport,size)),
+        ('rx_poll',lambda: bench_rx_poll(args.transport,size//4)),
+        ('rx_screen',lambda: bench_rx_screen(args.transport,size//8)),
+        ('tx',lambda: bench_tx(args.transport,size,200 if args.quick else 1000)),
+        ('latency',lambda: bench_latency(args.transport,50 if args.quick else 500)),
+        ('memory',lambda: bench_memory(args.transport,2 if args.quick else 10)),
+    ]
+    if args.transport == 'loop':
+        size //= 64 # loop:// moves one byte at a time
+    results = {}
+    for name,bench in benches:
+        if args.only and name not in args.only:
+            continue
+        print('running ' + name,file=sys.stderr)
+        try:
+            results[name] = bench()
+        except Exception as err:
+            results[name] = {'error':'{}: {}'.format(type(err).__name__,err)}
+    return {'title':'StepComm: benchmark','time':time.asctime(),'transport':args.transport,
+            'python':platform.python_version(),'platform':platform.platform(),
+            'quick':args.quick,'results':results}
+
+
+def metrics(results,prefix=''):
+    #flatten to {'latency.thread.p99_ms':value}
+    out = {}
+    for k,v in results.items():
+        if isinstance(v,dict):
+            out.update(metrics(v,prefix + k + '.'))
+        elif isinstance(v,(int,float)) and not isinstance(v,bool):
+            out[prefix + k] = v
+    return out
+
+
+def compare(base,new,tolerance):
+    #list of (metric,baseline,now) that got worse by more than tolerance
+    worse = []
+    old = metrics(base['results'])
+    for name,value in metrics(new['results']).items():
+        if name not in old:
+            continue
+        if name.endswith('_mbps') and value < old[name]*(1 - tolerance):
+            worse.append((name,old[name],value))
+        elif name.endswith(('_ms','_kb')) and value > old[name]*(1 + tolerance) and \
+                value - old[name] > (1 if name.endswith('_ms') else 64):
+            #small absolute changes are noise, not regressions
+            worse.append((name,old[name],value))
+    return worse
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='StepComm benchmarks')
+    parser.add_argument('--transport', help='virtual device to run against',
+            choices=('pty','loop'),default='pty' if os.name == 'posix' else 'loop')
+    parser.add_argument('--quick', help='smaller sizes and shorter runs',action='store_true')
+    parser.add_argument('--only', help='run only these benchmarks',nargs='+')
+    parser.add_argument('-o','--output', help='write the json results to this file')
+    parser.add_argument('--compare', help='baseline json, exit 1 on a regression')
+    parser.add_argument('--tolerance', help='allowed relative regression',type=float,default=0.2)
+    args = parser.parse_args(argv)
+    result = run(args)
+    txt = json.dumps(result,indent=1)
+    if args.output:
+        with open(args.output,'w') as file:
+            file.write(txt)
+    print(txt)
+    if args.compare:
+        with open(args.compare,'r') as file:
+            base = json.loads(file.read())
+        if base.get('transport') != result['transport']:
+            print('baseline was run over {}, not {}'.format(base.get('transport'),
+                    result['transport']),file=sys.stderr)
+        worse = compare(base,result,args.tolerance)
+        for name,old,now in worse:
+            print('regression {}: {:.3f} -> {:.3f}'.format(name,old,now),file=sys.stderr)
+        return 1 if worse else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,1316 @@
+#StepComm engine, the serial port handling of StepComm without any GUI
+#
+#Copyright (C) 2018  William B Hunter
+#
+#This program is free software: you can redistribute it and/or modify
+#it under the terms of the GNU General Public License as published by
+#the Free Software Foundation, either version 3 of the License, or
+#(at your option) any later version.
+#
+#This program is distributed in the hope that it will be useful,
+#but WITHOUT ANY WARRANTY; without even the implied warranty of
+#MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#GNU General Public License for more details.
+#
+#You should have received a copy of the GNU General Public License
+#along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+#construction Notes:
+#Everything StepComm does with a serial port that does not need a display lives here:
+# the port settings, the reader thread, the transmit engine and its pacing, the
+# queues to and from other threads, live capture and the newline state machine.
+# perf_counters keeps count on the hot paths so a slow driver, render or consumer shows.
+# A frame decoder from stepcomm_frames (set_frames) makes the queue and on_rx get whole
+# frames instead of the chunks read.
+# port_watcher keeps the list of serial ports current from a thread of its own, so
+# finding ports never holds up startup or the GUI.
+# serial_engine ties them together for one port. The tkinter GUI in StepComm.py
+# drives a serial_engine, and main() runs one on its own as a serial bridge between
+# stdin/stdout and the port (StepComm.py --headless).
+#This module must never import tkinter, so headless runs start fast and stay small.
+import os.path
+import time
+import threading
+import serial
+import re
+import sys
+import json
+import argparse
+import queue
+import signal
+import mmap
+import codecs
+import concurrent.futures
+import stepcomm_frames
+try:
+    from re import _parser as sre_parse
+except ImportError:
+    import sre_parse
+
+
+bauds=('300','600','1200','2400','4800','9600','14400','19200',
+    '28800','38400','57600','115200','230400','46800')
+parity_strings = ('NONE','EVEN','ODD','MARK','SPACE')
+parity_consts= (serial.PARITY_NONE,serial.PARITY_EVEN,serial.PARITY_ODD,
+                serial.PARITY_MARK,serial.PARITY_SPACE)
+databit_strings=('5','6','7','8')
+databit_consts=(serial.FIVEBITS,serial.SIXBITS,serial.SEVENBITS,serial.EIGHTBITS)
+stopbit_strings=('1','1.5','2')
+stopbit_consts=(serial.STOPBITS_ONE,serial.STOPBITS_ONE_POINT_FIVE,serial.STOPBITS_TWO)
+nl_styles = ('WINDOWS','UNIX   ','OLD MAC','AUTO   ')
+
+
+class newline_state:
+    #CR/LF state machine for one direction of the screen. feed() splits decoded text
+    # into runs: CR, LF, CR/LF and LF/CR each become a single '\n' and a backspace ends
+    # the run. It returns a list of strings where '\b' stands for one backspace. With
+    # detect set it also records the newline style the device uses in autostyle, which
+    # is what the AUTO TX newline mimics.
+    token_re = re.compile('[^\r\n\b]+|[\r\n]|\b') # text runs, CR/LF and BS tokens
+    def __init__(self,detect=False):
+        self.ignore = ' '
+        self.detect = detect
+        self.autostyle = 'WINDOWS'
+    def feed(self,text):
+        out = []
+        run = []
+        ignore = self.ignore
+        for m in self.token_re.finditer(text):
+            t = m.group()
+            if t == '\n' or t == '\r':
+                nl = 'LF' if t == '\n' else 'CR'
+                if ignore == nl:
+                    ignore = ' '
+                    if self.detect:
+                        self.autostyle = "WINDOWS"
+                else:
+                    run.append('\n')
+                    ignore = 'CR' if nl == 'LF' else 'LF'
+            elif t == '\b':
+                ignore = ' '
+                if run:
+                    out.append(''.join(run))
+                    run = []
+                out.append('\b')
+            else:
+                run.append(t)
+                #a lone LF or CR came before this text
+                if self.detect:
+                    if ignore == 'CR':
+                        self.autostyle = "UNIX   "
+                    elif ignore == 'LF':
+                        self.autostyle = "OLD MAC"
+                ignore = ' '
+        if run:
+            out.append(''.join(run))
+        self.ignore = ignore
+        return out
+
+
+def port_fd(port):
+    #file descriptor to wait on for readiness, None when the port has to be polled
+    if os.name != 'posix':
+        return None
+    try:
+        return port.fileno()
+    except (AttributeError,NotImplementedError,ValueError,serial.SerialException):
+        return None
+
+
+class serial_reader(threading.Thread):
+    #background reader for the comport. It blocks in read() until data arrives (or the
+    # timeout runs out), so received bytes are passed to the callback without waiting
+    # for the tkinter mainloop. The callback is called from this thread.
+    def __init__(self,callback,timeout=0.05,chunk=65536,perf=None):
+        threading.Thread.__init__(self,name='serial_reader',daemon=True)
+        self.callback = callback
+        self.timeout = timeout
+        self.chunk = chunk
+        self.perf = perf # perf_counters getting the in_waiting high water mark
+        self.port = None
+        self.running = True
+    def set_port(self,port):
+        #the comport gets replaced every time the settings change
+        self.port = port
+    def stop(self):
+        self.running = False
+    def run(self):
+        while self.running:
+            port = self.port
+            if port is None or not port.is_open:
+                time.sleep(self.timeout)
+                continue
+            try:
+                #wait for the first byte, then pick up whatever else is already buffered
+                l = port.read(1)
+                if l:
+                    inlen = port.in_waiting
+                    if inlen > 0:
+                        l += port.read(min(inlen,self.chunk))
+                        perf = self.perf
+                        if perf is not None and inlen > perf.in_waiting_max:
+                            perf.in_waiting_max = inlen
+                    self.callback(l)
+            except (serial.SerialException,OSError,TypeError,AttributeError):
+                #port closed or reconfigured under us, wait for the new one
+                time.sleep(self.timeout)
+
+
+class port_watcher(threading.Thread):
+    #keeps a cached list of the serial port names up to date. comports() looks at every
+    # tty and its sysfs entries, with many USB adapters that takes hundreds of ms, so it
+    # only runs in this thread: once at the start, on refresh(), and when a hotplug
+    # shows. Where there is a /dev (Linux, macOS) adding or removing a device node
+    # changes its mtime, so every interval_s only the watch_paths are stat'ed; without
+    # one comports() runs every fallback_s. The functions in subscribers are called
+    # from this thread with the new list when it changes, and after every refresh()
+    watch_paths = ('/dev','/dev/serial/by-id')
+    def __init__(self,interval_s=1.0,fallback_s=5.0):
+        threading.Thread.__init__(self,name='port_watcher',daemon=True)
+        self.interval_s = interval_s
+        self.fallback_s = fallback_s
+        self.ports = [] # sorted port names of the last scan
+        self.scans = 0
+        self.subscribers = []
+        self.ready = threading.Event() # set once the first scan is done
+        self.wake = threading.Event()
+        self.running = True
+    def refresh(self):
+        #scan again now, whether anything changed or not
+        self.wake.set()
+    def stop(self):
+        self.running = False
+        self.wake.set()
+    def signature(self):
+        #mtimes of the watch_paths, None when there is nothing to watch
+        sig = []
+        for path in self.watch_paths:
+            try:
+                sig.append(os.stat(path).st_mtime_ns)
+            except OSError:
+                sig.append(None)
+        return tuple(sig) if sig[0] is not None else None
+    def scan(self,notify=False):
+        from serial.tools.list_ports import comports
+        try:
+            ports = sorted(p.device for p in comports())
+        except OSError:
+            ports = self.ports
+        self.scans += 1
+        if ports != self.ports or not self.ready.is_set():
+            self.ports = ports
+            notify = True
+        self.ready.set()
+        if notify:
+            for fn in list(self.subscribers):
+                fn(list(ports))
+    def run(self):
+        sig = self.signature()
+        self.scan()
+        last = time.monotonic()
+        while self.running:
+            forced = self.wake.wait(self.interval_s)
+            self.wake.clear()
+            if not self.running:
+                break
+            new = self.signature()
+            if forced or (new is None and time.monotonic() - last >= self.fallback_s) or \
+                    (new is not None and new != sig):
+                #the mtimes are read before the scan, a change during it is seen next time
+                sig = new
+                self.scan(forced)
+                last = time.monotonic()
+
+
+class capture_writer(threading.Thread):
+    #streams raw received bytes to a capture file from its own thread. write() only queues
+    # the data, the thread collects everything pending into one batch per write call.
+    # fsync_s forces the data to disk at that interval, rotate_bytes/rotate_s start a new
+    # file once the current one is too big or too old; the old file is renamed with a
+    # time stamp, e.g. cap-20181201-120000.txt
+    def __init__(self,filename,fsync_s=0,rotate_bytes=0,rotate_s=0,batch=1<<20):
+        threading.Thread.__init__(self,name='capture_writer',daemon=True)
+        self.filename = filename
+        self.fsync_s = fsync_s
+        self.rotate_bytes = rotate_bytes
+        self.rotate_s = rotate_s
+        self.batch = batch
+        self.q = queue.SimpleQueue()
+        self.written = 0 # bytes written over all files
+        self.error = None
+        self.file = open(filename,'ab')
+    def write(self,data):
+        self.q.put(data)
+    def stop(self):
+        self.q.put(None)
+        self.join()
+    def rotate(self):
+        self.file.close()
+        root,ext = os.path.splitext(self.filename)
+        root += time.strftime('-%Y%m%d-%H%M%S')
+        name = root + ext
+        n = 1
+        while os.path.exists(name):
+            name = '{:s}-{:d}{:s}'.format(root,n,ext)
+            n += 1
+        os.replace(self.filename,name)
+        self.file = open(self.filename,'ab')
+    def run(self):
+        opened = last_sync = time.monotonic()
+        size = self.file.tell()
+        running = True
+        while running:
+            try:
+                item = self.q.get(timeout=max(self.fsync_s,0.5))
+            except queue.Empty:
+                item = b''
+            batch = []
+            pending = 0
+            while item is not None:
+                batch.append(item)
+                pending += len(item)
+                if pending >= self.batch:
+                    break
+                try:
+                    item = self.q.get_nowait()
+                except queue.Empty:
+                    break
+            running = item is not None
+            try:
+                if pending:
+                    self.file.write(b''.join(batch))
+                    self.file.flush()
+                    size += pending
+                    self.written += pending
+                now = time.monotonic()
+                if self.fsync_s and now - last_sync >= self.fsync_s:
+                    os.fsync(self.file.fileno())
+                    last_sync = now
+                if (self.rotate_bytes and size >= self.rotate_bytes) or \
+                        (self.rotate_s and size and now - opened >= self.rotate_s):
+                    self.rotate()
+                    opened = now
+                    size = 0
+            except OSError as err:
+                self.error = err
+                break
+        self.file.close()
+
+
+class tx_cancelled(Exception):
+    pass
+
+
+class tx_job:
+    #one transmission for the tx_engine. data is already encoded with the newlines
+    # translated, nl is the newline sequence so line_delay can follow each line.
+    # Delays are in seconds.
+    def __init__(self,data,char_delay=0,line_delay=0,nl=b'\r\n'):
+        self.data = data
+        self.char_delay = char_delay
+        self.line_delay = line_delay
+        self.nl = nl
+        self.total = len(data)
+        self.sent = 0
+        self.label = ''
+        self.echo = True # pass the written data to on_sent
+        self.drain = False # wait for the port to send everything before the job is done
+        self.started = None
+        self.error = None
+        self.cancelled = False
+        self.done = threading.Event()
+        self.on_done = None # called with the job from the tx thread once it is done
+    def blocks(self):
+        yield self.data
+
+
+class tx_file_job(tx_job):
+    #streams a file from disk in fixed size blocks, so its size does not matter. In text
+    # mode the file is read as utf-8 and each block goes through translate, which turns
+    # the text into bytes with the newlines translated, the same way typed text is sent
+    # (by default utf-8 with the newlines made nl). CRs and LFs at the end of a block are
+    # held back so a CR/LF pair is never split. Binary mode sends the bytes as they are.
+    # The file is opened here so a bad name fails right away.
+    nl_re = re.compile(b'\r\n|\n\r|\r|\n')
+    def __init__(self,filename,binary=False,use_mmap=False,block=1<<16,translate=None,**kw):
+        tx_job.__init__(self,b'',**kw)
+        self.translate = translate or (lambda t: self.nl_re.sub(self.nl,t.encode('utf-8')))
+        self.file = open(filename,'rb')
+        self.total = os.fstat(self.file.fileno()).st_size
+        self.label = 'file ' + filename
+        self.binary = binary
+        self.use_mmap = use_mmap and self.total > 0
+        self.block = block
+        self.echo = not binary
+        self.drain = True
+    def read_blocks(self):
+        if self.use_mmap:
+            with mmap.mmap(self.file.fileno(),0,access=mmap.ACCESS_READ) as m:
+                for pos in range(0,len(m),self.block):
+                    yield m[pos:pos+self.block]
+        else:
+            while True:
+                b = self.file.read(self.block)
+                if not b:
+                    break
+                yield b
+    def blocks(self):
+        try:
+            if self.binary:
+                yield from self.read_blocks()
+                return
+            dec = codecs.getincrementaldecoder('utf-8')(errors='replace')
+            held = ''
+            for b in self.read_blocks():
+                t = held + dec.decode(b)
+                stripped = t.rstrip('\r\n')
+                held = t[len(stripped):]
+                if stripped:
+                    yield self.translate(stripped)
+            held += dec.decode(b'',True)
+            if held:
+                yield self.translate(held)
+        finally:
+            self.file.close()
+
+
+class tx_engine(threading.Thread):
+    #transmits queued tx_jobs on the comport from its own thread. Without pacing the data
+    # is written in chunks sized to ~100ms of line time (write_timeout is 0.2s), with
+    # pacing each char/line is released on a monotonic clock schedule. on_sent is called
+    # from this thread with every block that was written. The thread is only started by
+    # the first send(), so ports that are just listened to don't cost a thread.
+    def __init__(self,on_sent=None):
+        threading.Thread.__init__(self,name='tx_engine',daemon=True)
+        self.on_sent = on_sent
+        self.jobs = queue.SimpleQueue()
+        self.port = None
+        self.job = None # job being transmitted
+        self.error = None # last write error, cleared by the reader
+        self.log = None # event_log getting every block written
+        self.perf = None # perf_counters counting the bytes written
+        self.running = threading.Event() # cleared while paused
+        self.running.set()
+        self.start_lock = threading.Lock()
+    def set_port(self,port):
+        self.port = port
+    def send(self,job):
+        self.jobs.put(job)
+        with self.start_lock:
+            if self.ident is None:
+                self.start()
+        return job
+    def pause(self):
+        self.running.clear()
+    def resume(self):
+        self.running.set()
+    def cancel(self):
+        #stop the job being sent, queued jobs still go out afterwards
+        job = self.job
+        if job is not None:
+            job.cancelled = True
+        self.running.set()
+    def stop(self):
+        self.jobs.put(None)
+    def run(self):
+        while True:
+            job = self.jobs.get()
+            if job is None:
+                break
+            self.job = job
+            job.started = time.monotonic()
+            try:
+                self.transmit(job)
+                if job.drain:
+                    self.port.flush()
+            except tx_cancelled:
+                pass
+            except (serial.SerialException,OSError,TypeError,AttributeError,queue.Full) as err:
+                #write timeout (queue.Full from loop://), or the port was closed under us
+                job.error = err
+                self.error = err
+            self.job = None
+            job.done.set()
+            if job.on_done is not None:
+                job.on_done(job)
+    def write(self,job,data):
+        if not self.running.is_set():
+            self.running.wait()
+        if job.cancelled:
+            raise tx_cancelled()
+        self.port.write(data)
+        log = self.log
+        if log is not None:
+            log.tx(data)
+        perf = self.perf
+        if perf is not None:
+            perf.tx_bytes += len(data)
+        job.sent += len(data)
+        if self.on_sent and job.echo:
+            self.on_sent(data)
+    def wait_until(self,t):
+        #sleep until close to the deadline and spin for the rest, sleep() alone is too coarse
+        while True:
+            left = t - time.monotonic()
+            if left <= 0:
+                return
+            if left > 0.002:
+                time.sleep(left - 0.001)
+    def transmit(self,job):
+        chunk = max(64,int(getattr(self.port,'baudrate',9600) or 9600)//100)
+        if not job.char_delay and not job.line_delay:
+            for block in job.blocks():
+                for i in range(0,len(block),chunk):
+                    self.write(job,block[i:i+chunk])
+            return
+        nl = job.nl
+        deadline = time.monotonic()
+        for block in job.blocks():
+            pos = 0
+            while pos < len(block):
+                end = block.find(nl,pos)
+                end = len(block) if end < 0 else end + len(nl)
+                line = block[pos:end]
+                if job.char_delay:
+                    for i in range(len(line)):
+                        self.wait_until(deadline)
+                        self.write(job,line[i:i+1])
+                        deadline = max(deadline,time.monotonic()) + job.char_delay
+                else:
+                    for i in range(0,len(line),chunk):
+                        self.wait_until(deadline)
+                        self.write(job,line[i:i+chunk])
+                        deadline = max(deadline,time.monotonic())
+                if line.endswith(nl):
+                    #the line delay replaces the char delay after a newline
+                    deadline += job.line_delay - job.char_delay
+                pos = end
+
+
+class device_queue(queue.Queue):
+    #queue.Queue with a choice of what put() does when the queue is full:
+    # 'block' waits up to timeout and then drops the item (no timeout waits forever),
+    # 'drop-newest' throws away the item being put, 'drop-oldest' throws away the oldest
+    # item to make room, 'coalesce' appends the item to the newest one waiting, so no
+    # data is lost but the number of items stays bounded. Frames from a frame decoder
+    # keep their boundaries and str never joins bytes, those drop the oldest instead.
+    #dropped and dropped_bytes count what was thrown away, high_water is the most items
+    # that were ever waiting. With stamp set, items are (seq,time,data) tuples: seq is the
+    # stream offset of the first byte and time is time.monotonic() at put(), so a gap
+    # shows up as seq != previous seq + len(previous data).
+    #On data_to_device_q, str items have their newlines translated to the TX newline
+    # style when translate_nl is set, bytes items are always sent as they are.
+    policies = ('block','drop-newest','drop-oldest','coalesce')
+    def __init__(self,maxsize=0,policy='block',timeout=None,stamp=False,translate_nl=True):
+        if policy not in self.policies:
+            raise ValueError('unknown queue policy {}'.format(policy))
+        queue.Queue.__init__(self,maxsize)
+        self.policy = policy
+        self.timeout = timeout
+        self.stamp = stamp
+        self.translate_nl = translate_nl
+        self.seq = 0
+        self.dropped = 0
+        self.dropped_bytes = 0
+        self.high_water = 0
+    def drop(self,item):
+        if self.stamp:
+            item = item[2]
+        self.dropped += 1
+        self.dropped_bytes += len(item)
+    def joinable(self,a,b):
+        #can coalesce append b to a?
+        if isinstance(a,stepcomm_frames.frame) or isinstance(b,stepcomm_frames.frame):
+            return False
+        return isinstance(a,str) == isinstance(b,str)
+    def put(self,item,block=True,timeout=None):
+        if self.stamp:
+            with self.mutex:
+                item = (self.seq,time.monotonic(),item)
+                self.seq += len(item[2])
+        if self.policy == 'block' or self.policy == 'drop-newest':
+            try:
+                if self.policy == 'block':
+                    queue.Queue.put(self,item,block,self.timeout if timeout is None else timeout)
+                else:
+                    queue.Queue.put(self,item,False)
+            except queue.Full:
+                self.drop(item)
+                return
+        else:
+            with self.not_full:
+                if self.maxsize > 0 and self._qsize() >= self.maxsize:
+                    last = self.queue[-1]
+                    if self.policy == 'coalesce' and self.stamp and self.joinable(last[2],item[2]):
+                        self.queue[-1] = (last[0],last[1],last[2] + item[2])
+                        return
+                    if self.policy == 'coalesce' and not self.stamp and self.joinable(last,item):
+                        self.queue[-1] = last + item
+                        return
+                    self.drop(self._get())
+                    #the dropped item never gets its task_done()
+                    self.unfinished_tasks -= 1
+                    if self.unfinished_tasks == 0:
+                        self.all_tasks_done.notify_all()
+                self._put(item)
+                self.unfinished_tasks += 1
+                self.not_empty.notify()
+        qsize = self.qsize()
+        if qsize > self.high_water:
+            self.high_water = qsize
+
+
+class perf_counters:
+    #counters on the RX/TX hot paths of one serial_engine. Each counter is only added to
+    # by one thread (rx_bytes and in_waiting_max by the reader, tx_bytes by the tx
+    # thread, tick() and render() by the GUI), so there are no locks on the hot paths.
+    # sample() turns them into rates and maxima since the previous sample and passes the
+    # result to every function in hooks, which is how the numbers get exported
+    def __init__(self):
+        self.rx_bytes = 0
+        self.tx_bytes = 0
+        self.in_waiting_max = 0 # most bytes waiting in the driver at one read
+        self.ticks = 0 # GUI polls (port_in) and the time they took
+        self.tick_s = 0.0
+        self.tick_max = 0.0
+        self.renders = 0 # chunks shown, and how long they waited to be shown
+        self.render_lag_s = 0.0
+        self.render_lag_max = 0.0
+        self.hooks = []
+        self.last = None # (time,rx_bytes,tx_bytes) of the previous sample
+    def tick(self,seconds):
+        self.ticks += 1
+        self.tick_s += seconds
+        if seconds > self.tick_max:
+            self.tick_max = seconds
+    def render(self,lag):
+        self.renders += 1
+        self.render_lag_s += lag
+        if lag > self.render_lag_max:
+            self.render_lag_max = lag
+    def sample(self,q=None,dropped=0,extra=None):
+        #dict of the counters, q is the data_from_device_q and dropped the bytes it lost,
+        # extra is added as it is
+        now = time.monotonic()
+        rx,tx = self.rx_bytes,self.tx_bytes
+        last = self.last or (now,rx,tx)
+        dt = max(now - last[0],1e-6)
+        s = {'time':time.time(),'rx_bytes':rx,'tx_bytes':tx,
+                'rx_bps':(rx - last[1])/dt,'tx_bps':(tx - last[2])/dt,
+                'in_waiting_max':self.in_waiting_max,
+                'queue_depth':q.qsize() if q is not None else 0,
+                'queue_high_water':getattr(q,'high_water',0),
+                'queue_dropped_bytes':dropped,
+                'tick_ms':self.tick_s/self.ticks*1000 if self.ticks else 0.0,
+                'tick_max_ms':self.tick_max*1000,
+                'render_lag_ms':self.render_lag_s/self.renders*1000 if self.renders else 0.0,
+                'render_lag_max_ms':self.render_lag_max*1000}
+        if extra:
+            s.update(extra)
+        self.last = (now,rx,tx)
+        self.in_waiting_max = 0
+        self.ticks = self.renders = 0
+        self.tick_s = self.tick_max = self.render_lag_s = self.render_lag_max = 0.0
+        for hook in self.hooks:
+            hook(s)
+        return s
+    def summary(self,s):
+        #one line for a status bar
+        frames = ''
+        if 'frames' in s:
+            frames = '  frames {:d} ({:d} malformed)'.format(s['frames'],s['frames_malformed'])
+        return 'RX {:.1f} kB/s  TX {:.1f} kB/s  in_waiting max {:d}  queue {:d} ({:d} B dropped)  ' \
+                'tick {:.2f}/{:.2f} ms  render lag {:.1f}/{:.1f} ms'.format(
+                s['rx_bps']/1000,s['tx_bps']/1000,s['in_waiting_max'],s['queue_depth'],
+                s['queue_dropped_bytes'],s['tick_ms'],s['tick_max_ms'],
+                s['render_lag_ms'],s['render_lag_max_ms']) + frames
+
+
+def perf_logger(fn):
+    #a perf_counters hook appending every sample to fn as a line of json.
+    # Raises OSError when the file can't be opened
+    file = open(fn,'a')
+    def hook(s):
+        try:
+            file.write(json.dumps(s) + '\n')
+            file.flush()
+        except (OSError,ValueError):
+            pass # full disk or closed at exit, the terminal keeps going
+    return hook
+
+
+class queue_feeder(threading.Thread):
+    #drains data_to_device_q into the tx_engine. Everything waiting on the queue is
+    # collected into one unpaced tx_job, up to batch bytes, so many small items cost
+    # one write. newline is called once per batch to get the current TX newline, encode
+    # turns str items into bytes.
+    def __init__(self,q,tx,newline=None,batch=1<<16,encode=None):
+        threading.Thread.__init__(self,name='queue_feeder',daemon=True)
+        self.q = q
+        self.tx = tx
+        self.newline = newline
+        self.batch = batch
+        self.str_encode = encode or (lambda s: s.encode('utf-8'))
+        self.nl = '\r\n'
+        self.nl_re = re.compile('\r\n|\n\r|\r|\n')
+        self.running = True
+    def stop(self):
+        self.running = False
+    def encode(self,item):
+        if isinstance(item,tuple):
+            item = item[2] # stamped (seq,time,data) item
+        if isinstance(item,str):
+            if getattr(self.q,'translate_nl',True):
+                item = self.nl_re.sub(self.nl,item)
+            return self.str_encode(item)
+        return bytes(item)
+    def run(self):
+        while self.running:
+            try:
+                item = self.q.get(timeout=0.1)
+            except queue.Empty:
+                continue
+            if self.newline is not None:
+                self.nl = self.newline()
+            batch = [self.encode(item)]
+            size = len(batch[0])
+            while size < self.batch:
+                try:
+                    item = self.q.get_nowait()
+                except queue.Empty:
+                    break
+                batch.append(self.encode(item))
+                size += len(batch[-1])
+            self.tx.send(tx_job(b''.join(batch),nl=self.str_encode(self.nl)))
+
+
+class expect_timeout(Exception):
+    pass
+
+
+class expect_result:
+    #what an expectation matched: index into its patterns, the re match object and the
+    # data received between the start of the expectation and the match
+    def __init__(self,index,match,before):
+        self.index = index
+        self.match = match
+        self.before = before
+    def __repr__(self):
+        return 'expect_result({:d},{!r})'.format(self.index,self.match.group())
+
+
+global_flags_re = re.compile(rb'^(?:\(\?[aiLmsux]+\))+')
+
+
+def expect_pattern(p,encoding='utf-8'):
+    #str and bytes are literal strings, compiled regexes are used as they are. Everything
+    # is matched against the raw bytes, str patterns are encoded with encoding.
+    #All patterns end up in one alternation, so regexes can't have named groups or
+    # backreferences, ValueError is raised for those and for what doesn't compile
+    if isinstance(p,str):
+        p = p.encode(encoding,'replace')
+    if isinstance(p,bytes):
+        return re.compile(re.escape(p))
+    try:
+        if isinstance(p.pattern,str):
+            p = re.compile(p.pattern.encode(encoding,'replace'),p.flags & ~re.UNICODE)
+        #leading global flags like (?i) are in p.flags already, rebuild() scopes them
+        bare = global_flags_re.sub(b'',p.pattern)
+        if bare != p.pattern:
+            p = re.compile(bare,p.flags)
+    except re.error as e:
+        raise ValueError('bad expect pattern {!r}: {}'.format(p.pattern,e))
+    if p.groupindex:
+        raise ValueError('named groups are not supported in expect patterns')
+    if has_backref(sre_parse.parse(p.pattern,p.flags)):
+        raise ValueError('backreferences are not supported in expect patterns')
+    return p
+
+
+def has_backref(node):
+    #True when the sre_parse tree node has a backreference anywhere in it
+    if isinstance(node,sre_parse.SubPattern):
+        return any(op in (sre_parse.GROUPREF,sre_parse.GROUPREF_EXISTS) or has_backref(av)
+                for op,av in node)
+    if isinstance(node,(tuple,list)):
+        return any(has_backref(n) for n in node)
+    return False
+
+
+def pattern_width(regex):
+    #longest text the regex can match, None when there is no limit
+    try:
+        width = sre_parse.parse(regex.pattern,regex.flags).getwidth()[1]
+    except Exception:
+        return None
+    return None if width >= sre_parse.MAXREPEAT else width
+
+
+class expectation(concurrent.futures.Future):
+    #one pending expect(). The result is an expect_result, or expect_timeout is raised.
+    # Being a concurrent.futures.Future it can be waited on from any thread with
+    # result(), get callbacks, or be awaited through asyncio.wrap_future()
+    def __init__(self,owner,patterns,since,deadline):
+        concurrent.futures.Future.__init__(self)
+        self.owner = owner
+        self.patterns = patterns
+        self.since = since # stream offset from where the patterns are looked for
+        self.deadline = deadline
+    def cancel(self):
+        self.owner.discard(self)
+        return concurrent.futures.Future.cancel(self)
+
+
+class expecter:
+    #matches the RX stream against the patterns of all pending expectations at once.
+    # The patterns are combined into one compiled alternation, rebuilt only when the set
+    # changes, and each chunk is searched once: the next search starts where the last
+    # one ended, backed up only by the longest possible match so a match split across
+    # chunks is still found. Nothing is buffered while no expectation is pending, and
+    # only data received after expect() counts. A match consumes the data up to its end
+    # for every expectation. Timeouts are run by one timer thread, started when needed.
+    def __init__(self,window=1<<16):
+        self.window = window # most data kept for patterns without a length limit
+        self.encoding = 'utf-8' # of str patterns
+        self.cond = threading.Condition()
+        self.waiting = [] # pending expectations, the first made wins a tie
+        self.owners = [] # (expectation,index) of every group of combined
+        self.combined = None
+        self.overlap = 0
+        self.buf = bytearray()
+        self.pos = 0 # stream offset of buf[0]
+        self.scanned = 0 # stream offset searched up to
+        self.timer = None
+    def expect(self,patterns,timeout=None,callback=None):
+        #patterns is one pattern or a list of them, see expect_pattern(). callback is
+        # called with the expectation when it is done, from the thread that fed the
+        # match (or the timer thread). ValueError is raised for patterns that can't be
+        # used, nothing changes then
+        if isinstance(patterns,(str,bytes,re.Pattern)):
+            patterns = [patterns]
+        compiled = [expect_pattern(p,self.encoding) for p in patterns]
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self.cond:
+            exp = expectation(self,compiled,self.pos + len(self.buf),deadline)
+            #compiled before anything changes, a set that doesn't combine is refused
+            combined = self.combine(self.waiting + [exp])
+            self.waiting.append(exp)
+            self.combined,self.owners,self.overlap = combined
+            if deadline is not None:
+                if self.timer is None:
+                    self.timer = threading.Thread(target=self.run_timer,name='expect_timer',
+                            daemon=True)
+                    self.timer.start()
+                else:
+                    self.cond.notify()
+        if callback is not None:
+            exp.add_done_callback(callback)
+        return exp
+    def discard(self,exp):
+        with self.cond:
+            if exp in self.waiting:
+                self.waiting.remove(exp)
+                self.rebuild()
+    def rebuild(self):
+        #called with the lock held whenever waiting changes
+        if not self.waiting:
+            self.combined = None
+            self.owners = []
+            self.pos += len(self.buf)
+            self.buf = bytearray()
+            self.scanned = self.pos
+            return
+        self.combined,self.owners,self.overlap = self.combine(self.waiting)
+    def combine(self,waiting):
+        #(combined,owners,overlap) for the patterns of waiting. Raises ValueError when
+        # they don't compile together
+        alts = []
+        owners = []
+        overlap = 0
+        for exp in waiting:
+            for index,p in enumerate(exp.patterns):
+                flags = ''.join(f for f,v in (('i',re.I),('m',re.M),('s',re.S),('x',re.X))
+                        if p.flags & v)
+                scoped = b'(?' + flags.encode() + b':' + p.pattern + b')' if flags else p.pattern
+                alts.append(b'(?P<p' + str(len(owners)).encode() + b'>' + scoped + b')')
+                owners.append((exp,index))
+                width = pattern_width(p)
+                overlap = max(overlap,self.window if width is None else width - 1)
+        try:
+            return re.compile(b'|'.join(alts)),owners,overlap
+        except re.error as e:
+            raise ValueError('expect patterns can not be combined: {}'.format(e))
+    def feed(self,l):
+        #called with every chunk received
+        if not self.waiting:
+            return
+        done = []
+        with self.cond:
+            if not self.waiting:
+                return
+            self.buf += l
+            i = max(self.scanned - self.overlap - self.pos,0)
+            while self.combined is not None:
+                m = self.combined.search(self.buf,i)
+                if m is None:
+                    break
+                exp,index = self.owners[int(m.lastgroup[1:])]
+                if m.start() + self.pos < exp.since:
+                    #older text than the expectation, the pattern may match later on
+                    i = m.start() + 1
+                    continue
+                #the result gets its own copy, buf keeps changing
+                b0 = max(exp.since - self.pos,0)
+                seg = bytes(self.buf[b0:])
+                match = exp.patterns[index].match(seg,m.start() - b0)
+                done.append((exp,expect_result(index,match,seg[:m.start() - b0])))
+                self.waiting.remove(exp)
+                #the match is consumed, nobody looks at it again
+                cut = max(m.end(),m.start() + 1)
+                del self.buf[:cut]
+                self.pos += cut
+                i = 0
+                for other in self.waiting:
+                    other.since = max(other.since,self.pos)
+                self.rebuild()
+            if self.waiting:
+                self.scanned = self.pos + len(self.buf)
+                #trimmed in big steps so a trickle of small chunks doesn't move it each time
+                keep = max(self.overlap,self.window)
+                if len(self.buf) > 2*keep:
+                    cut = len(self.buf) - keep
+                    del self.buf[:cut]
+                    self.pos += cut
+        for exp,result in done:
+            try:
+                exp.set_result(result)
+            except concurrent.futures.InvalidStateError:
+                pass # cancelled meanwhile
+    def run_timer(self):
+        while True:
+            with self.cond:
+                now = time.monotonic()
+                timed = [e for e in self.waiting if e.deadline is not None]
+                if not timed:
+                    self.timer = None
+                    return
+                expired = [e for e in timed if e.deadline <= now]
+                if not expired:
+                    self.cond.wait(min(e.deadline for e in timed) - now)
+                    continue
+                for exp in expired:
+                    self.waiting.remove(exp)
+                self.rebuild()
+            for exp in expired:
+                try:
+                    exp.set_exception(expect_timeout('none of {} seen'.format(
+                            [p.pattern for p in exp.patterns])))
+                except concurrent.futures.InvalidStateError:
+                    pass
+
+
+class serial_engine:
+    #one serial port with everything needed to use it from other threads: the reader
+    # thread (or poll() for callers that poll), the transmit engine, the queues, live
+    # capture and the newline state. on_rx is called with every chunk read and on_sent
+    # with every block written, both from the engine threads. With detect_nl set the RX
+    # data runs through rx_nl here to track the AUTO newline style, a GUI that feeds
+    # rx_nl itself while displaying clears it.
+    def __init__(self,data_from_device_q=None,data_to_device_q=None,on_rx=None,on_sent=None):
+        self.data_from_device_q = data_from_device_q # queue; bytes from device are writtem there
+        self.data_to_device_q = data_to_device_q # queue; str or bytes put there are sent to the device
+        self.on_rx = on_rx
+        self.rx_q_dropped = 0 # bytes dropped because a plain queue.Queue was full
+        self.frames = None # stepcomm_frames decoder, None passes the chunks on as read
+        self.frames_name = 'NONE'
+        self.perf = perf_counters()
+        self.comport = serial.Serial()
+        self.rx_reader = None # serial_reader thread, None when the port is polled
+        self.rx_timeout = 0.05 # blocking read timeout used by the reader thread
+        self.capture = None # capture_writer while a live capture is running
+        self.event_log = None # stepcomm_eventlog.event_log while events are recorded
+        self.txnl = nl_styles[0]
+        self.rx_nl = newline_state(detect=True)
+        self.detect_nl = True
+        self.expecter = expecter() # patterns waited for in the RX stream
+        self.tx_nl_re = re.compile('\r\n|\n\r|\r|\n')
+        self.tx_lock = threading.Lock()
+        self.set_encoding('utf-8')
+        self.tx = tx_engine(on_sent=on_sent) # writes everything sent to the comport
+        self.tx.perf = self.perf
+        self.feeder = None # queue_feeder for data_to_device_q
+        if self.data_to_device_q is not None:
+            self.feeder = queue_feeder(self.data_to_device_q,self.tx,newline=self.tx_newline,
+                    encode=self.encode)
+            self.feeder.start()
+    def open(self,port,baud='115200',parity='NONE',databits='8',stopbits='1'):
+        #(re)open the port, settings are the strings shown in the GUI. Raises
+        # serial.SerialException or ValueError when the port can't be opened
+        pv = parity_consts[parity_strings.index(parity)]
+        dv = databit_consts[databit_strings.index(databits)]
+        sv = stopbit_consts[stopbit_strings.index(stopbits)]
+        if self.comport.is_open:
+            self.comport.close()
+        #the reader thread needs blocking reads, polling needs reads that never block
+        timeout = self.rx_timeout if self.rx_reader else 0
+        try:
+            #serial_for_url opens plain port names like serial.Serial does, and also
+            # pyserial urls such as loop:// or socket://host:port. replay:// plays back
+            # a recording, see stepcomm_replay
+            if port.startswith('replay://'):
+                import stepcomm_replay
+                opener = stepcomm_replay.replay_port
+            else:
+                opener = serial.serial_for_url
+            self.comport = opener(port,baudrate=int(baud),bytesize=dv,
+                    stopbits=sv, parity=pv, timeout=timeout, write_timeout=0.2)
+        finally:
+            if self.rx_reader:
+                self.rx_reader.set_port(self.comport)
+            self.tx.set_port(self.comport)
+    def set_rxthread(self,on):
+        #switch between polling the comport and reading it from a serial_reader thread
+        if on and self.rx_reader is None:
+            self.rx_reader = serial_reader(self.rx_dispatch,timeout=self.rx_timeout,perf=self.perf)
+            if self.comport.is_open:
+                self.comport.timeout = self.rx_timeout
+            self.rx_reader.set_port(self.comport)
+            self.rx_reader.start()
+        elif not on and self.rx_reader is not None:
+            self.rx_reader.stop()
+            self.rx_reader = None
+            if self.comport.is_open:
+                self.comport.timeout = 0
+    def poll(self,budget=0):
+        #read whatever is waiting when there is no reader thread, returns the number of
+        # bytes read. With a budget (seconds) it keeps reading until the driver has
+        # nothing left or the budget is used up, so one poll keeps up with fast ports.
+        # Raises serial.SerialException or OSError when the read fails
+        got = 0
+        if self.rx_reader is None and self.comport.is_open:
+            end = time.monotonic() + budget
+            while True:
+                inlen = self.comport.in_waiting
+                if inlen <= 0:
+                    break
+                if inlen > self.perf.in_waiting_max:
+                    self.perf.in_waiting_max = inlen
+                l = self.comport.read(inlen)
+                if not l:
+                    break
+                self.rx_dispatch(l)
+                got += len(l)
+                if time.monotonic() >= end:
+                    break
+        return got
+    def rx_dispatch(self,l):
+        #called with every chunk read from the comport, either from poll() or from
+        # the reader thread
+        self.perf.rx_bytes += len(l)
+        dec = self.frames
+        items = (l,) if dec is None else dec.feed(l)
+        # write bytes from device to other thread(s)
+        q = self.data_from_device_q
+        if isinstance(q,device_queue):
+            #the queue applies its own overflow policy and keeps the drop counters
+            for item in items:
+                q.put(item)
+        elif q is not None:
+            for item in items:
+                try:
+                    q.put_nowait(item)
+                except queue.Full:
+                    self.rx_q_dropped += len(item)
+        cap = self.capture
+        if cap is not None:
+            cap.write(l)
+        log = self.event_log
+        if log is not None:
+            log.rx(l)
+        if self.detect_nl:
+            self.rx_nl.feed(l.decode('latin-1'))
+        self.expecter.feed(l)
+        if self.on_rx is not None:
+            for item in items:
+                self.on_rx(item)
+    def set_frames(self,name):
+        #deliver frames of one of stepcomm_frames.decoder_names, NONE for the raw chunks.
+        # Raises ValueError for an unknown name
+        self.frames = stepcomm_frames.make_decoder(name)
+        self.frames_name = name.strip().upper()
+    def expect(self,patterns,timeout=None,callback=None):
+        #wait for the device to send one of patterns, see expecter.expect(). Only data
+        # received from now on counts, so expect before sending what triggers the answer
+        return self.expecter.expect(patterns,timeout=timeout,callback=callback)
+    def send_expect(self,txt,patterns,timeout=None,callback=None,**kw):
+        #send txt and wait for the answer, without missing a fast one
+        exp = self.expect(patterns,timeout=timeout,callback=callback)
+        self.send_text(txt,**kw)
+        return exp
+    def tx_newline(self):
+        style = self.txnl
+        if style == "AUTO   ":
+            style = self.rx_nl.autostyle
+        if style == 'UNIX   ':
+            return '\n'
+        elif style == 'OLD MAC':
+            return '\r'
+        return '\r\n'
+    def set_encoding(self,encoding):
+        #the codec of text sent and shown. Raises LookupError for an unknown codec
+        codecs.lookup(encoding)
+        with self.tx_lock:
+            self.encoding = encoding
+            self.tx_encoder = codecs.getincrementalencoder(encoding)(errors='replace')
+            self.nl_bytes = {}
+        self.expecter.encoding = encoding
+    def decoder(self):
+        #a new incremental decoder for the text received (or echoed), it keeps the bytes
+        # of a character split across reads until the rest arrives
+        return codecs.getincrementaldecoder(self.encoding)(errors='replace')
+    def encode(self,txt):
+        #all text sent goes through one incremental encoder, so a stateful codec sees it
+        # as one stream (a utf-16 BOM is only sent once)
+        with self.tx_lock:
+            return self.tx_encoder.encode(txt)
+    def encode_nl(self,nl):
+        #the bytes of a newline in the middle of the stream, for line_delay
+        b = self.nl_bytes.get(nl)
+        if b is None:
+            enc = codecs.getincrementalencoder(self.encoding)(errors='replace')
+            enc.encode('\n')
+            b = self.nl_bytes[nl] = enc.encode(nl)
+        return b
+    def tx_translate(self,txt,nl=None):
+        #CR, LF, CR/LF and LF/CR all become one TX newline, done once for the whole string
+        if nl is None:
+            nl = self.tx_newline()
+        return self.encode(self.tx_nl_re.sub(nl,txt))
+    def send_text(self,txt,char_delay=0,line_delay=0):
+        #queue a string for the transmit engine, delays are in seconds
+        nl = self.tx_newline()
+        return self.tx.send(tx_job(self.tx_translate(txt,nl),char_delay=char_delay,
+                line_delay=line_delay,nl=self.encode_nl(nl)))
+    def send_file(self,filename,binary=False,use_mmap=False,char_delay=0,line_delay=0):
+        #queue a file for the transmit engine. Raises OSError when it can't be opened.
+        # A text file is sent in the TX encoding like typed text
+        nl = self.tx_newline()
+        return self.tx.send(tx_file_job(filename,binary=binary,use_mmap=use_mmap,
+                char_delay=char_delay,line_delay=line_delay,nl=self.encode_nl(nl),
+                translate=lambda t: self.tx_translate(t,nl)))
+    def start_capture(self,filename,fsync_s=0,rotate_bytes=0,rotate_s=0):
+        #live capture, every raw byte read from the port is appended to the capture file.
+        # Raises OSError when the file can't be opened
+        cap = capture_writer(filename,fsync_s=fsync_s,rotate_bytes=rotate_bytes,rotate_s=rotate_s)
+        cap.start()
+        self.capture = cap
+        return cap
+    def start_eventlog(self,filename):
+        #record every chunk received and sent with its time, see stepcomm_eventlog.
+        # Raises OSError when the file can't be opened
+        import stepcomm_eventlog
+        self.stop_eventlog()
+        log = stepcomm_eventlog.event_log(filename)
+        log.start()
+        self.event_log = log
+        self.tx.log = log
+        return log
+    def stop_eventlog(self):
+        log = self.event_log
+        self.event_log = None
+        self.tx.log = None
+        if log is not None:
+            log.stop()
+        return log
+    def perf_sample(self):
+        #sample the perf counters with the state of data_from_device_q
+        q = self.data_from_device_q
+        dropped = q.dropped_bytes if isinstance(q,device_queue) else self.rx_q_dropped
+        dec = self.frames
+        return self.perf.sample(q,dropped,None if dec is None else dec.stats())
+    def stop_capture(self):
+        cap = self.capture
+        self.capture = None
+        if cap is not None:
+            cap.stop()
+        return cap
+    def stop(self):
+        self.set_rxthread(False)
+        if self.feeder is not None:
+            self.feeder.stop()
+        self.tx.stop()
+        if self.capture is not None:
+            self.stop_capture()
+        self.stop_eventlog()
+        try:
+            self.comport.close()
+        except:
+            pass
+
+
+def add_arguments(parser):
+    #command line options shared by the GUI and headless mode
+    parser.add_argument('-b','--baud', help='baud rate',choices=bauds)
+    parser.add_argument('-p','--port', help='port name')
+    parser.add_argument('-e','--echo', help='echo ON or OFF')
+    parser.add_argument('--encoding', help='codec of the text sent and shown, default utf-8')
+    parser.add_argument('-i','--ini', help='ini file name')
+    parser.add_argument('-r','--rxthread', help='read the port from a background thread',
+            action='store_true')
+    parser.add_argument('--mmap', help='read files to send through mmap',action='store_true')
+    parser.add_argument('-c','--capture', help='start a live capture to this file')
+    parser.add_argument('--capsync', help='seconds between fsyncs of a live capture',type=float)
+    parser.add_argument('--caprotate-mb', help='rotate live capture files at this size',type=int)
+    parser.add_argument('--caprotate-min', help='rotate live capture files at this age',type=float)
+    parser.add_argument('--eventlog', help='record all RX/TX data with time stamps to this file')
+    parser.add_argument('--perflog', help='append the perf counters to this file every second, as json lines')
+    parser.add_argument('--headless', help='run without the GUI, bridging stdin/stdout to the port',
+            action='store_true')
+    parser.add_argument('--sessions', help='open all the ports listed in this sessions file')
+    parser.add_argument('--iothreads', help='threads reading the ports of a sessions file',
+            type=int,default=1)
+    parser.add_argument('--frames', help='pass whole frames on instead of the chunks read',
+            type=str.upper,choices=stepcomm_frames.decoder_names)
+    parser.add_argument('--raw', help='headless: pass stdin to the port without newline translation',
+            action='store_true')
+    parser.add_argument('--duration', help='headless: stop after this many seconds',type=float)
+    parser.add_argument('--macro', help='headless: run this @script file and exit')
+
+
+def load_settings(fn):
+    #read a StepComm ini file, returns the settings dict. Raises OSError or ValueError
+    with open(fn.strip(),'r') as file:
+        jdict = json.loads(file.read())
+    if jdict.get('title') != 'StepComm: saved settings':
+        raise ValueError('file ' + fn + ' is not valid Stepcomm ini file')
+    return jdict
+
+
+def stdin_reader(q,raw):
+    #headless: everything typed or piped in goes to data_to_device_q
+    if raw:
+        while True:
+            b = sys.stdin.buffer.read1(65536)
+            if not b:
+                break
+            q.put(b)
+    else:
+        for line in sys.stdin:
+            q.put(line)
+
+
+def main(argv=None):
+    #headless serial bridge: device data goes to stdout, stdin goes to the device
+    parser = argparse.ArgumentParser(description='StepComm - Simple Terminal Emulator in Python')
+    add_arguments(parser)
+    args,unknown = parser.parse_known_args(argv)
+    if args.sessions != None:
+        import stepcomm_sessions
+        return stepcomm_sessions.main(args)
+    settings = {'port':'','baud':'115200','parity':'NONE','databits':'8','stopbits':'1',
+            'txnl':nl_styles[0],'txnl_autostyle':'WINDOWS'}
+    if args.ini != None:
+        try:
+            settings.update(load_settings(args.ini))
+        except (OSError,ValueError) as err:
+            print('failed to load ini file {}: {}'.format(args.ini,err),file=sys.stderr)
+            return 1
+    #command line options override the ini file
+    if args.port != None:
+        settings['port'] = args.port
+    if args.baud != None:
+        settings['baud'] = args.baud
+    from_q = device_queue()
+    to_q = device_queue()
+    engine = serial_engine(data_from_device_q=from_q,data_to_device_q=to_q)
+    engine.txnl = settings['txnl']
+    engine.rx_nl.autostyle = settings['txnl_autostyle']
+    try:
+        engine.set_encoding(args.encoding or settings.get('encoding','utf-8'))
+    except LookupError as err:
+        print(err,file=sys.stderr)
+        engine.stop()
+        return 1
+    try:
+        engine.set_frames(args.frames or settings.get('frames','NONE'))
+    except ValueError as err:
+        print(err,file=sys.stderr)
+        engine.stop()
+        return 1
+    engine.set_rxthread(True)
+    try:
+        engine.open(settings['port'],settings['baud'],settings['parity'],
+                settings['databits'],settings['stopbits'])
+    except (serial.SerialException,ValueError) as err:
+        print("Failed to open port '{}': {}".format(settings['port'],err),file=sys.stderr)
+        engine.stop()
+        return 1
+    print('port {},{},{},{},{}'.format(settings['port'],settings['baud'],settings['parity'],
+            settings['databits'],settings['stopbits']),file=sys.stderr)
+    if args.capture != None:
+        try:
+            engine.start_capture(args.capture,fsync_s=args.capsync or 0,
+                    rotate_bytes=(args.caprotate_mb or 0)*1024*1024,
+                    rotate_s=(args.caprotate_min or 0)*60)
+        except OSError as err:
+            print('failed to open capture file {}: {}'.format(args.capture,err),file=sys.stderr)
+    if args.eventlog != None:
+        try:
+            engine.start_eventlog(args.eventlog)
+        except OSError as err:
+            print('failed to open event log {}: {}'.format(args.eventlog,err),file=sys.stderr)
+    next_sample = None
+    if args.perflog != None:
+        try:
+            engine.perf.hooks.append(perf_logger(args.perflog))
+            next_sample = time.monotonic() + 1
+        except OSError as err:
+            print('failed to open perf log {}: {}'.format(args.perflog,err),file=sys.stderr)
+    runner = None
+    if args.macro != None:
+        import stepcomm_macro
+        try:
+            runner = stepcomm_macro.macro_runner(engine,stepcomm_macro.load_macro(args.macro))
+        except (OSError,ValueError) as err:
+            print('failed to load macro {}: {}'.format(args.macro,err),file=sys.stderr)
+            engine.stop()
+            return 1
+        runner.start()
+    else:
+        threading.Thread(target=stdin_reader,args=(to_q,args.raw),name='stdin_reader',
+                daemon=True).start()
+    signal.signal(signal.SIGTERM,lambda signum,frame: sys.exit(0))
+    end = time.monotonic() + args.duration if args.duration else None
+    out = sys.stdout.buffer
+    try:
+        while end is None or time.monotonic() < end:
+            if runner is not None and not runner.is_alive() and from_q.empty():
+                break
+            if next_sample is not None and time.monotonic() >= next_sample:
+                engine.perf_sample()
+                next_sample += 1
+            try:
+                l = from_q.get(timeout=0.1)
+            except queue.Empty:
+                continue
+            if engine.frames is not None:
+                l = stepcomm_frames.frame_bytes(l)
+            out.write(l)
+            out.flush()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if runner is not None:
+            runner.stop()
+        engine.stop()
+    if runner is not None and runner.error is not None:
+        print('macro failed: {}'.format(runner.error),file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    #run from the imported module, so stepcomm_macro and the others share its classes
+    import stepcomm_engine
+    sys.exit(stepcomm_engine.main())
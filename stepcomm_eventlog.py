@@ -0,0 +1,249 @@
+#StepComm event log, time stamped RX/TX records in a compact binary file
+#
+#Copyright (C) 2018  William B Hunter
+#
+#This program is free software: you can redistribute it and/or modify
+#it under the terms of the GNU General Public License as published by
+#the Free Software Foundation, either version 3 of the License, or
+#(at your option) any later version.
+#
+#This program is distributed in the hope that it will be useful,
+#but WITHOUT ANY WARRANTY; without even the implied warranty of
+#MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#GNU General Public License for more details.
+#
+#You should have received a copy of the GNU General Public License
+#along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+#construction Notes:
+#The event log records every chunk read from the port and every block written to it,
+# with the monotonic time it happened. The file is only ever appended to:
+#    header   b'SCEVLOG1', wall clock ns and monotonic ns of the time origin
+#    records  kind (1 byte), ns since the origin (8 bytes), length (4 bytes), data
+#             kind is R (received), T (sent) or I (index)
+#An index record is written every index_bytes of data (and at least every index_s while
+# there is traffic). Its data is b'SCIX', its own file offset, the offset of the index
+# before it and a crc32 of those. Reading can start right after any index record, and
+# since an index checks its own offset and crc it can be found by scanning from any
+# point in the file. The reader uses that to binary search a time range in a multi-GB
+# log with a few seeks, and a log cut short by a crash reads up to the last whole record.
+#The records are put together on a writer thread like the capture file, the time stamp
+# is taken when the event happens, not when it is written.
+#Run this module to export a log:  python stepcomm_eventlog.py LOG [--start S] [--end S]
+import os
+import sys
+import time
+import zlib
+import queue
+import struct
+import argparse
+import threading
+
+file_magic = b'SCEVLOG1'
+file_header = struct.Struct('<8sqq') # magic, wall clock ns, monotonic ns of the origin
+record_header = struct.Struct('<BqI') # kind, ns since the origin, length
+index_magic = b'SCIX'
+index_body = struct.Struct('<4sqq') # magic, own offset, previous index offset
+index_size = record_header.size + index_body.size + 4 # + crc32
+RX = ord('R')
+TX = ord('T')
+INDEX = ord('I')
+
+
+class event_log(threading.Thread):
+    #writes the event log, record() can be called from any thread
+    def __init__(self,filename,index_bytes=1<<20,index_s=1.0,batch=1<<20):
+        threading.Thread.__init__(self,name='event_log',daemon=True)
+        self.filename = filename
+        self.index_bytes = index_bytes
+        self.index_s = index_s
+        self.batch = batch
+        self.q = queue.SimpleQueue()
+        self.error = None
+        self.written = 0
+        self.file = open(filename,'wb')
+        self.origin = time.monotonic_ns()
+        self.file.write(file_header.pack(file_magic,time.time_ns(),self.origin))
+        self.pos = file_header.size
+        self.last_index = -1
+    def record(self,kind,data):
+        self.q.put((kind,time.monotonic_ns(),data))
+    def rx(self,data):
+        self.record(RX,data)
+    def tx(self,data):
+        self.record(TX,data)
+    def stop(self):
+        self.q.put(None)
+        self.join()
+    def index(self,t):
+        body = index_body.pack(index_magic,self.pos,self.last_index)
+        self.last_index = self.pos
+        return record_header.pack(INDEX,t,len(body) + 4) + body + \
+                struct.pack('<I',zlib.crc32(body))
+    def run(self):
+        since_index = self.index_bytes # start with an index
+        index_t = 0
+        running = True
+        while running:
+            item = self.q.get()
+            batch = []
+            pending = 0
+            while item is not None:
+                kind,t,data = item
+                t -= self.origin
+                if since_index >= self.index_bytes or t - index_t >= self.index_s*1e9:
+                    batch.append(self.index(t))
+                    self.pos += index_size
+                    pending += index_size
+                    since_index = 0
+                    index_t = t
+                rec = record_header.pack(kind,t,len(data))
+                batch.append(rec)
+                batch.append(data)
+                size = len(rec) + len(data)
+                self.pos += size
+                pending += size
+                since_index += size
+                if pending >= self.batch:
+                    break
+                try:
+                    item = self.q.get_nowait()
+                except queue.Empty:
+                    break
+            running = item is not None
+            try:
+                self.file.write(b''.join(batch))
+                self.file.flush()
+                self.written += pending
+            except OSError as err:
+                self.error = err
+                break
+        self.file.close()
+
+
+class event_log_reader:
+    #reads an event log without loading it. Times are in seconds since the start of the
+    # log, wall_time() turns them into time.time() values
+    def __init__(self,filename):
+        self.file = open(filename,'rb')
+        magic,self.wall_ns,self.origin = file_header.unpack(self.file.read(file_header.size))
+        if magic != file_magic:
+            raise ValueError(filename + ' is not a StepComm event log')
+        self.size = os.fstat(self.file.fileno()).st_size
+    def close(self):
+        self.file.close()
+    def wall_time(self,t):
+        return self.wall_ns/1e9 + t
+    def read_index(self,pos):
+        #(time ns,offset after it,offset of the index before) of a valid index record at
+        # pos, or None
+        self.file.seek(pos)
+        b = self.file.read(index_size)
+        if len(b) < index_size:
+            return None
+        kind,t,length = record_header.unpack_from(b)
+        body = b[record_header.size:-4]
+        magic,own,prev = index_body.unpack(body)
+        if kind != INDEX or magic != index_magic or own != pos or \
+                struct.unpack('<I',b[-4:])[0] != zlib.crc32(body):
+            return None
+        return t,pos + index_size,prev
+    def next_index(self,pos,scan=1<<16):
+        #the first index record at or after pos, as (offset,) + read_index()
+        magic_at = record_header.size # where the magic is inside an index record
+        while pos < self.size:
+            self.file.seek(pos + magic_at)
+            chunk = self.file.read(scan + len(index_magic))
+            i = chunk.find(index_magic)
+            while i >= 0:
+                found = self.read_index(pos + i)
+                if found is not None:
+                    return (pos + i,) + found
+                i = chunk.find(index_magic,i + 1)
+            if len(chunk) <= len(index_magic):
+                break
+            pos += scan
+        return None
+    def seek_time(self,t):
+        #offset to start reading from so no record at or after time t (seconds) is missed
+        target = int(t*1e9)
+        lo,hi = file_header.size,self.size
+        best = None
+        while hi - lo > index_size:
+            mid = (lo + hi)//2
+            found = self.next_index(mid)
+            if found is None or found[1] >= target:
+                hi = mid
+            else:
+                best = found
+                lo = found[2]
+        if best is None:
+            return file_header.size
+        #records of different threads can be a little out of order, start one index early
+        return best[3] if best[3] >= 0 else best[0]
+    def records(self,start=None,end=None,kinds=(RX,TX)):
+        #yields (seconds since the start,kind,data) of the records from start to end
+        pos = file_header.size if start is None else self.seek_time(start)
+        lo = None if start is None else int(start*1e9)
+        hi = None if end is None else int(end*1e9)
+        late = 0
+        self.file.seek(pos)
+        read = self.file.read
+        while True:
+            head = read(record_header.size)
+            if len(head) < record_header.size:
+                return
+            kind,t,length = record_header.unpack(head)
+            data = read(length)
+            if len(data) < length:
+                return # cut short, the writer did not finish this record
+            if hi is not None and t > hi:
+                #a few records of another thread may still be in range
+                late += 1
+                if kind == INDEX or late > 64:
+                    return
+                continue
+            if kind in kinds and (lo is None or t >= lo):
+                yield t/1e9,kind,data
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='StepComm event log exporter')
+    parser.add_argument('log', help='event log file')
+    parser.add_argument('--start', help='seconds from the start of the log',type=float)
+    parser.add_argument('--end', help='seconds from the start of the log',type=float)
+    parser.add_argument('--dir', help='only RX or TX records',choices=('RX','TX'))
+    parser.add_argument('--format', help='text lines (default), hex, or raw bytes to stdout',
+            choices=('text','hex','raw'),default='text')
+    parser.add_argument('--wall', help='print wall clock times',action='store_true')
+    args = parser.parse_args(argv)
+    try:
+        log = event_log_reader(args.log)
+    except (OSError,ValueError,struct.error) as err:
+        print('failed to open event log {}: {}'.format(args.log,err),file=sys.stderr)
+        return 1
+    kinds = (RX,TX) if args.dir is None else (ord(args.dir[0]),)
+    out = sys.stdout.buffer
+    try:
+        for t,kind,data in log.records(args.start,args.end,kinds):
+            if args.format == 'raw':
+                out.write(data)
+                continue
+            if args.wall:
+                wall = log.wall_time(t)
+                stamp = time.strftime('%Y-%m-%d %H:%M:%S',time.localtime(wall)) + \
+                        '.{:06d}'.format(int(wall % 1 * 1e6))
+            else:
+                stamp = '{:.6f}'.format(t)
+            text = data.hex(' ') if args.format == 'hex' else repr(data)[2:-1]
+            out.write('{} {}X {}\n'.format(stamp,chr(kind),text).encode('utf-8'))
+    except BrokenPipeError:
+        pass
+    finally:
+        log.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,247 @@
+#StepComm frames, decoders that turn the RX byte stream into frames
+#
+#Copyright (C) 2018  William B Hunter
+#
+#This program is free software: you can redistribute it and/or modify
+#it under the terms of the GNU General Public License as published by
+#the Free Software Foundation, either version 3 of the License, or
+#(at your option) any later version.
+#
+#This program is distributed in the hope that it will be useful,
+#but WITHOUT ANY WARRANTY; without even the implied warranty of
+#MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#GNU General Public License for more details.
+#
+#You should have received a copy of the GNU General Public License
+#along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+#construction Notes:
+#A serial_engine with a frame decoder (serial_engine.set_frames) passes whole frames to
+# data_from_device_q and on_rx instead of the chunks read from the port. Capture, the
+# event log and expect still see the raw bytes.
+#The decoders:
+#    LINE     lines ending in LF, a CR before the LF is dropped
+#    SLIP     RFC 1055, END (C0) delimited with ESC (DB) DC/DD escapes
+#    COBS     consistent overhead byte stuffing, 00 delimited
+#    LEN8 LEN16 LEN16LE LEN32 LEN32LE
+#             a 1, 2 or 4 byte length (big endian, or little with LE) before each frame
+#Every decoder is incremental: bytes of an unfinished frame are kept until the rest
+# arrives. A chunk without a delimiter (or too short to finish the frame being read)
+# is only appended to a list; once something can be finished, the held bytes are joined
+# and split with bytes.split()/find(), SLIP is unescaped with bytes.replace() and COBS
+# slices whole runs, so Python code runs per frame, never per byte.
+#A frame is a bytes object with a few attributes: start and end are the offsets of the
+# frame in the byte stream (delimiters and header included), time is the monotonic
+# time of the read that finished it and text is True for LINE frames. Code that only
+# wants bytes can ignore them. Frames that don't decode (bad escapes, bad COBS codes,
+# a length over max_frame, more than max_frame bytes without a delimiter) are counted
+# in malformed and their bytes in discarded, they are not passed on.
+import time
+
+decoder_names = ('NONE','LINE','SLIP','COBS','LEN8','LEN16','LEN16LE','LEN32','LEN32LE')
+
+
+class frame(bytes):
+    start = 0
+    end = 0
+    time = 0.0
+    text = False
+
+
+def frame_bytes(f):
+    #the bytes to show for a frame as one line of a terminal: the line itself for LINE
+    # frames, hex for binary ones
+    if f.text:
+        return f + b'\n'
+    return '[{:d}] {}\n'.format(len(f),f.hex(' ')).encode('ascii')
+
+
+class frame_decoder:
+    #the bookkeeping all decoders share. parse(buf,out,t) finds the frames in buf,
+    # appends them with emit() and returns how many bytes of buf it used up
+    text = False
+    def __init__(self,max_frame=1<<16):
+        self.max_frame = max_frame
+        self.held = [] # bytes not used up yet, joined when parse() can use them
+        self.held_len = 0
+        self.offset = 0 # stream offset of the first held byte
+        self.frames = 0
+        self.malformed = 0
+        self.discarded = 0
+        self.skipping = False # dropping the rest of a frame that was too long
+    def ready(self,data):
+        #can data finish a frame? A cheap test so partial frames are not joined again
+        # for every chunk
+        return True
+    def feed(self,data,t=None):
+        #bytes read from the port, returns the list of frames they finished
+        if not self.ready(data):
+            self.held.append(data)
+            self.held_len += len(data)
+            if self.held_len > self.max_frame:
+                self.overflow()
+            return []
+        if t is None:
+            t = time.monotonic()
+        self.held.append(data)
+        buf = b''.join(self.held) if len(self.held) > 1 else data
+        out = []
+        used = self.parse(buf,out,t)
+        rest = buf[used:]
+        self.held = [rest] if rest else []
+        self.held_len = len(rest)
+        self.offset += used
+        if self.held_len > self.max_frame:
+            self.overflow()
+        return out
+    def overflow(self):
+        self.bad(self.held_len)
+        self.offset += self.held_len
+        self.held = []
+        self.held_len = 0
+        self.skipping = True
+    def emit(self,out,payload,start,end,t):
+        f = frame(payload)
+        f.start = self.offset + start
+        f.end = self.offset + end
+        f.time = t
+        f.text = self.text
+        out.append(f)
+        self.frames += 1
+    def bad(self,size):
+        self.malformed += 1
+        self.discarded += size
+    def reset(self):
+        self.offset += self.held_len
+        self.held = []
+        self.held_len = 0
+        self.skipping = False
+    def stats(self):
+        return {'frames':self.frames,'frames_malformed':self.malformed,
+                'frames_discarded_bytes':self.discarded}
+
+
+class delimited_decoder(frame_decoder):
+    #frames end with delim, decode() turns the bytes between two delimiters into the
+    # payload, or None when they are malformed
+    delim = b'\n'
+    skip_empty = True
+    def ready(self,data):
+        return self.delim in data
+    def parse(self,buf,out,t):
+        last = buf.rfind(self.delim)
+        if last < 0:
+            return 0
+        pos = 0
+        dl = len(self.delim)
+        for part in buf[:last].split(self.delim):
+            end = pos + len(part) + dl
+            if self.skipping:
+                self.skipping = False
+                self.discarded += end - pos
+            elif part or not self.skip_empty:
+                if len(part) > self.max_frame:
+                    payload = None
+                else:
+                    payload = self.decode(part)
+                if payload is None:
+                    self.bad(end - pos)
+                else:
+                    self.emit(out,payload,pos,end,t)
+            pos = end
+        return last + dl
+    def decode(self,part):
+        return part
+
+
+class line_decoder(delimited_decoder):
+    text = True
+    skip_empty = False # an empty line is a frame too
+    def decode(self,part):
+        return part[:-1] if part.endswith(b'\r') else part
+
+
+class slip_decoder(delimited_decoder):
+    delim = b'\xc0'
+    def decode(self,part):
+        if b'\xdb' not in part:
+            return part
+        #every ESC must start an ESC END or ESC ESC pair, then the pairs can't overlap
+        # and two replaces undo the escaping
+        if part.count(b'\xdb') != part.count(b'\xdb\xdc') + part.count(b'\xdb\xdd'):
+            return None
+        return part.replace(b'\xdb\xdc',b'\xc0').replace(b'\xdb\xdd',b'\xdb')
+
+
+class cobs_decoder(delimited_decoder):
+    delim = b'\x00'
+    def decode(self,part):
+        runs = []
+        i = 0
+        n = len(part)
+        while i < n:
+            code = part[i]
+            end = i + code
+            if end > n:
+                return None
+            runs.append(part[i+1:end])
+            if code < 0xff and end < n:
+                runs.append(b'\x00')
+            i = end
+        return b''.join(runs)
+
+
+class length_decoder(frame_decoder):
+    #each frame is a length field of size bytes and then that many bytes of payload
+    def __init__(self,size=2,byteorder='big',max_frame=1<<16):
+        frame_decoder.__init__(self,max_frame + size)
+        self.size = size
+        self.byteorder = byteorder
+        self.limit = max_frame
+        self.need = size # held bytes needed before the next frame can be finished
+        self.lost = False # skipping bytes after a bad length
+    def ready(self,data):
+        return self.held_len + len(data) >= self.need
+    def parse(self,buf,out,t):
+        pos = 0
+        n = len(buf)
+        h = self.size
+        while n - pos >= h:
+            length = int.from_bytes(buf[pos:pos+h],self.byteorder)
+            if length > self.limit:
+                #no telling where the next frame starts, try again one byte further on
+                if not self.lost:
+                    self.malformed += 1
+                    self.lost = True
+                self.discarded += 1
+                pos += 1
+                continue
+            if n - pos - h < length:
+                self.need = h + length
+                return pos
+            self.lost = False
+            self.emit(out,buf[pos+h:pos+h+length],pos,pos+h+length,t)
+            pos += h + length
+        self.need = h
+        return pos
+    def reset(self):
+        frame_decoder.reset(self)
+        self.need = self.size
+
+
+def make_decoder(name,max_frame=1<<16):
+    #a new decoder for one of decoder_names, None for NONE. Raises ValueError
+    name = name.strip().upper()
+    if name == 'NONE':
+        return None
+    if name == 'LINE':
+        return line_decoder(max_frame)
+    if name == 'SLIP':
+        return slip_decoder(max_frame)
+    if name == 'COBS':
+        return cobs_decoder(max_frame)
+    if name.startswith('LEN') and name in decoder_names:
+        size = {'8':1,'16':2,'32':4}[name[3:].rstrip('LE')]
+        return length_decoder(size,'little' if name.endswith('LE') else 'big',max_frame)
+    raise ValueError('unknown frame decoder {}'.format(name))
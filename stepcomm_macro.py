@@ -0,0 +1,292 @@
+#StepComm macros, a small script language for the macro slots
+#
+#Copyright (C) 2018  William B Hunter
+#
+#This program is free software: you can redistribute it and/or modify
+#it under the terms of the GNU General Public License as published by
+#the Free Software Foundation, either version 3 of the License, or
+#(at your option) any later version.
+#
+#This program is distributed in the hope that it will be useful,
+#but WITHOUT ANY WARRANTY; without even the implied warranty of
+#MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#GNU General Public License for more details.
+#
+#You should have received a copy of the GNU General Public License
+#along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+#construction Notes:
+#A macro whose first line is @script is a script, anything else is still sent as plain
+# text. A script has one command per line, the command is separated from its argument
+# by one space and the rest of the line is the argument, trailing spaces included:
+#    send TEXT      send TEXT and a newline
+#    put TEXT       send TEXT without a newline
+#    wait TEXT      wait until the device sends TEXT
+#    waitre REGEX   wait until the device sends something matching REGEX
+#    timeout SECS   how long the following waits may take (default 10, 0 for ever)
+#    delay MS       pause for MS milliseconds
+#    repeat [N]     repeat the lines up to the matching 'end' N times (no N: until stopped)
+#    end
+#    include SLOT   run macro slot 1-4, or a script file when SLOT is not a number
+#    # comment
+# TEXT may use the escapes \n \r \t \e \\ and \xNN.
+#Scripts are compiled once into a list of ops and cached per slot, a cached program is
+# reused until the text of its slot (or one it includes) changes. A wait right after a
+# send is registered with the expecter before the send goes out, so an answer that
+# comes back fast is never missed.
+#A macro_runner thread executes the program against a serial_engine: sends go through
+# the tx_engine and are waited for, delays count from the end of the previous step on
+# a monotonic clock. Nothing here needs tkinter.
+import os.path
+import re
+import time
+import threading
+import concurrent.futures
+from stepcomm_engine import expect_timeout,expect_pattern
+
+
+class macro_error(ValueError):
+    #a script that does not compile, or a step that failed while running
+    def __init__(self,source,line,msg):
+        ValueError.__init__(self,'{} line {:d}: {}'.format(source,line,msg))
+        self.source = source
+        self.line = line
+
+
+class macro_stopped(Exception):
+    pass
+
+
+escape_re = re.compile(r'\\(x[0-9a-fA-F]{2}|.)')
+escapes = {'n':'\n','r':'\r','t':'\t','e':'\x1b','\\':'\\'}
+
+
+def unescape(text):
+    return escape_re.sub(lambda m: chr(int(m.group(1)[1:],16)) if len(m.group(1)) == 3
+            else escapes.get(m.group(1),m.group(0)),text)
+
+
+def is_script(text):
+    return text.split('\n',1)[0].strip() == '@script'
+
+
+class macro_program:
+    #a compiled script. ops is a list of [op,source,line,...]:
+    # ('send',source,line,text,expect) expect is None or (patterns,timeout) for the wait
+    #                                  that follows it
+    # ('wait',source,line,patterns,timeout,armed) armed: registered by the send before
+    # ('delay',source,line,seconds)
+    # ('repeat',source,line,count,ops) count None for ever
+    # deps maps every slot or file the program was compiled from to the text (or file
+    # mtime) it had, so the cache can tell when to recompile
+    def __init__(self,ops,deps):
+        self.ops = ops
+        self.deps = deps
+
+
+def compile_macro(text,source,get_text,deps=None,stack=()):
+    #compile a script, source names it in errors ('macro 2' or a file name) and
+    # get_text(slot) returns the text of a macro slot for include. Raises macro_error
+    if deps is None:
+        deps = {}
+    if source in stack:
+        raise macro_error(source,1,'includes itself')
+    stack = stack + (source,)
+    lines = text.split('\n')
+    if not is_script(text):
+        raise macro_error(source,1,'a script starts with @script')
+    blocks = [[]] # ops of the open repeat blocks, innermost last
+    starts = []
+    timeout = 10.0
+    for n,line in enumerate(lines[1:],2):
+        line = line.rstrip('\r')
+        if not line.strip() or line.lstrip().startswith('#'):
+            continue
+        cmd,sep,arg = line.lstrip().partition(' ')
+        cmd = cmd.lower()
+        ops = blocks[-1]
+        try:
+            if cmd in ('send','put'):
+                ops.append(['send',source,n,unescape(arg) + ('\n' if cmd == 'send' else ''),None])
+            elif cmd in ('wait','waitre'):
+                if not arg:
+                    raise ValueError('nothing to wait for')
+                pattern = unescape(arg) if cmd == 'wait' else expect_pattern(re.compile(arg))
+                armed = bool(ops) and ops[-1][0] == 'send'
+                if armed:
+                    ops[-1][4] = ([pattern],timeout or None)
+                ops.append(['wait',source,n,[pattern],timeout or None,armed])
+            elif cmd == 'timeout':
+                timeout = float(arg)
+            elif cmd == 'delay':
+                ops.append(['delay',source,n,float(arg)/1000])
+            elif cmd == 'repeat':
+                count = int(arg) if arg.strip() else None
+                blocks.append([])
+                starts.append((n,count))
+            elif cmd == 'end':
+                if not starts:
+                    raise ValueError("'end' without 'repeat'")
+                body = blocks.pop()
+                start,count = starts.pop()
+                if not body:
+                    raise macro_error(source,start,"'repeat' with nothing to repeat")
+                blocks[-1].append(['repeat',source,start,count,body])
+            elif cmd == 'include':
+                arg = arg.strip()
+                if arg.isdigit():
+                    if not 1 <= int(arg) <= 4:
+                        raise ValueError('no macro slot {}, they are 1 to 4'.format(arg))
+                    inc_source = 'macro ' + arg
+                    inc_text = get_text(int(arg))
+                    deps[int(arg)] = inc_text
+                else:
+                    inc_source = arg
+                    with open(arg,'r') as file:
+                        inc_text = file.read()
+                    deps[arg] = os.path.getmtime(arg)
+                if not is_script(inc_text):
+                    #a plain text macro is sent like the Send button does
+                    ops.append(['send',source,n,inc_text,None])
+                else:
+                    ops.extend(compile_macro(inc_text,inc_source,get_text,deps,stack).ops)
+            else:
+                raise ValueError("unknown command '{}'".format(cmd))
+        except macro_error:
+            raise
+        except (ValueError,IndexError,re.error,OSError) as err:
+            raise macro_error(source,n,str(err))
+    if starts:
+        raise macro_error(source,starts[-1][0],"'repeat' without 'end'")
+    return macro_program(blocks[0],deps)
+
+
+class macro_library:
+    #compiled programs of the macro slots, get_text(slot) returns the current text of a
+    # slot (1 based). A program is compiled again only when its text, or the text of
+    # anything it includes, has changed since
+    def __init__(self,get_text):
+        self.get_text = get_text
+        self.cache = {}
+    def valid(self,prog):
+        for dep,old in prog.deps.items():
+            try:
+                now = self.get_text(dep) if isinstance(dep,int) else os.path.getmtime(dep)
+            except (OSError,IndexError):
+                return False
+            if now != old:
+                return False
+        return True
+    def program(self,slot):
+        prog = self.cache.get(slot)
+        if prog is None or not self.valid(prog):
+            deps = {slot:self.get_text(slot)}
+            prog = compile_macro(deps[slot],'macro {:d}'.format(slot),self.get_text,deps)
+            self.cache[slot] = prog
+        return prog
+
+
+def load_macro(fn):
+    #compile a script file, includes of slot numbers are not available
+    with open(fn,'r') as file:
+        text = file.read()
+    def no_slots(slot):
+        raise ValueError('no macro slots outside the GUI')
+    return compile_macro(text,fn,no_slots,{fn:os.path.getmtime(fn)})
+
+
+class macro_runner(threading.Thread):
+    #runs a macro_program against a serial_engine. error is None when it ran to the end,
+    # macro_stopped when stop() was called, or a macro_error. on_done is called from this
+    # thread at the end. line is the (source,line) being run, for progress reports
+    def __init__(self,engine,program,char_delay=0,line_delay=0,on_done=None):
+        threading.Thread.__init__(self,name='macro_runner',daemon=True)
+        self.engine = engine
+        self.program = program
+        self.char_delay = char_delay
+        self.line_delay = line_delay
+        self.on_done = on_done
+        self.stopping = threading.Event()
+        self.error = None
+        self.line = None
+        self.armed = None # expectation registered by the last send
+        self.clock = 0 # end of the last step, delays count from here
+    def stop(self):
+        self.stopping.set()
+    def run(self):
+        self.clock = time.monotonic()
+        try:
+            self.execute(self.program.ops)
+        except macro_stopped as err:
+            self.error = err
+        except macro_error as err:
+            self.error = err
+        finally:
+            if self.armed is not None:
+                self.armed.cancel()
+            if self.on_done is not None:
+                self.on_done(self)
+    def check(self):
+        if self.stopping.is_set():
+            raise macro_stopped()
+    def execute(self,ops):
+        for op in ops:
+            self.check()
+            kind = op[0]
+            self.line = (op[1],op[2])
+            if kind == 'send':
+                self.send(op)
+            elif kind == 'wait':
+                self.wait(op)
+            elif kind == 'delay':
+                self.delay(op[3])
+            elif kind == 'repeat':
+                count = op[3]
+                while count is None or count > 0:
+                    self.check()
+                    self.execute(op[4])
+                    if count is not None:
+                        count -= 1
+    def send(self,op):
+        text,expect = op[3],op[4]
+        if expect is not None:
+            self.armed = self.engine.expect(expect[0],timeout=expect[1])
+        job = self.engine.send_text(text,char_delay=self.char_delay,line_delay=self.line_delay)
+        while not job.done.wait(0.05):
+            if self.stopping.is_set():
+                if self.engine.tx.job is job:
+                    self.engine.tx.cancel()
+                raise macro_stopped()
+        if job.error is not None:
+            raise macro_error(op[1],op[2],'send failed: {}'.format(job.error))
+        self.clock = time.monotonic()
+    def wait(self,op):
+        patterns,timeout,armed = op[3],op[4],op[5]
+        exp = self.armed if armed else None
+        self.armed = None
+        if exp is None:
+            exp = self.engine.expect(patterns,timeout=timeout)
+        try:
+            while True:
+                try:
+                    exp.result(0.05)
+                    break
+                except concurrent.futures.TimeoutError:
+                    self.check()
+        except expect_timeout:
+            raise macro_error(op[1],op[2],'timed out waiting for {!r}'.format(
+                    getattr(patterns[0],'pattern',patterns[0])))
+        finally:
+            exp.cancel()
+        self.clock = time.monotonic()
+    def delay(self,seconds):
+        #sleep to close to the deadline, spin the last bit like the tx_engine does
+        self.clock += seconds
+        while True:
+            left = self.clock - time.monotonic()
+            if left <= 0:
+                return
+            if left > 0.002:
+                if self.stopping.wait(left - 0.001):
+                    raise macro_stopped()
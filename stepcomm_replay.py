@@ -0,0 +1,207 @@
+#StepComm replay, a virtual serial port that plays back recorded device output
+#
+#Copyright (C) 2018  William B Hunter
+#
+#This program is free software: you can redistribute it and/or modify
+#it under the terms of the GNU General Public License as published by
+#the Free Software Foundation, either version 3 of the License, or
+#(at your option) any later version.
+#
+#This program is distributed in the hope that it will be useful,
+#but WITHOUT ANY WARRANTY; without even the implied warranty of
+#MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#GNU General Public License for more details.
+#
+#You should have received a copy of the GNU General Public License
+#along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+#construction Notes:
+#replay_port is a pyserial port (a SerialBase like the loop:// handler) whose received
+# data comes from a recording instead of a device. serial_engine.open() uses it for
+# port names of the form
+#    replay://FILE?speed=N&loop=1&start=S&end=S&dir=TX
+# so the GUI, headless mode, sessions and the asyncio API can all replay a recording
+# through the same path a real port takes: port_in/the reader thread, rx_dispatch,
+# data_from_device_q, capture, expect.
+#FILE is either an event log (stepcomm_eventlog), replayed with its original timing, or
+# any other file such as a live capture, replayed at the line rate of the port's baud
+# rate (10 bits per byte). speed=N plays N times faster, speed=max as fast as the
+# reader takes it. start/end pick a time range of an event log in seconds, dir=TX plays
+# the sent side instead of the received one, loop=1 starts over at the end.
+#Everything written to the port is thrown away and counted in written.
+import os
+import time
+import serial
+import urllib.parse
+import stepcomm_eventlog
+
+
+class replay_port(serial.SerialBase):
+    backlog = 1<<20 # most data made available ahead of the reader at speed=max
+    def __init__(self,*args,**kwargs):
+        self.speed = 1.0
+        self.repeat = False
+        self.start = None
+        self.end = None
+        self.kind = stepcomm_eventlog.RX
+        self.path = None
+        self.chunks = None
+        self.pending = bytearray()
+        self.next = None # (time,data) of the next chunk, once read from the file
+        self.written = 0
+        self.finished = False
+        serial.SerialBase.__init__(self,*args,**kwargs)
+    def from_url(self,url):
+        parts = urllib.parse.urlsplit(url)
+        if parts.scheme != 'replay':
+            raise serial.SerialException('expected replay://FILE?options, not {!r}'.format(url))
+        self.path = urllib.parse.unquote(parts.netloc + parts.path)
+        try:
+            for option,values in urllib.parse.parse_qs(parts.query,True).items():
+                value = values[0]
+                if option == 'speed':
+                    self.speed = float('inf') if value == 'max' else float(value)
+                    if not self.speed > 0:
+                        raise ValueError('speed must be more than 0')
+                elif option == 'loop':
+                    self.repeat = value not in ('','0')
+                elif option == 'start':
+                    self.start = float(value)
+                elif option == 'end':
+                    self.end = float(value)
+                elif option == 'dir':
+                    self.kind = stepcomm_eventlog.TX if value.upper() == 'TX' else stepcomm_eventlog.RX
+                else:
+                    raise ValueError('unknown option: {!r}'.format(option))
+        except ValueError as err:
+            raise serial.SerialException('bad replay url {!r}: {}'.format(url,err))
+    def read_chunks(self):
+        #(seconds,data) of the recording, read from the file as they are needed
+        with open(self.path,'rb') as file:
+            is_log = file.read(len(stepcomm_eventlog.file_magic)) == stepcomm_eventlog.file_magic
+        if is_log:
+            log = stepcomm_eventlog.event_log_reader(self.path)
+            try:
+                for t,kind,data in log.records(self.start,self.end,(self.kind,)):
+                    yield t,data
+            finally:
+                log.close()
+            return
+        byte_time = 10/(self._baudrate or 9600)
+        with open(self.path,'rb') as file:
+            pos = 0
+            while True:
+                data = file.read(256)
+                if not data:
+                    return
+                pos += len(data)
+                yield pos*byte_time,data
+    def open(self):
+        if self.is_open:
+            raise serial.SerialException("Port is already open.")
+        if self._port is None:
+            raise serial.SerialException("Port must be configured before it can be used.")
+        self.from_url(self.port)
+        if not os.path.isfile(self.path):
+            raise serial.SerialException('could not open port {}: no such file'.format(self.port))
+        self.restart()
+        self.is_open = True
+    def restart(self):
+        self.chunks = self.read_chunks()
+        self.next = None
+        self.first = None # time of the first chunk
+        self.played = 0 # chunks taken from the recording since the restart
+        self.started = time.monotonic()
+        self.finished = False
+    def close(self):
+        self.is_open = False
+        if self.chunks is not None:
+            self.chunks.close()
+            self.chunks = None
+        serial.SerialBase.close(self)
+    def _reconfigure_port(self):
+        pass
+    def _update_dtr_state(self):
+        pass
+    def _update_rts_state(self):
+        pass
+    def _update_break_state(self):
+        pass
+    def fill(self):
+        #move every chunk that is due into pending, returns the seconds until the next
+        # one is due, None at the end of the recording
+        now = time.monotonic()
+        while len(self.pending) < self.backlog:
+            if self.next is None:
+                self.next = next(self.chunks,None)
+                if self.next is None:
+                    if not self.repeat or self.played == 0:
+                        #an empty recording or range would start over forever
+                        self.finished = True
+                        return None
+                    self.restart()
+                    continue
+                self.played += 1
+                if self.first is None:
+                    self.first = self.next[0]
+            t,data = self.next
+            due = self.started + (t - self.first)/self.speed
+            if due > now:
+                return due - now
+            self.pending += data
+            self.next = None
+        return 0
+    @property
+    def in_waiting(self):
+        if not self.is_open:
+            raise serial.PortNotOpenError()
+        self.fill()
+        return len(self.pending)
+    def read(self,size=1):
+        if not self.is_open:
+            raise serial.PortNotOpenError()
+        timeout = self._timeout
+        deadline = None if timeout is None else time.monotonic() + timeout
+        data = bytearray()
+        while self.is_open:
+            wait = self.fill()
+            if self.pending:
+                n = min(size - len(data),len(self.pending))
+                data += self.pending[:n]
+                del self.pending[:n]
+            if len(data) >= size:
+                break
+            left = None if deadline is None else deadline - time.monotonic()
+            if left is not None and left <= 0:
+                break
+            if wait is None:
+                wait = 0.05 # the end, nothing more comes until close()
+            time.sleep(min(x for x in (wait,left,0.05) if x is not None))
+        return bytes(data)
+    def write(self,data):
+        if not self.is_open:
+            raise serial.PortNotOpenError()
+        self.written += len(data)
+        return len(data)
+    def flush(self):
+        pass
+    def reset_input_buffer(self):
+        self.pending.clear()
+    def reset_output_buffer(self):
+        pass
+    @property
+    def out_waiting(self):
+        return 0
+    @property
+    def cts(self):
+        return True
+    @property
+    def dsr(self):
+        return True
+    @property
+    def ri(self):
+        return False
+    @property
+    def cd(self):
+        return True
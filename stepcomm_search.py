@@ -0,0 +1,262 @@
+#StepComm search, an incremental index over everything shown in the terminal
+#
+#Copyright (C) 2018  William B Hunter
+#
+#This program is free software: you can redistribute it and/or modify
+#it under the terms of the GNU General Public License as published by
+#the Free Software Foundation, either version 3 of the License, or
+#(at your option) any later version.
+#
+#This program is distributed in the hope that it will be useful,
+#but WITHOUT ANY WARRANTY; without even the implied warranty of
+#MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#GNU General Public License for more details.
+#
+#You should have received a copy of the GNU General Public License
+#along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+#construction Notes:
+#search_index keeps a copy of the text shown in the terminal (RX and TX, including what
+# was trimmed off the top) in blocks of about block_chars characters. A block always
+# ends after a newline, so a line is never split between blocks and a search only
+# ever has to look at one block at a time. append() is called with every run inserted
+# into the text widget and costs a list append; when a block is full it is sealed:
+# joined into one string, its line count taken and, with ngrams on, the set of all
+# 4 byte sequences of its casefolded utf-8 text stored as a sorted array.
+#The line offset index is per block: the number of lines before each block, so a
+# match offset becomes a line number by counting newlines in its block only.
+#A search for a literal of 4 or more bytes first checks its 4-grams against each
+# block's array with bisect and only scans blocks that can contain it, so a rare
+# string in hundreds of MB is found in milliseconds. A regex gets the same filter from
+# the literal runs every match must contain (found with the regex parser), regexes
+# without one and short literals scan every block with the compiled pattern.
+# Matches spanning two blocks (multi-line patterns) are not found.
+#Offsets are counted from the first character ever appended, they stay valid when old
+# blocks are dropped to stay under max_chars. Nothing here needs tkinter.
+import re
+import array
+import bisect
+try:
+    from re import _parser as sre_parse
+except ImportError:
+    import sre_parse
+
+ngram_size = 4
+
+
+def ngrams(b):
+    #the set of all 4 byte sequences of b as ints, made with memoryview casts so the
+    # loop over the bytes runs in C
+    s = set()
+    view = memoryview(b)
+    for k in range(ngram_size):
+        n = (len(b) - k)//ngram_size*ngram_size
+        if n > 0:
+            s.update(view[k:k+n].cast('I'))
+    return s
+
+
+def required_literals(regex):
+    #runs of literal characters at the top level of regex that every match contains
+    runs = []
+    run = []
+    try:
+        items = sre_parse.parse(regex)
+    except re.error:
+        return runs
+    for op,av in items:
+        if op is sre_parse.LITERAL:
+            run.append(chr(av))
+            continue
+        if op in (sre_parse.MAX_REPEAT,sre_parse.MIN_REPEAT) and av[0] >= 1 and \
+                len(av[2]) == 1 and av[2][0][0] is sre_parse.LITERAL:
+            run.append(chr(av[2][0][1])) # x+ has at least one x
+        runs.append(''.join(run))
+        run = []
+    runs.append(''.join(run))
+    return [r for r in runs if r]
+
+
+class search_block:
+    def __init__(self,start,line0,text,grams):
+        self.start = start # offset of the first character
+        self.line0 = line0 # lines before this block
+        self.text = text
+        self.lines = text.count('\n')
+        self.grams = grams # sorted array of its 4-grams, None when not indexed
+    def may_contain(self,grams):
+        g = self.grams
+        if g is None:
+            return True
+        for v in grams:
+            i = bisect.bisect_left(g,v)
+            if i == len(g) or g[i] != v:
+                return False
+        return True
+
+
+class search_query:
+    #a compiled query. Literal queries match case insensitively unless case is set
+    def __init__(self,text,regex=False,case=False):
+        flags = 0 if case else re.IGNORECASE
+        self.pattern = re.compile(text if regex else re.escape(text),flags)
+        self.grams = None
+        for lit in required_literals(text) if regex else [text]:
+            b = lit.casefold().encode('utf-8')
+            if len(b) >= ngram_size:
+                self.grams = ngrams(b) | (self.grams or set())
+
+
+class search_index:
+    def __init__(self,block_chars=1<<16,max_chars=256*1024*1024,use_ngrams=True):
+        self.block_chars = block_chars
+        self.max_chars = max_chars # oldest blocks are dropped past this, 0 for no limit
+        self.use_ngrams = use_ngrams
+        self.clear()
+    def clear(self):
+        self.blocks = []
+        self.starts = [] # start of each block, for bisect
+        self.size = 0 # characters in the sealed blocks
+        self.open = [] # strings appended since the last seal
+        self.open_chars = 0
+        self.end = 0 # offset after the last character appended
+        self.lines = 0 # newlines in the sealed blocks, including dropped ones
+    def append(self,text):
+        self.open.append(text)
+        self.open_chars += len(text)
+        self.end += len(text)
+        if self.open_chars >= self.block_chars:
+            self.seal()
+    def retract(self,n):
+        #take back the last n characters, when the text widget deletes them. Only text
+        # that is not sealed yet can be taken back, returns False if it was
+        if n > self.open_chars:
+            return False
+        while n > 0:
+            last = self.open.pop()
+            cut = min(n,len(last))
+            if cut < len(last):
+                self.open.append(last[:-cut])
+            n -= cut
+            self.open_chars -= cut
+            self.end -= cut
+        return True
+    def truncate(self,offset):
+        #drop everything from offset on, sealed or not, so text the widget changed in
+        # the middle can be appended again. Returns False if offset was already dropped
+        if offset >= self.end - self.open_chars:
+            return self.retract(self.end - offset)
+        i = self.find_block(offset)
+        if i >= len(self.blocks) or offset < self.blocks[i].start:
+            return False
+        block = self.blocks[i]
+        keep = block.text[:offset - block.start]
+        for dropped in self.blocks[i:]:
+            self.size -= len(dropped.text)
+        self.lines = block.line0
+        del self.blocks[i:]
+        del self.starts[i:]
+        self.open = [keep] if keep else []
+        self.open_chars = len(keep)
+        self.end = offset
+        return True
+    def line_offset(self,line):
+        #offset of the start of line (0 based, as position() counts them), None when it
+        # was dropped or not appended yet
+        blocks = self.blocks + [self.tail()]
+        i = max(0,bisect.bisect_right([b.line0 for b in blocks],line) - 1)
+        block = blocks[i]
+        if line < block.line0:
+            return None
+        p = 0
+        for n in range(line - block.line0):
+            p = block.text.find('\n',p) + 1
+            if p == 0:
+                return None
+        return block.start + p
+    def seal(self):
+        #move the open text up to its last newline into a new block
+        text = ''.join(self.open)
+        cut = text.rfind('\n') + 1
+        if cut == 0:
+            self.open = [text]
+            return
+        rest = text[cut:]
+        text = text[:cut]
+        grams = None
+        if self.use_ngrams:
+            g = ngrams(text.casefold().encode('utf-8'))
+            if len(g) < len(text)//4:
+                #more grams than that (random data, hex dumps) costs more than it saves
+                grams = array.array('I',sorted(g))
+        block = search_block(self.end - self.open_chars,self.lines,text,grams)
+        self.blocks.append(block)
+        self.starts.append(block.start)
+        self.size += len(text)
+        self.lines += block.lines
+        self.open = [rest] if rest else []
+        self.open_chars = len(rest)
+        while self.max_chars and self.size > self.max_chars and len(self.blocks) > 1:
+            self.size -= len(self.blocks.pop(0).text)
+            self.starts.pop(0)
+    def tail(self):
+        #the open text as a block, not indexed
+        text = ''.join(self.open)
+        self.open = [text] if text else []
+        return search_block(self.end - self.open_chars,self.lines,text,None)
+    def start(self):
+        #offset of the oldest character still held
+        return self.blocks[0].start if self.blocks else self.end - self.open_chars
+    def find_block(self,pos):
+        #index into blocks (len(blocks) for the open text) holding offset pos
+        return max(0,bisect.bisect_right(self.starts,pos) - 1)
+    def search(self,query,pos,backwards=False):
+        #the first match at or after pos, or the last one that starts before pos when
+        # backwards, as (offset,length); None when there is none
+        blocks = self.blocks + [self.tail()]
+        i = self.find_block(pos)
+        if i < len(self.blocks) and pos >= blocks[i].start + len(blocks[i].text):
+            i += 1
+        step = -1 if backwards else 1
+        while 0 <= i < len(blocks):
+            block = blocks[i]
+            if query.grams is None or block is blocks[-1] or block.may_contain(query.grams):
+                found = self.search_block(block,query,pos - block.start,backwards)
+                if found is not None:
+                    return found
+            i += step
+        return None
+    def search_block(self,block,query,pos,backwards):
+        text = block.text
+        if not backwards:
+            m = query.pattern.search(text,max(0,pos))
+            if m is None:
+                return None
+            return block.start + m.start(),m.end() - m.start()
+        last = None
+        for m in query.pattern.finditer(text,0,len(text)):
+            if m.start() >= pos:
+                break
+            last = m
+        if last is None:
+            return None
+        return block.start + last.start(),last.end() - last.start()
+    def position(self,offset):
+        #(line,column) of offset, both 0 based and counted from the first line appended
+        blocks = self.blocks + [self.tail()]
+        block = blocks[self.find_block(offset)]
+        if offset >= block.start + len(block.text) and block is not blocks[-1]:
+            block = blocks[-1]
+        p = offset - block.start
+        line = block.line0 + block.text.count('\n',0,p)
+        return line,p - (block.text.rfind('\n',0,p) + 1)
+    def line_text(self,offset):
+        #the whole line holding offset
+        blocks = self.blocks + [self.tail()]
+        block = blocks[self.find_block(offset)]
+        if offset >= block.start + len(block.text) and block is not blocks[-1]:
+            block = blocks[-1]
+        p = offset - block.start
+        end = block.text.find('\n',p)
+        return block.text[block.text.rfind('\n',0,p) + 1:len(block.text) if end < 0 else end]
@@ -0,0 +1,263 @@
+#StepComm sessions, many serial ports in one process
+#
+#Copyright (C) 2018  William B Hunter
+#
+#This program is free software: you can redistribute it and/or modify
+#it under the terms of the GNU General Public License as published by
+#the Free Software Foundation, either version 3 of the License, or
+#(at your option) any later version.
+#
+#This program is distributed in the hope that it will be useful,
+#but WITHOUT ANY WARRANTY; without even the implied warranty of
+#MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#GNU General Public License for more details.
+#
+#You should have received a copy of the GNU General Public License
+#along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+#construction Notes:
+#A session is one serial_engine: its own port settings, newline state, queues and
+# capture file. The session_manager opens any number of them, but instead of a reader
+# thread per port all the reading is done by one io_loop thread (or a small pool of
+# them). An io_loop waits for all of its ports at once with a selector, so idle ports
+# cost nothing. Ports without a file descriptor (Windows, url handlers like loop://)
+# can't be selected on and are polled instead, only while there are any.
+#The sessions file is json like the ini file:
+# {"title": "StepComm: sessions", "sessions": [
+#     {"name": "dut1", "port": "/dev/ttyUSB0", "baud": "115200", "capfile": "dut1.txt"},
+#     ...]}
+# name and port are required, the rest defaults like the GUI (115200,NONE,8,1).
+# "frames": "SLIP" (or another stepcomm_frames decoder) delivers that port's frames.
+#Like stepcomm_engine, this module must never import tkinter.
+import sys
+import time
+import json
+import socket
+import selectors
+import threading
+import serial
+from stepcomm_engine import serial_engine,port_fd
+from stepcomm_frames import frame,frame_bytes
+
+
+class io_loop(threading.Thread):
+    #reads many serial_engines from one thread. add() and remove() can be called from
+    # any thread, the change is handed over and the loop woken through a socket pair so
+    # the selector is only ever touched by this thread. A port that fails (unplugged
+    # USB adapter) is dropped and its error kept in errors.
+    def __init__(self,poll_s=0.01,idle_s=1.0):
+        threading.Thread.__init__(self,name='io_loop',daemon=True)
+        self.poll_s = poll_s
+        self.idle_s = idle_s
+        self.sel = selectors.DefaultSelector()
+        self.wake_r,self.wake_w = socket.socketpair()
+        self.wake_r.setblocking(False)
+        self.wake_w.setblocking(False)
+        self.sel.register(self.wake_r,selectors.EVENT_READ,None)
+        self.lock = threading.Lock()
+        self.changes = []
+        self.polled = [] # engines without a file descriptor
+        self.engines = set()
+        self.errors = {} # engine: exception that dropped it
+        self.running = True
+    def wake(self):
+        try:
+            self.wake_w.send(b'x')
+        except OSError:
+            pass # already full, the loop wakes up anyway
+    def add(self,engine):
+        with self.lock:
+            self.changes.append((True,engine))
+            self.engines.add(engine)
+        self.wake()
+    def remove(self,engine):
+        with self.lock:
+            self.changes.append((False,engine))
+            self.engines.discard(engine)
+        self.wake()
+    def stop(self):
+        self.running = False
+        self.wake()
+    def apply(self):
+        with self.lock:
+            changes = self.changes
+            self.changes = []
+        for add,engine in changes:
+            if add:
+                fd = port_fd(engine.comport)
+                if fd is None:
+                    self.polled.append(engine)
+                else:
+                    self.sel.register(fd,selectors.EVENT_READ,engine)
+            else:
+                self.drop(engine)
+    def drop(self,engine):
+        if engine in self.polled:
+            self.polled.remove(engine)
+            return
+        for key in list(self.sel.get_map().values()):
+            if key.data is engine:
+                self.sel.unregister(key.fd)
+    def service(self,engine,ready=False):
+        try:
+            if engine.poll() == 0 and ready:
+                #readable but nothing waiting is how a hangup looks, read() tells which
+                l = engine.comport.read(1)
+                if l:
+                    engine.rx_dispatch(l)
+        except (serial.SerialException,OSError,TypeError,AttributeError) as err:
+            self.errors[engine] = err
+            self.drop(engine)
+            with self.lock:
+                self.engines.discard(engine)
+    def run(self):
+        while self.running:
+            self.apply()
+            timeout = self.poll_s if self.polled else self.idle_s
+            for key,events in self.sel.select(timeout):
+                if key.data is None:
+                    try:
+                        self.wake_r.recv(4096)
+                    except OSError:
+                        pass
+                else:
+                    self.service(key.data,ready=True)
+            for engine in list(self.polled):
+                self.service(engine)
+        self.sel.close()
+        self.wake_r.close()
+        self.wake_w.close()
+
+
+class session_manager:
+    #opens and runs any number of ports. sessions maps the session name to its
+    # serial_engine, each engine is read by the least loaded of the io_loops.
+    def __init__(self,threads=1):
+        self.sessions = {}
+        self.loop_of = {}
+        self.loops = [io_loop() for i in range(max(1,threads))]
+        for loop in self.loops:
+            loop.start()
+    def add(self,name,port,baud='115200',parity='NONE',databits='8',stopbits='1',
+            txnl='WINDOWS',encoding='utf-8',capfile=None,frames='NONE',data_from_device_q=None,
+            data_to_device_q=None,on_rx=None,on_sent=None):
+        #open one more port. Raises serial.SerialException or ValueError when the port
+        # can't be opened or frames is unknown, OSError when the capture file can't be,
+        # LookupError for an unknown encoding
+        if name in self.sessions:
+            raise ValueError('session {} already exists'.format(name))
+        engine = serial_engine(data_from_device_q,data_to_device_q,on_rx=on_rx,on_sent=on_sent)
+        engine.name = name
+        engine.txnl = txnl
+        try:
+            engine.set_encoding(encoding)
+            engine.set_frames(frames)
+            engine.open(port,baud,parity,databits,stopbits)
+            if capfile:
+                engine.start_capture(capfile)
+        except:
+            engine.stop()
+            raise
+        loop = min(self.loops,key=lambda l: len(l.engines))
+        loop.add(engine)
+        self.sessions[name] = engine
+        self.loop_of[name] = loop
+        return engine
+    def remove(self,name):
+        engine = self.sessions.pop(name)
+        self.loop_of.pop(name).remove(engine)
+        engine.stop()
+    def error(self,name):
+        #the error that stopped a session, None while it is running
+        return self.loop_of[name].errors.get(self.sessions[name])
+    def load(self,fn,hooks=None):
+        #open every session of a sessions file. hooks(name) returns extra arguments for
+        # add(), e.g. the session's on_rx. Returns a list of (name,error) for the
+        # sessions that failed to open
+        with open(fn,'r') as file:
+            jdict = json.loads(file.read())
+        if jdict.get('title') != 'StepComm: sessions':
+            raise ValueError('file ' + fn + ' is not valid Stepcomm sessions file')
+        failed = []
+        for s in jdict['sessions']:
+            args = dict((k,s[k]) for k in ('baud','parity','databits','stopbits','txnl',
+                    'encoding','capfile','frames') if k in s)
+            if hooks is not None:
+                args.update(hooks(s['name']))
+            try:
+                self.add(s['name'],s['port'],**args)
+            except (serial.SerialException,ValueError,OSError,LookupError) as err:
+                failed.append((s['name'],err))
+        return failed
+    def stop(self):
+        for name in list(self.sessions):
+            self.remove(name)
+        for loop in self.loops:
+            loop.stop()
+
+
+class line_prefixer:
+    #headless: writes the data of all sessions to one stream, each line prefixed with
+    # the session name. Partial lines are held until their newline arrives.
+    def __init__(self,out):
+        self.out = out
+        self.lock = threading.Lock()
+        self.partial = {}
+    def write(self,name,l):
+        with self.lock:
+            data = self.partial.pop(name,b'') + l
+            end = data.rfind(b'\n') + 1
+            if end == 0 and len(data) < 4096:
+                self.partial[name] = data
+                return
+            if end == 0:
+                end = len(data)
+            self.partial[name] = data[end:]
+            prefix = name.encode('utf-8') + b': '
+            lines = data[:end].splitlines(keepends=True)
+            self.out.write(b''.join(prefix + line for line in lines))
+            if not data[end-1:end] == b'\n':
+                self.out.write(b'\n')
+            self.out.flush()
+
+
+def main(args):
+    #headless with a sessions file: device data goes to stdout as 'name: line', and
+    # stdin lines of the form 'name: text' are sent to that session
+    out = line_prefixer(sys.stdout.buffer)
+    manager = session_manager(threads=args.iothreads)
+    try:
+        failed = manager.load(args.sessions,
+                hooks=lambda name: {'on_rx':lambda l: out.write(name,
+                        frame_bytes(l) if isinstance(l,frame) else l)})
+    except (OSError,ValueError) as err:
+        print('failed to load sessions file {}: {}'.format(args.sessions,err),file=sys.stderr)
+        manager.stop()
+        return 1
+    for name,err in failed:
+        print("session {} failed to open: {}".format(name,err),file=sys.stderr)
+    print('{:d} sessions open'.format(len(manager.sessions)),file=sys.stderr)
+    def stdin_reader():
+        for line in sys.stdin:
+            name,sep,text = line.partition(': ')
+            if sep and name in manager.sessions:
+                manager.sessions[name].send_text(text)
+            else:
+                print('no session for input line {!r}'.format(line),file=sys.stderr)
+    threading.Thread(target=stdin_reader,name='stdin_reader',daemon=True).start()
+    end = time.monotonic() + args.duration if args.duration else None
+    reported = set()
+    try:
+        while end is None or time.monotonic() < end:
+            time.sleep(0.1)
+            for name in manager.sessions:
+                err = manager.error(name)
+                if err is not None and name not in reported:
+                    reported.add(name)
+                    print('session {} stopped: {}'.format(name,err),file=sys.stderr)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        manager.stop()
+    return 0
@@ -0,0 +1,437 @@
+#StepComm vt, a VT100/ANSI terminal screen
+#
+#Copyright (C) 2018  William B Hunter
+#
+#This program is free software: you can redistribute it and/or modify
+#it under the terms of the GNU General Public License as published by
+#the Free Software Foundation, either version 3 of the License, or
+#(at your option) any later version.
+#
+#This program is distributed in the hope that it will be useful,
+#but WITHOUT ANY WARRANTY; without even the implied warranty of
+#MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#GNU General Public License for more details.
+#
+#You should have received a copy of the GNU General Public License
+#along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+#construction Notes:
+#vt_screen is the screen of a VT100 (plus the common xterm additions: colors, the
+# alternate screen, cursor visibility) as a grid of rows x cols cells. Each row is a
+# list of characters and an array of style ids, a style is the tuple
+# (fg,bg,bold,underline,reverse) and gets a small id the first time it is used.
+#feed() takes decoded text. A regex splits it into runs of printable characters and
+# single control or escape sequences, so a run is written into its row with one slice
+# assignment and Python code runs per sequence, not per character. An escape sequence
+# cut off at the end of a chunk is held until the next one.
+#Every row that changes is added to dirty. When the whole screen scrolls up, the row
+# leaving the top is appended to scrolled (with whether it changed since the last
+# repaint) and the dirty rows move up with the rest of the screen, so a text widget
+# showing the screen as its last rows lines can just append a line instead of
+# repainting all of them. take() hands both over and clears them. Scrolling inside a
+# scroll region or down marks the rows it moved dirty instead.
+#Replies to status requests (cursor position, device attributes) are collected in
+# replies for the caller to send to the device.
+#Not done: double width characters, tab stops other than every 8 columns, insert mode,
+# character sets other than ASCII and the DEC line drawing set.
+import re
+import array
+
+#a run of printable characters, CSI, OSC, ESC with a charset or # argument, other ESC
+# sequences, or a C0/C1 control character
+token_re = re.compile('([^\x00-\x1f\x7f-\x9f]+)'
+        '|\x1b\\[([<=>?]?)([0-9;:]*)[ -/]*([@-~])'
+        '|\x1b\\][^\x07\x1b]*(?:\x07|\x1b\\\\)'
+        '|\x1b([()*+#%])(.)'
+        '|\x1b([ -~])'
+        '|([\x00-\x1f\x7f-\x9f])',re.S)
+#an escape sequence that is not finished at the end of the text
+partial_re = re.compile('\x1b(?:\\[[<=>?]?[0-9;:]*[ -/]*|\\][^\x07\x1b]*\x1b?|[()*+#%])?$')
+
+#the DEC special graphics set, selected with ESC ( 0, draws the boxes of text menus
+dec_graphics = str.maketrans('`abcdefghijklmnopqrstuvwxyz{|}~',
+        '◆▒␉␌␍␊°±␤␋┘┐┌'
+        '└┼⎺⎻─⎼⎽├┤┴┬│≤'
+        '≥π≠£·')
+
+#xterm's 16 colors, then the 6x6x6 cube and the gray ramp of the 256 color palette
+palette = ['#000000','#cd0000','#00cd00','#cdcd00','#0000ee','#cd00cd','#00cdcd','#e5e5e5',
+        '#7f7f7f','#ff0000','#00ff00','#ffff00','#5c5cff','#ff00ff','#00ffff','#ffffff']
+palette += ['#{:02x}{:02x}{:02x}'.format(*(0 if v == 0 else 55 + v*40 for v in (r,g,b)))
+        for r in range(6) for g in range(6) for b in range(6)]
+palette += ['#{0:02x}{0:02x}{0:02x}'.format(8 + i*10) for i in range(24)]
+
+default_style = (None,None,False,False,False)
+
+
+def row_runs(chars,attrs):
+    #[(text,style id),...] of a row, trailing blanks without a style left off
+    end = len(chars)
+    while end > 0 and chars[end-1] == ' ' and attrs[end-1] == 0:
+        end -= 1
+    if attrs.count(attrs[0]) == len(attrs):
+        return [(''.join(chars[:end]),attrs[0])] if end else []
+    out = []
+    start = 0
+    for x in range(1,end + 1):
+        if x == end or attrs[x] != attrs[start]:
+            out.append((''.join(chars[start:x]),attrs[start]))
+            start = x
+    return out
+
+
+class vt_screen:
+    def __init__(self,rows=24,cols=80):
+        self.rows = rows
+        self.cols = cols
+        self.styles = [default_style] # style of each id
+        self.style_ids = {default_style:0}
+        self.replies = [] # strings to send back to the device
+        self.scrolled = [] # (chars,style ids,changed) of rows that left the top
+        self.held = '' # unfinished escape sequence
+        self.reset()
+    def reset(self):
+        self.chars,self.attrs = self.blank_grid()
+        self.alt = None # the main grid while the alternate screen is shown
+        self.dirty = set(range(self.rows))
+        self.x = 0 # cursor, x == cols when a wrap is pending
+        self.y = 0
+        self.top = 0 # scroll region, inclusive
+        self.bottom = self.rows - 1
+        self.style = default_style
+        self.attr = 0
+        self.saved = (0,0,default_style,0)
+        self.charsets = [False,False] # G0 and G1, True for DEC graphics
+        self.shift = 0 # charset in use
+        self.autowrap = True
+        self.origin = False
+        self.app_cursor = False # cursor keys send ESC O instead of ESC [
+        self.cursor_visible = True
+    def blank_grid(self):
+        return ([[' ']*self.cols for i in range(self.rows)],
+                [array.array('H',bytes(2*self.cols)) for i in range(self.rows)])
+    def blank(self):
+        #cells are erased to the current background
+        bg = self.style[1]
+        if bg is None:
+            return 0
+        return self.style_id((None,bg,False,False,False))
+    def style_id(self,style):
+        i = self.style_ids.get(style)
+        if i is None:
+            if len(self.styles) >= 0xffff:
+                return 0 # out of ids, a program cycling through 24 bit colors
+            i = self.style_ids[style] = len(self.styles)
+            self.styles.append(style)
+        return i
+    def take(self):
+        #(scrolled,dirty) since the last call
+        scrolled,dirty = self.scrolled,self.dirty
+        self.scrolled = []
+        self.dirty = set()
+        return scrolled,dirty
+    def text(self,y):
+        return ''.join(self.chars[y])
+    def runs(self,y):
+        return row_runs(self.chars[y],self.attrs[y])
+    def feed(self,text):
+        if self.held:
+            text = self.held + text
+            self.held = ''
+        m = partial_re.search(text)
+        if m is not None:
+            self.held = text[m.start():] if m.end() - m.start() < 4096 else ''
+            text = text[:m.start()]
+        for m in token_re.finditer(text):
+            run,private,params,final,charset,which,esc,ctrl = m.groups()
+            if run is not None:
+                self.write(run)
+            elif final is not None:
+                self.csi(private,params,final)
+            elif ctrl is not None:
+                self.control(ctrl)
+            elif esc is not None:
+                self.escape(esc)
+            elif charset is not None and charset in '()':
+                self.charsets[charset == ')'] = which == '0'
+            #OSC (window title) and the rest are ignored
+    def write(self,run):
+        if self.charsets[self.shift]:
+            run = run.translate(dec_graphics)
+        cols = self.cols
+        while run:
+            if self.x >= cols:
+                if not self.autowrap:
+                    self.x = cols - 1
+                    run = run[-1]
+                else:
+                    self.x = 0
+                    self.linefeed()
+            n = min(len(run),cols - self.x)
+            y = self.y
+            x = self.x
+            self.chars[y][x:x+n] = run[:n]
+            self.attrs[y][x:x+n] = array.array('H',[self.attr])*n
+            self.dirty.add(y)
+            self.x = x + n
+            run = run[n:]
+    def control(self,c):
+        if c == '\n' or c == '\x0b' or c == '\x0c':
+            self.linefeed()
+        elif c == '\r':
+            self.x = 0
+        elif c == '\b':
+            self.x = max(0,min(self.x,self.cols - 1) - 1)
+        elif c == '\t':
+            self.x = min(self.cols - 1,(self.x//8 + 1)*8)
+        elif c == '\x0e':
+            self.shift = 1
+        elif c == '\x0f':
+            self.shift = 0
+    def escape(self,c):
+        if c == '7':
+            self.saved = (self.x,self.y,self.style,self.attr)
+        elif c == '8':
+            self.x,self.y,self.style,self.attr = self.saved
+        elif c == 'D':
+            self.linefeed()
+        elif c == 'E':
+            self.x = 0
+            self.linefeed()
+        elif c == 'M':
+            if self.y == self.top:
+                self.scroll_down(1)
+            elif self.y > 0:
+                self.y -= 1
+        elif c == 'c':
+            self.reset()
+    def linefeed(self):
+        if self.y == self.bottom:
+            self.scroll_up(1)
+        elif self.y < self.rows - 1:
+            self.y += 1
+    def scroll_up(self,n):
+        top,bottom = self.top,self.bottom
+        n = min(n,bottom - top + 1)
+        blank = self.blank()
+        whole = top == 0 and bottom == self.rows - 1 and self.alt is None
+        for i in range(n):
+            chars = self.chars.pop(top)
+            attrs = self.attrs.pop(top)
+            self.chars.insert(bottom,[' ']*self.cols)
+            self.attrs.insert(bottom,array.array('H',[blank])*self.cols)
+            if whole:
+                self.scrolled.append((chars,attrs,0 in self.dirty))
+                self.dirty = {y - 1 for y in self.dirty if y}
+                self.dirty.add(bottom)
+        if not whole:
+            self.dirty.update(range(top,bottom + 1))
+    def scroll_down(self,n):
+        top,bottom = self.top,self.bottom
+        n = min(n,bottom - top + 1)
+        blank = self.blank()
+        for i in range(n):
+            del self.chars[bottom]
+            del self.attrs[bottom]
+            self.chars.insert(top,[' ']*self.cols)
+            self.attrs.insert(top,array.array('H',[blank])*self.cols)
+        self.dirty.update(range(top,bottom + 1))
+    def erase(self,y,start,end):
+        self.chars[y][start:end] = [' ']*(end - start)
+        self.attrs[y][start:end] = array.array('H',[self.blank()])*(end - start)
+        self.dirty.add(y)
+    def goto(self,x,y):
+        #y counts from the top of the scroll region in origin mode
+        if self.origin:
+            self.y = max(self.top,min(self.bottom,y + self.top))
+        else:
+            self.y = max(0,min(self.rows - 1,y))
+        self.x = max(0,min(self.cols - 1,x))
+    def csi(self,private,params,final):
+        args = [int(p) if p.isdigit() else 0 for p in params.replace(':',';').split(';')]
+        a = args[0] or 1 # the first parameter where a missing one means 1
+        x = min(self.x,self.cols - 1)
+        y = self.y
+        if private == '?':
+            if final in 'hl':
+                self.private_modes(args,final == 'h')
+            return
+        if private:
+            return
+        if final == 'm':
+            self.sgr(args)
+        elif final == 'H' or final == 'f':
+            self.goto((args[1] if len(args) > 1 else 1) - 1,a - 1)
+        elif final == 'A':
+            self.y = max(self.top if y >= self.top else 0,y - a)
+            self.x = x
+        elif final == 'B':
+            self.y = min(self.bottom if y <= self.bottom else self.rows - 1,y + a)
+            self.x = x
+        elif final == 'C':
+            self.x = min(self.cols - 1,x + a)
+        elif final == 'D':
+            self.x = max(0,x - a)
+        elif final == 'E' or final == 'F':
+            self.y = max(0,min(self.rows - 1,y + (a if final == 'E' else -a)))
+            self.x = 0
+        elif final == 'G' or final == '`':
+            self.x = max(0,min(self.cols - 1,a - 1))
+        elif final == 'd':
+            self.goto(x,a - 1)
+        elif final == 'J':
+            if args[0] == 0:
+                self.erase(y,x,self.cols)
+                for i in range(y + 1,self.rows):
+                    self.erase(i,0,self.cols)
+            elif args[0] == 1:
+                for i in range(y):
+                    self.erase(i,0,self.cols)
+                self.erase(y,0,x + 1)
+            else:
+                for i in range(self.rows):
+                    self.erase(i,0,self.cols)
+        elif final == 'K':
+            if args[0] == 0:
+                self.erase(y,x,self.cols)
+            elif args[0] == 1:
+                self.erase(y,0,x + 1)
+            else:
+                self.erase(y,0,self.cols)
+        elif final == 'X':
+            self.erase(y,x,min(self.cols,x + a))
+            self.x = x
+        elif final == 'P' or final == '@':
+            n = min(a,self.cols - x)
+            row = self.chars[y]
+            attrs = self.attrs[y]
+            if final == 'P':
+                del row[x:x+n]
+                del attrs[x:x+n]
+                row.extend(' '*n)
+                attrs.extend(array.array('H',[self.blank()])*n)
+            else:
+                row[x:x] = ' '*n
+                attrs[x:x] = array.array('H',[self.blank()])*n
+                del row[self.cols:]
+                del attrs[self.cols:]
+            self.dirty.add(y)
+            self.x = x
+        elif final == 'L' or final == 'M':
+            if self.top <= y <= self.bottom:
+                top = self.top
+                self.top = y
+                if final == 'L':
+                    self.scroll_down(a)
+                else:
+                    self.scroll_up(a)
+                self.top = top
+                self.x = 0
+        elif final == 'S':
+            self.scroll_up(a)
+        elif final == 'T':
+            self.scroll_down(a)
+        elif final == 'r':
+            top = a - 1
+            bottom = (args[1] if len(args) > 1 and args[1] else self.rows) - 1
+            if 0 <= top < bottom < self.rows:
+                self.top = top
+                self.bottom = bottom
+                self.goto(0,0)
+        elif final == 's':
+            self.saved = (self.x,self.y,self.style,self.attr)
+        elif final == 'u':
+            self.x,self.y,self.style,self.attr = self.saved
+        elif final == 'n':
+            if args[0] == 5:
+                self.replies.append('\x1b[0n')
+            elif args[0] == 6:
+                row = y - self.top if self.origin else y
+                self.replies.append('\x1b[{:d};{:d}R'.format(row + 1,x + 1))
+        elif final == 'c' and args[0] == 0:
+            self.replies.append('\x1b[?1;2c') # a VT100 with advanced video
+    def private_modes(self,args,on):
+        for mode in args:
+            if mode == 1:
+                self.app_cursor = on
+            elif mode == 6:
+                self.origin = on
+                self.goto(0,0)
+            elif mode == 7:
+                self.autowrap = on
+            elif mode == 25:
+                self.cursor_visible = on
+            elif mode in (47,1047,1049):
+                self.alt_screen(on,mode == 1049)
+    def alt_screen(self,on,save_cursor):
+        #full screen programs draw on the alternate screen, leaving the main one as it was
+        if on == (self.alt is not None):
+            return
+        if on:
+            if save_cursor:
+                self.saved = (self.x,self.y,self.style,self.attr)
+            self.alt = (self.chars,self.attrs)
+            self.chars,self.attrs = self.blank_grid()
+        else:
+            self.chars,self.attrs = self.alt
+            self.alt = None
+            if save_cursor:
+                self.x,self.y,self.style,self.attr = self.saved
+        self.dirty.update(range(self.rows))
+    def sgr(self,args):
+        fg,bg,bold,underline,reverse = self.style
+        i = 0
+        while i < len(args):
+            p = args[i]
+            if p == 0:
+                fg,bg,bold,underline,reverse = default_style
+            elif p == 1:
+                bold = True
+            elif p == 4:
+                underline = True
+            elif p == 7:
+                reverse = True
+            elif p == 22:
+                bold = False
+            elif p == 24:
+                underline = False
+            elif p == 27:
+                reverse = False
+            elif 30 <= p <= 37:
+                fg = palette[p - 30]
+            elif p == 39:
+                fg = None
+            elif 40 <= p <= 47:
+                bg = palette[p - 40]
+            elif p == 49:
+                bg = None
+            elif 90 <= p <= 97:
+                fg = palette[p - 82]
+            elif 100 <= p <= 107:
+                bg = palette[p - 92]
+            elif p == 38 or p == 48:
+                #38;5;n from the palette or 38;2;r;g;b
+                color = None
+                if i + 2 < len(args) and args[i+1] == 5:
+                    color = palette[args[i+2] & 0xff]
+                    i += 2
+                elif i + 4 < len(args) and args[i+1] == 2:
+                    color = '#{:02x}{:02x}{:02x}'.format(*(v & 0xff for v in args[i+2:i+5]))
+                    i += 4
+                if p == 38:
+                    fg = color
+                else:
+                    bg = color
+            i += 1
+        self.style = (fg,bg,bold,underline,reverse)
+        self.attr = self.style_id(self.style)
+    def key(self,keysym):
+        #the sequence a cursor or editing key sends, None for other keys
+        if keysym in ('Up','Down','Right','Left'):
+            return ('\x1bO' if self.app_cursor else '\x1b[') + 'ABCD'[('Up','Down','Right','Left').index(keysym)]
+        return vt_keys.get(keysym)
+
+
+vt_keys = {'Home':'\x1b[1~','Insert':'\x1b[2~','Delete':'\x1b[3~','End':'\x1b[4~',
+        'Prior':'\x1b[5~','Next':'\x1b[6~'}
@@ -0,0 +1,5 @@
+#the StepComm modules are plain files in the directory above, not a package
+import os
+import sys
+
+sys.path.insert(0,os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
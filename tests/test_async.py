@@ -0,0 +1,32 @@
+import asyncio
+import stepcomm_async
+
+
+def run(coro):
+    return asyncio.run(asyncio.wait_for(coro,10))
+
+
+def test_write_drain_readline():
+    #the example of the module notes, against a loopback port
+    async def main():
+        port = await stepcomm_async.open_serial('loop://','115200')
+        try:
+            job = port.write('version\n')
+            assert job is not None
+            await port.drain()
+            return await port.readline()
+        finally:
+            port.close()
+    assert run(main()) == b'version\r\n'
+
+
+def test_readexactly_and_bytes():
+    async def main():
+        port = await stepcomm_async.open_serial('loop://','115200')
+        try:
+            port.write(b'\x00\x01\x02\x03')
+            await port.drain()
+            return await port.readexactly(4)
+        finally:
+            port.close()
+    assert run(main()) == b'\x00\x01\x02\x03'
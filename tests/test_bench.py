@@ -0,0 +1,48 @@
+import json
+import os
+import pytest
+import stepcomm_bench
+
+transports = ['loop'] + (['pty'] if os.name == 'posix' else [])
+
+
+def test_percentiles():
+    p = stepcomm_bench.percentiles([i/1000 for i in range(100,0,-1)])
+    assert p == {'p50_ms':51.0,'p90_ms':91.0,'p99_ms':100.0,'max_ms':100.0}
+    assert stepcomm_bench.percentiles([]) == {}
+
+
+def test_metrics_flatten_numbers_only():
+    results = {'latency':{'thread':{'p99_ms':1.5,'samples':50}},'tx':{'complete':True,
+            'tx_mbps':2.0,'error':'x'}}
+    assert stepcomm_bench.metrics(results) == {'latency.thread.p99_ms':1.5,
+            'latency.thread.samples':50,'tx.tx_mbps':2.0}
+
+
+def test_compare():
+    base = {'results':{'rx':{'rx_mbps':10.0,'lat_ms':2.0,'heap_kb':1000.0,'gone_mbps':1.0}}}
+    new = {'results':{'rx':{'rx_mbps':7.0,'lat_ms':2.5,'heap_kb':2000.0,'new_mbps':0.1}}}
+    worse = stepcomm_bench.compare(base,new,0.2)
+    #lat_ms is 25% worse but only 0.5ms, that is noise
+    assert sorted(w[0] for w in worse) == ['rx.heap_kb','rx.rx_mbps']
+    assert stepcomm_bench.compare(base,base,0.2) == []
+
+
+@pytest.mark.parametrize('transport',transports)
+def test_rx_queue_and_latency_run(transport):
+    r = stepcomm_bench.bench_rx_queue(transport,16*1024)
+    assert r['complete'] and r['bytes'] == 16*1024
+    r = stepcomm_bench.bench_latency(transport,5)
+    assert r['thread']['samples'] == 5 and r['poll']['samples'] == 5
+
+
+def test_main_writes_results_and_compares(tmp_path):
+    out = tmp_path / 'base.json'
+    args = ['--transport','loop','--quick','--only','rx_queue']
+    assert stepcomm_bench.main(args + ['-o',str(out)]) == 0
+    base = json.loads(out.read_text())
+    assert base['results']['rx_queue']['complete']
+    #a baseline that can't be reached makes it fail
+    base['results']['rx_queue']['rx_queue_mbps'] *= 1000
+    out.write_text(json.dumps(base))
+    assert stepcomm_bench.main(args + ['--compare',str(out)]) == 1
@@ -0,0 +1,54 @@
+import pytest
+StepComm = pytest.importorskip('StepComm') # needs tkinter, not a display
+byte_format = StepComm.byte_format
+
+
+def screen(fmt,chunks):
+    #apply format() results the way display_bytes() does
+    text = ''
+    for c in chunks:
+        retract,add = fmt.format(c)
+        text = text[:len(text) - retract] + add
+    return text
+
+
+def test_hex_full_and_partial_lines():
+    fmt = byte_format('HEX')
+    retract,text = fmt.format(bytes(range(20)))
+    assert retract == 0
+    assert text == ' '.join('{:02x}'.format(i) for i in range(16)) + '\n10 11 12 13'
+    retract,text = fmt.format(b'\xff')
+    assert retract == 11
+    assert text == '10 11 12 13 ff'
+
+
+def test_chunking_does_not_change_the_result():
+    data = bytes(range(256)) * 3
+    for mode in ('HEX','HEX+ASCII','RAW'):
+        whole = screen(byte_format(mode),[data])
+        for size in (1,5,16,17):
+            chunks = [data[i:i+size] for i in range(0,len(data),size)]
+            assert screen(byte_format(mode),chunks) == whole
+
+
+def test_hex_ascii():
+    fmt = byte_format('HEX+ASCII')
+    text = screen(fmt,[b'Hello, \x00\x7f\xffworld!\r\n'])
+    first,second = text.split('\n')
+    assert first == '00000000  48 65 6c 6c 6f 2c 20 00 7f ff 77 6f 72 6c 64 21  |Hello, ...world!|'
+    assert second == '00000010  0d 0a' + ' ' * 44 + '|..|'
+
+
+def test_raw():
+    fmt = byte_format('RAW')
+    assert fmt.format(b'a\tb\r\n\x00\x1b\xe9') == (0,'a\tb.\n..\xe9')
+
+
+def test_commit_starts_a_new_line():
+    fmt = byte_format('HEX+ASCII')
+    fmt.format(b'abc')
+    assert fmt.commit() == '\n'
+    assert fmt.commit() == ''
+    retract,text = fmt.format(b'd')
+    assert retract == 0
+    assert text.startswith('00000003  64')
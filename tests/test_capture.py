@@ -0,0 +1,62 @@
+import pytest
+from stepcomm_engine import capture_writer,serial_engine
+
+
+def test_writes_everything_in_order(tmp_path):
+    path = tmp_path / 'cap.txt'
+    path.write_bytes(b'old\n')
+    cap = capture_writer(str(path))
+    cap.start()
+    data = [bytes([i % 256]) * (i % 7 + 1) for i in range(3000)]
+    for d in data:
+        cap.write(d)
+    cap.stop()
+    assert path.read_bytes() == b'old\n' + b''.join(data)
+    assert cap.written == sum(len(d) for d in data)
+    assert cap.error is None and cap.file.closed
+
+
+def test_small_batches(tmp_path):
+    path = tmp_path / 'cap.txt'
+    cap = capture_writer(str(path),batch=10)
+    for i in range(100):
+        cap.write(b'%03d' % i)
+    cap.start()
+    cap.stop()
+    assert path.read_bytes() == b''.join(b'%03d' % i for i in range(100))
+
+
+def test_rotate_by_size(tmp_path):
+    path = tmp_path / 'cap.txt'
+    cap = capture_writer(str(path),rotate_bytes=100,batch=40)
+    for i in range(50):
+        cap.write(b'x' * 10)
+    cap.start()
+    cap.stop()
+    files = sorted(tmp_path.iterdir())
+    rotated = [f for f in files if f.name != 'cap.txt']
+    assert rotated and all(f.name.startswith('cap-') and f.suffix == '.txt' for f in rotated)
+    assert all(f.stat().st_size >= 100 for f in rotated)
+    assert sum(f.stat().st_size for f in files) == 500
+
+
+def test_bad_name():
+    with pytest.raises(OSError):
+        capture_writer('/nonexistent/dir/cap.txt')
+
+
+def test_engine_captures_raw_rx(tmp_path):
+    path = tmp_path / 'cap.bin'
+    engine = serial_engine()
+    engine.open('loop://')
+    try:
+        engine.start_capture(str(path))
+        engine.comport.write(b'\x00raw\r\n\xff')
+        while engine.poll() == 0:
+            pass
+        engine.stop_capture()
+        engine.comport.write(b'not captured')
+        engine.poll()
+    finally:
+        engine.stop()
+    assert path.read_bytes() == b'\x00raw\r\n\xff'
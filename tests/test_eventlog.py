@@ -0,0 +1,97 @@
+import pytest
+import stepcomm_eventlog
+from stepcomm_eventlog import RX,TX
+
+
+def write_log(path,records,**kw):
+    #records are (seconds,kind,data), put on the queue with made up times
+    log = stepcomm_eventlog.event_log(str(path),**kw)
+    log.start()
+    for t,kind,data in records:
+        log.q.put((kind,log.origin + int(t*1e9),data))
+    log.stop()
+    return log
+
+
+def read_all(path,start=None,end=None,kinds=(RX,TX)):
+    reader = stepcomm_eventlog.event_log_reader(str(path))
+    try:
+        return list(reader.records(start,end,kinds))
+    finally:
+        reader.close()
+
+
+many = [(i*0.01,RX if i % 3 else TX,b'%06d' % i) for i in range(5000)]
+
+
+def test_round_trip(tmp_path):
+    path = tmp_path / 'ev.log'
+    log = write_log(path,many,index_bytes=4096)
+    assert log.error is None
+    got = read_all(path)
+    assert [(round(t,6),k,d) for t,k,d in got] == [(round(t,6),k,d) for t,k,d in many]
+
+
+def test_directions(tmp_path):
+    path = tmp_path / 'ev.log'
+    write_log(path,many,index_bytes=4096)
+    assert all(k == TX for t,k,d in read_all(path,kinds=(TX,)))
+
+
+def test_time_range_uses_the_index(tmp_path):
+    path = tmp_path / 'ev.log'
+    write_log(path,many,index_bytes=4096)
+    reader = stepcomm_eventlog.event_log_reader(str(path))
+    assert reader.seek_time(30.0) > reader.size//2
+    reader.close()
+    got = read_all(path,20.0,20.5)
+    assert [d for t,k,d in got] == [d for t,k,d in many if 20.0 <= round(t,6) <= 20.5]
+
+
+def test_empty_log_and_empty_range(tmp_path):
+    path = tmp_path / 'ev.log'
+    write_log(path,[])
+    assert read_all(path) == []
+    path = tmp_path / 'ev2.log'
+    write_log(path,many[:10])
+    assert read_all(path,100.0,200.0) == []
+
+
+def test_cut_short_log_reads_whole_records(tmp_path):
+    path = tmp_path / 'ev.log'
+    write_log(path,many[:100],index_bytes=512)
+    data = path.read_bytes()
+    path.write_bytes(data[:-3])
+    assert [d for t,k,d in read_all(path)] == [d for t,k,d in many[:99]]
+
+
+def test_corrupt_index_is_skipped(tmp_path):
+    path = tmp_path / 'ev.log'
+    write_log(path,many,index_bytes=4096)
+    data = bytearray(path.read_bytes())
+    #flip the crc of every other index record
+    pos = data.find(stepcomm_eventlog.index_magic)
+    n = 0
+    while pos >= 0:
+        if n % 2:
+            data[pos + stepcomm_eventlog.index_body.size] ^= 0xff
+        n += 1
+        pos = data.find(stepcomm_eventlog.index_magic,pos + 1)
+    path.write_bytes(bytes(data))
+    got = read_all(path,30.0,30.1)
+    assert [d for t,k,d in got] == [d for t,k,d in many if 30.0 <= round(t,6) <= 30.1]
+
+
+def test_not_a_log(tmp_path):
+    path = tmp_path / 'x.log'
+    path.write_bytes(b'x'*64)
+    with pytest.raises(ValueError):
+        stepcomm_eventlog.event_log_reader(str(path))
+
+
+def test_export(tmp_path,capsysbinary):
+    path = tmp_path / 'ev.log'
+    write_log(path,[(0.5,RX,b'hi\n'),(1.0,TX,b'\x01')])
+    assert stepcomm_eventlog.main([str(path),'--format','hex']) == 0
+    out = capsysbinary.readouterr().out.decode()
+    assert out == '0.500000 RX 68 69 0a\n1.000000 TX 01\n'
@@ -0,0 +1,139 @@
+import re
+import pytest
+from stepcomm_engine import expecter,expect_timeout
+
+
+def test_literal():
+    e = expecter()
+    exp = e.expect('OK')
+    e.feed(b'AT\r\nOK\r\n')
+    r = exp.result(0)
+    assert r.index == 0
+    assert r.match.group() == b'OK'
+    assert r.before == b'AT\r\n'
+
+
+def test_regex_and_index():
+    e = expecter()
+    exp = e.expect(['ERROR',re.compile(r'v(\d+)\.(\d+)')])
+    e.feed(b'version v1.23\n')
+    r = exp.result(0)
+    assert r.index == 1
+    assert r.match.groups() == (b'1',b'23')
+
+
+def test_str_regex_is_matched_as_bytes():
+    e = expecter()
+    exp = e.expect(re.compile('ok',re.I))
+    e.feed(b'all OK')
+    assert exp.result(0).match.group() == b'OK'
+
+
+def test_match_split_across_chunks():
+    e = expecter()
+    exp = e.expect('login:')
+    for chunk in (b'welcome\r\nlo',b'g',b'in: '):
+        assert not exp.done()
+        e.feed(chunk)
+    assert exp.result(0).before == b'welcome\r\n'
+
+
+def test_unbounded_pattern_split_across_chunks():
+    e = expecter()
+    exp = e.expect(re.compile(rb'<[^>]*>'))
+    e.feed(b'xx<ab')
+    e.feed(b'cd')
+    assert not exp.done()
+    e.feed(b'e>yy')
+    assert exp.result(0).match.group() == b'<abcde>'
+
+
+def test_only_data_after_expect_counts():
+    e = expecter()
+    first = e.expect('zzz')
+    e.feed(b'prompt> ')
+    second = e.expect('prompt>')
+    e.feed(b'more\n')
+    assert not second.done()
+    e.feed(b'prompt> ')
+    assert second.result(0).before == b'more\n'
+    first.cancel()
+
+
+def test_match_is_consumed():
+    e = expecter()
+    a = e.expect('OK')
+    b = e.expect('OK')
+    e.feed(b'OK\n')
+    assert a.result(0).match.group() == b'OK'
+    assert not b.done()
+    e.feed(b'OK\n')
+    assert b.result(0).before == b'\n'
+
+
+def test_timeout():
+    e = expecter()
+    exp = e.expect('never',timeout=0.05)
+    with pytest.raises(expect_timeout):
+        exp.result(2)
+    assert e.waiting == []
+
+
+def test_callback():
+    e = expecter()
+    seen = []
+    e.expect('#',callback=seen.append)
+    e.feed(b'$ # ')
+    assert len(seen) == 1
+    assert seen[0].result().match.group() == b'#'
+
+
+def test_cancel():
+    e = expecter()
+    exp = e.expect('OK')
+    assert exp.cancel()
+    assert exp.cancelled()
+    assert e.waiting == [] and e.combined is None
+    e.feed(b'OK')
+    assert e.buf == bytearray()
+
+
+def test_nothing_buffered_without_expectations():
+    e = expecter()
+    e.feed(b'x' * 1000)
+    assert e.buf == bytearray()
+
+
+def test_inline_global_flags():
+    e = expecter()
+    exp = e.expect(re.compile(rb'(?i)error'))
+    other = e.expect(re.compile('(?s)a.b'))
+    e.feed(b'a\nb ERROR')
+    assert exp.result(0).match.group() == b'ERROR'
+    assert other.result(0).match.group() == b'a\nb'
+
+
+def test_bad_patterns_leave_the_expecter_usable():
+    e = expecter()
+    for p in (re.compile(r'(a)\1'),re.compile(r'(?P<v>\d+)'),re.compile(r'(a)?(?(1)b|c)')):
+        with pytest.raises(ValueError):
+            e.expect(p)
+    assert e.waiting == [] and e.combined is None
+    exp = e.expect('fine')
+    e.feed(b'all fine')
+    assert exp.result(0).match.group() == b'fine'
+
+
+def test_combine_failure_keeps_state(monkeypatch):
+    e = expecter()
+    first = e.expect('one')
+    combined = e.combined
+    def broken(waiting):
+        raise ValueError('expect patterns can not be combined')
+    monkeypatch.setattr(e,'combine',broken)
+    with pytest.raises(ValueError):
+        e.expect('two')
+    assert e.waiting == [first] and e.combined is combined
+    monkeypatch.undo()
+    e.feed(b'one')
+    assert first.done()
@@ -0,0 +1,106 @@
+import random
+import pytest
+import stepcomm_frames
+
+
+def feed_chunked(dec,data,seed=1):
+    rnd = random.Random(seed)
+    out = []
+    pos = 0
+    while pos < len(data):
+        n = rnd.randint(1,9)
+        out += dec.feed(data[pos:pos+n],0.0)
+        pos += n
+    return out
+
+
+def slip(payload):
+    return payload.replace(b'\xdb',b'\xdb\xdd').replace(b'\xc0',b'\xdb\xdc') + b'\xc0'
+
+
+def cobs(payload):
+    out = bytearray()
+    for part in payload.split(b'\x00'):
+        while len(part) >= 254:
+            out += b'\xff' + part[:254]
+            part = part[254:]
+        out += bytes([len(part) + 1]) + part
+    return bytes(out) + b'\x00'
+
+
+payloads = [b'',b'a',b'\x00\xc0\xdb\xdb\xdc',bytes(range(256)),b'x'*600,b'\x00'*3]
+
+
+def test_make_decoder():
+    assert stepcomm_frames.make_decoder('none') is None
+    assert isinstance(stepcomm_frames.make_decoder('len16le'),stepcomm_frames.length_decoder)
+    with pytest.raises(ValueError):
+        stepcomm_frames.make_decoder('LEN24')
+
+
+def test_lines():
+    dec = stepcomm_frames.make_decoder('LINE')
+    data = b'one\r\ntwo\n\nthree'
+    frames = feed_chunked(dec,data)
+    assert frames == [b'one',b'two',b'']
+    assert [(f.start,f.end) for f in frames] == [(0,5),(5,9),(9,10)]
+    assert all(f.text for f in frames)
+    assert dec.feed(b'\n') == [b'three']
+    assert stepcomm_frames.frame_bytes(frames[0]) == b'one\n'
+
+
+def test_slip_round_trip():
+    dec = stepcomm_frames.make_decoder('SLIP')
+    frames = feed_chunked(dec,b''.join(slip(p) for p in payloads))
+    assert frames == [p for p in payloads if p] # empty SLIP frames are skipped
+    assert dec.malformed == 0
+
+
+def test_slip_bad_escape():
+    dec = stepcomm_frames.make_decoder('SLIP')
+    assert dec.feed(b'ab\xdbx\xc0ok\xc0') == [b'ok']
+    assert dec.malformed == 1
+    assert dec.discarded == 5
+
+
+def test_cobs_round_trip():
+    dec = stepcomm_frames.make_decoder('COBS')
+    frames = feed_chunked(dec,b''.join(cobs(p) for p in payloads))
+    assert frames == payloads
+    assert dec.malformed == 0
+
+
+def test_cobs_bad_code():
+    dec = stepcomm_frames.make_decoder('COBS')
+    assert dec.feed(b'\x05ab\x00\x02z\x00') == [b'z']
+    assert dec.malformed == 1
+
+
+@pytest.mark.parametrize('name,size,order',[('LEN8',1,'big'),('LEN16',2,'big'),
+        ('LEN16LE',2,'little'),('LEN32',4,'big'),('LEN32LE',4,'little')])
+def test_length_round_trip(name,size,order):
+    dec = stepcomm_frames.make_decoder(name)
+    use = [p for p in payloads if len(p) < 1 << (8*size)]
+    data = b''.join(len(p).to_bytes(size,order) + p for p in use)
+    assert feed_chunked(dec,data) == use
+
+
+def test_length_too_long_resyncs():
+    dec = stepcomm_frames.make_decoder('LEN16',max_frame=16)
+    assert dec.feed(b'\xff\xff' + b'\x00\x02hi') == [b'hi']
+    assert dec.malformed == 1
+
+
+def test_overflow_without_delimiter():
+    dec = stepcomm_frames.make_decoder('LINE',max_frame=8)
+    assert dec.feed(b'x'*20) == []
+    assert dec.feed(b'yy\nok\n') == [b'ok']
+    assert dec.malformed == 1
+    assert dec.stats()['frames'] == 1
+
+
+def test_empty_input():
+    for name in stepcomm_frames.decoder_names[1:]:
+        dec = stepcomm_frames.make_decoder(name)
+        assert dec.feed(b'') == []
+        assert dec.stats() == {'frames':0,'frames_malformed':0,'frames_discarded_bytes':0}
@@ -0,0 +1,63 @@
+import json
+import os
+import subprocess
+import sys
+import pytest
+import stepcomm_engine
+
+engine_py = os.path.abspath(stepcomm_engine.__file__)
+
+
+def headless(*args,stdin=b''):
+    return subprocess.run([sys.executable,engine_py] + list(args),input=stdin,
+            capture_output=True,timeout=30)
+
+
+def test_stdin_to_port_to_stdout():
+    r = headless('-p','loop://','--duration','1',stdin=b'hello\nworld\n')
+    assert r.returncode == 0
+    assert r.stdout == b'hello\r\nworld\r\n'
+    assert b'port loop://,115200' in r.stderr
+
+
+def test_raw_stdin_and_unix_newlines(tmp_path):
+    ini = tmp_path / 'unix.ini'
+    ini.write_text(json.dumps({'title':'StepComm: saved settings','txnl':'UNIX   '}))
+    r = headless('-p','loop://','--duration','1','-i',str(ini),stdin=b'a\r\nb\n')
+    assert r.stdout == b'a\nb\n'
+    r = headless('-p','loop://','--duration','1','--raw',stdin=b'a\r\nb\n\x00')
+    assert r.stdout == b'a\r\nb\n\x00'
+
+
+def test_macro_runs_and_exits(tmp_path):
+    script = tmp_path / 'ping.txt'
+    #the run ends with the macro, so it waits for the last echo to be sure it was shown
+    script.write_text('@script\ntimeout 2\nsend ping\nwait ping\nput done\nwait done\n')
+    r = headless('-p','loop://','--macro',str(script))
+    assert r.returncode == 0
+    assert r.stdout == b'ping\r\ndone'
+
+
+def test_macro_failure(tmp_path):
+    script = tmp_path / 'fail.txt'
+    script.write_text('@script\ntimeout 0.2\nwait never\n')
+    r = headless('-p','loop://','--macro',str(script))
+    assert r.returncode == 1
+    assert b'macro failed' in r.stderr
+
+
+@pytest.mark.parametrize('args',[
+        ('-p','/dev/nonexistent-port'),
+        ('-p','loop://','--encoding','no-such-codec'),
+        ('-p','loop://','-i','/nonexistent.ini')])
+def test_errors_exit_1(args):
+    assert headless(*args,'--duration','1').returncode == 1
+
+
+def test_load_settings(tmp_path):
+    ini = tmp_path / 'x.ini'
+    ini.write_text(json.dumps({'title':'something else'}))
+    with pytest.raises(ValueError):
+        stepcomm_engine.load_settings(str(ini))
+    ini.write_text(json.dumps({'title':'StepComm: saved settings','baud':'9600'}))
+    assert stepcomm_engine.load_settings(str(ini) + '\n')['baud'] == '9600'
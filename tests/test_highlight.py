@@ -0,0 +1,44 @@
+import pytest
+StepComm = pytest.importorskip('StepComm') # needs tkinter, not a display
+highlight_rules = StepComm.highlight_rules
+
+
+def test_defaults_color_whole_lines():
+    rules = highlight_rules(highlight_rules.defaults)
+    text = 'ok\nan ERROR here\nWARN: low\nkernel panic\n'
+    found = rules.ranges(text)
+    assert [text[s:e] for s,e in found['hl1']] == ['an ERROR here']
+    assert [text[s:e] for s,e in found['hl2']] == ['WARN: low']
+    assert [text[s:e] for s,e in found['hl0']] == ['kernel panic']
+
+
+def test_match_scope_and_first_rule_wins():
+    rules = highlight_rules([{'pattern':'ERROR','color':'red','scope':'line'},
+            {'pattern':r'\d+ms','color':'green','scope':'match'}])
+    text = 'took 12ms\nERROR after 3ms\n'
+    found = rules.ranges(text)
+    assert [text[s:e] for s,e in found['hl1']] == ['12ms']
+    assert [text[s:e] for s,e in found['hl0']] == ['ERROR after 3ms']
+
+
+def test_no_rules():
+    assert highlight_rules([]).ranges('ERROR') == {}
+
+
+def test_text_round_trip():
+    rules = highlight_rules(highlight_rules.defaults)
+    assert rules.parse(rules.text()) == rules.rules
+
+
+@pytest.mark.parametrize('rules',[
+    [{'pattern':'(','color':'red','scope':'line'}],
+    [{'pattern':'x','color':'','scope':'line'}],
+])
+def test_bad_rules(rules):
+    with pytest.raises(ValueError):
+        highlight_rules(rules)
+
+
+def test_parse_errors():
+    with pytest.raises(ValueError):
+        highlight_rules().parse('red everywhere x\n')
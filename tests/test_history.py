@@ -0,0 +1,89 @@
+import io
+import types
+import pytest
+StepComm = pytest.importorskip('StepComm') # needs tkinter, not a display
+text_history = StepComm.text_history
+
+
+@pytest.mark.parametrize('spill',[False,True])
+def test_append_get_clear(spill):
+    h = text_history(spill=spill)
+    h.append('one\n')
+    h.append('')
+    h.append('twø\n')
+    assert h.get() == 'one\ntwø\n'
+    assert h.size == 8
+    out = io.StringIO()
+    h.write_to(out)
+    assert out.getvalue() == 'one\ntwø\n'
+    h.clear()
+    assert h.get() == '' and h.size == 0
+    h.append('three\n')
+    assert h.get() == 'three\n'
+    h.close()
+
+
+def test_ring_drops_the_oldest_chunks():
+    h = text_history(max_chars=10)
+    for i in range(5):
+        h.append('line{:d}\n'.format(i))
+    assert h.get() == 'line4\n'
+    assert h.size == 6
+    #one chunk bigger than the limit is still kept
+    h.append('x' * 50)
+    assert h.get() == 'x' * 50
+
+
+def test_spill_keeps_everything():
+    h = text_history(max_chars=10,spill=True)
+    for i in range(5):
+        h.append('line{:d}\n'.format(i))
+    assert h.get() == ''.join('line{:d}\n'.format(i) for i in range(5))
+    h.close()
+    assert h.file is None
+
+
+class fake_text:
+    #the bit of tk.Text that trim_scrollback uses, with 'N.0' indexes
+    def __init__(self,text):
+        self.text = text
+    def index(self,index):
+        assert index == 'end-1c'
+        lines = self.text.split('\n')
+        return '{:d}.{:d}'.format(len(lines),len(lines[-1]))
+    def offset(self,index):
+        line = int(index.split('.')[0])
+        return sum(len(l) + 1 for l in self.text.split('\n')[:line - 1])
+    def get(self,start,end):
+        return self.text[self.offset(start):self.offset(end)]
+    def delete(self,start,end):
+        self.text = self.text[:self.offset(start)] + self.text[self.offset(end):]
+
+
+def trimmer(lines,limit):
+    text = ''.join('line{:d}\n'.format(i) for i in range(lines))
+    return types.SimpleNamespace(textarea=fake_text(text),history=text_history(),vt=None,
+            trimmed_lines=0,scrollback=types.SimpleNamespace(get=lambda: limit))
+
+
+def test_trim_waits_for_a_batch():
+    app = trimmer(150,100)
+    StepComm.pycom_tk.trim_scrollback(app)
+    assert app.trimmed_lines == 0 and app.history.get() == ''
+
+
+def test_trim_moves_lines_to_the_history():
+    app = trimmer(300,100)
+    StepComm.pycom_tk.trim_scrollback(app)
+    #the line being written (empty here) counts as one of the limit
+    assert app.trimmed_lines == 201
+    assert app.textarea.text.startswith('line201\n')
+    assert app.textarea.text.count('\n') == 99
+    assert app.history.get() + app.textarea.text == \
+            ''.join('line{:d}\n'.format(i) for i in range(300))
+
+
+def test_no_limit():
+    app = trimmer(5000,0)
+    StepComm.pycom_tk.trim_scrollback(app)
+    assert app.trimmed_lines == 0
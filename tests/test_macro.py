@@ -0,0 +1,107 @@
+import re
+import pytest
+import stepcomm_macro
+
+
+def compile_text(text,slots=None):
+    slots = slots or {}
+    return stepcomm_macro.compile_macro(text,'macro 1',lambda slot: slots[slot])
+
+
+def error_line(text):
+    with pytest.raises(stepcomm_macro.macro_error) as err:
+        compile_text(text)
+    return err.value.line
+
+
+def test_unescape():
+    assert stepcomm_macro.unescape(r'a\nb\x41\e\\\q') == 'a\nbA\x1b\\\\q'
+
+
+def test_plain_text_is_not_a_script():
+    assert not stepcomm_macro.is_script('send hello')
+    assert error_line('send hello') == 1
+
+
+def test_send_and_armed_wait():
+    ops = compile_text('@script\ntimeout 2\nsend ver\nwait OK\n').ops
+    assert [op[0] for op in ops] == ['send','wait']
+    assert ops[0][3] == 'ver\n'
+    assert ops[0][4] == (['OK'],2.0)
+    assert ops[1][5] is True
+
+
+def test_waitre_compiles_the_pattern():
+    ops = compile_text('@script\nwaitre v\\d+\n').ops
+    assert isinstance(ops[0][3][0],re.Pattern)
+    assert ops[0][5] is False
+
+
+def test_repeat_blocks():
+    ops = compile_text('@script\nrepeat 3\nput a\nrepeat\ndelay 5\nend\nend\n').ops
+    assert ops[0][0] == 'repeat' and ops[0][3] == 3
+    inner = ops[0][4][1]
+    assert inner[0] == 'repeat' and inner[3] is None
+    assert inner[4] == [['delay','macro 1',5,0.005]]
+
+
+@pytest.mark.parametrize('text,line',[
+    ('@script\nsend a\nbogus x\n',3),
+    ('@script\nend\n',2),
+    ('@script\nsend a\nrepeat 2\nsend b\n',3),
+    ('@script\nwait\n',2),
+    ('@script\nwaitre (\n',2),
+    ('@script\ndelay soon\n',2),
+    ('@script\nrepeat\nend\n',2),
+    ('@script\nsend a\nrepeat 4\n# nothing\nend\n',3),
+])
+def test_errors_have_line_numbers(text,line):
+    assert error_line(text) == line
+
+
+def test_include_slot_and_self_include():
+    ops = compile_text('@script\ninclude 2\n',{2:'@script\nput x\n'}).ops
+    assert ops == [['send','macro 2',2,'x',None]]
+    ops = compile_text('@script\ninclude 2\n',{2:'plain'}).ops
+    assert ops[0][3] == 'plain'
+    with pytest.raises(stepcomm_macro.macro_error):
+        compile_text('@script\ninclude 1\n',{1:'@script\ninclude 1\n'})
+
+
+def test_include_slot_out_of_range():
+    #like the GUI, slot n is macro_text[n-1], so slot 0 would quietly be slot 4
+    slots = ['@script\nput 1\n','','','@script\nput 4\n']
+    for slot in ('0','5','00'):
+        with pytest.raises(stepcomm_macro.macro_error) as err:
+            stepcomm_macro.compile_macro('@script\nput a\ninclude ' + slot + '\n','macro 1',
+                    lambda i: slots[i-1])
+        assert err.value.line == 3
+
+
+def test_library_recompiles_on_change():
+    slots = {1:'@script\nput a\n'}
+    lib = stepcomm_macro.macro_library(lambda slot: slots[slot])
+    prog = lib.program(1)
+    assert lib.program(1) is prog
+    slots[1] = '@script\nput b\n'
+    assert lib.program(1).ops[0][3] == 'b'
+
+
+def test_stop_ends_an_endless_repeat():
+    #an empty body can't be compiled, but the runner must still see stop() for it
+    for body in ([],[['delay','macro 1',3,0.001]]):
+        prog = stepcomm_macro.macro_program([['repeat','macro 1',2,None,body]],{})
+        runner = stepcomm_macro.macro_runner(None,prog)
+        runner.start()
+        runner.stop()
+        runner.join(2)
+        assert not runner.is_alive()
+        assert isinstance(runner.error,stepcomm_macro.macro_stopped)
+
+
+def test_counted_repeat_of_delays():
+    prog = compile_text('@script\nrepeat 3\ndelay 1\nend\n')
+    runner = stepcomm_macro.macro_runner(None,prog)
+    runner.start()
+    runner.join(2)
+    assert runner.error is None
@@ -0,0 +1,35 @@
+import pytest
+StepComm = pytest.importorskip('StepComm')
+
+
+class fake_widget:
+    def __init__(self,*args,**kw):
+        pass
+    def pack(self,**kw):
+        pass
+    def mainloop(self):
+        pass
+
+
+@pytest.mark.parametrize('argv,sessions',[
+        (['--sessions','s.json'],'s.json'),
+        (['--sessions=s.json'],'s.json'),
+        (['--sess','s.json','--iothreads','2'],'s.json'),
+        (['-p','loop://'],None),
+        ([],None)])
+def test_main_picks_the_mode(monkeypatch,argv,sessions):
+    made = []
+    def record(kind):
+        def make(*args,**kw):
+            made.append((kind,args))
+            return fake_widget()
+        return make
+    monkeypatch.setattr(StepComm.sys,'argv',['StepComm.py'] + argv)
+    monkeypatch.setattr(StepComm.tk,'Tk',fake_widget)
+    monkeypatch.setattr(StepComm,'sessions_tk',record('sessions'))
+    monkeypatch.setattr(StepComm,'pycom_tk',record('gui'))
+    StepComm.main()
+    if sessions:
+        assert made[0][0] == 'sessions' and made[0][1][1] == sessions
+    else:
+        assert made[0][0] == 'gui'
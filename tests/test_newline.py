@@ -0,0 +1,58 @@
+import pytest
+from stepcomm_engine import newline_state,serial_engine
+
+
+@pytest.mark.parametrize('text,runs',[
+        ('ab\r\ncd','ab\ncd'),
+        ('ab\n\rcd','ab\ncd'),
+        ('a\r\rb','a\n\nb'),
+        ('a\n\nb','a\n\nb'),
+        ('a\r\n\r\nb','a\n\nb'),
+        ('plain','plain')])
+def test_newlines_collapse_into_one_run(text,runs):
+    assert newline_state().feed(text) == [runs]
+
+
+def test_pair_split_across_chunks():
+    nl = newline_state()
+    assert nl.feed('ab\r') == ['ab\n']
+    assert nl.feed('\ncd') == ['cd']
+    assert nl.feed('\n') == ['\n']
+    assert nl.feed('\r') == []
+
+
+def test_backspace_ends_the_run():
+    nl = newline_state()
+    assert nl.feed('ab\b\bc\r') == ['ab','\b','\b','c\n']
+    #a backspace between CR and LF breaks the pair
+    assert nl.feed('\b\n') == ['\b','\n']
+    assert nl.feed('') == []
+
+
+@pytest.mark.parametrize('text,style',[
+        ('a\nb','UNIX   '),
+        ('a\rb','OLD MAC'),
+        ('a\r\nb','WINDOWS'),
+        ('a\n\rb','WINDOWS')])
+def test_detect_style(text,style):
+    nl = newline_state(detect=True)
+    nl.autostyle = 'none'
+    nl.feed(text)
+    assert nl.autostyle == style
+
+
+def test_no_detect():
+    nl = newline_state()
+    nl.feed('a\nb')
+    assert nl.autostyle == 'WINDOWS'
+
+
+def test_auto_tx_newline_follows_rx():
+    engine = serial_engine()
+    engine.txnl = 'AUTO   '
+    engine.rx_dispatch(b'prompt\nnext')
+    assert engine.tx_newline() == '\n'
+    engine.rx_dispatch(b'\rmore')
+    assert engine.tx_newline() == '\r'
+    engine.txnl = 'WINDOWS'
+    assert engine.tx_newline() == '\r\n'
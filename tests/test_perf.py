@@ -0,0 +1,68 @@
+import json
+import queue
+import time
+from stepcomm_engine import perf_counters,perf_logger,serial_engine,device_queue
+
+
+def test_sample_rates_and_reset():
+    perf = perf_counters()
+    perf.sample()
+    time.sleep(0.05)
+    perf.rx_bytes += 5000
+    perf.tx_bytes += 1000
+    perf.in_waiting_max = 300
+    perf.tick(0.002)
+    perf.tick(0.004)
+    perf.render(0.010)
+    s = perf.sample()
+    assert 5000/2 < s['rx_bps'] <= 5000/0.05
+    assert 1000/2 < s['tx_bps'] <= 1000/0.05
+    assert s['in_waiting_max'] == 300
+    assert abs(s['tick_ms'] - 3.0) < 1e-6 and abs(s['tick_max_ms'] - 4.0) < 1e-6
+    assert abs(s['render_lag_ms'] - 10.0) < 1e-6
+    #maxima and averages start again, the byte counts keep going
+    s = perf.sample()
+    assert s['in_waiting_max'] == 0 and s['tick_ms'] == 0.0 and s['render_lag_max_ms'] == 0.0
+    assert s['rx_bps'] == 0 and s['rx_bytes'] == 5000
+
+
+def test_queue_fields_and_summary():
+    perf = perf_counters()
+    q = device_queue(2,policy='drop-newest')
+    for i in range(3):
+        q.put(b'abc')
+    s = perf.sample(q,q.dropped_bytes,{'frames':7,'frames_malformed':1})
+    assert (s['queue_depth'],s['queue_high_water'],s['queue_dropped_bytes']) == (2,2,3)
+    line = perf.summary(s)
+    assert 'queue 2 (3 B dropped)' in line
+    assert line.endswith('frames 7 (1 malformed)')
+
+
+def test_hooks_and_logger(tmp_path):
+    path = tmp_path / 'perf.jsonl'
+    perf = perf_counters()
+    seen = []
+    perf.hooks.append(seen.append)
+    perf.hooks.append(perf_logger(str(path)))
+    perf.sample()
+    perf.sample(extra={'name':'dut1'})
+    rows = [json.loads(l) for l in path.read_text().splitlines()]
+    assert len(rows) == 2 and rows[1]['name'] == 'dut1'
+    assert seen[1]['name'] == 'dut1'
+
+
+def test_engine_counts_rx_tx_and_plain_queue_drops():
+    q = queue.Queue(1)
+    engine = serial_engine(data_from_device_q=q)
+    engine.open('loop://')
+    try:
+        job = engine.send_text('abcd')
+        assert job.done.wait(5)
+        engine.poll()
+        engine.comport.write(b'ef')
+        engine.poll()
+        s = engine.perf_sample()
+    finally:
+        engine.stop()
+    assert s['tx_bytes'] == 4 and s['rx_bytes'] == 6
+    assert s['queue_depth'] == 1 and s['queue_dropped_bytes'] == 2
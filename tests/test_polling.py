@@ -0,0 +1,92 @@
+import collections
+import types
+import pytest
+import serial
+StepComm = pytest.importorskip('StepComm') # needs tkinter, not a display
+from stepcomm_engine import serial_engine
+
+
+class fake_root:
+    def __init__(self):
+        self.pending = {}
+        self.next_id = 0
+    def after(self,ms,fn):
+        self.next_id += 1
+        self.pending[self.next_id] = ms
+        return self.next_id
+    def after_cancel(self,id):
+        del self.pending[id]
+
+
+def fake_app(engine):
+    #what port_in and poll_soon use of a pycom_tk, without any display
+    app = types.SimpleNamespace(engine=engine,root=fake_root(),poll_min_ms=10,poll_max_ms=200,
+            poll_budget_ms=8,poll_ms=10,port_in_id=None,display_pending=collections.deque(),
+            macro_run=None,status=lambda t: None)
+    app.port_in = lambda: StepComm.pycom_tk.port_in(app)
+    return app
+
+
+def tick(app):
+    StepComm.pycom_tk.port_in(app)
+    return app.poll_ms
+
+
+def test_backs_off_when_idle_and_snaps_back():
+    engine = serial_engine()
+    engine.open('loop://')
+    app = fake_app(engine)
+    try:
+        assert [tick(app) for i in range(6)] == [20,40,80,160,200,200]
+        assert list(app.root.pending.values())[-1] == 200
+        engine.comport.write(b'data')
+        assert tick(app) == 10
+        assert tick(app) == 20
+    finally:
+        engine.stop()
+
+
+def test_sending_keeps_it_fast():
+    engine = serial_engine()
+    app = fake_app(engine)
+    engine.tx.job = object() # a job is being transmitted
+    assert [tick(app) for i in range(3)] == [10,10,10]
+
+
+def test_poll_soon_replaces_a_long_wait():
+    engine = serial_engine()
+    app = fake_app(engine)
+    for i in range(4):
+        tick(app)
+    old = app.port_in_id
+    StepComm.pycom_tk.poll_soon(app)
+    assert old not in app.root.pending
+    assert app.root.pending[app.port_in_id] == 10 and app.poll_ms == 10
+    #already fast, nothing to do
+    new = app.port_in_id
+    StepComm.pycom_tk.poll_soon(app)
+    assert app.port_in_id == new and new in app.root.pending
+
+
+def test_read_failure_is_reported():
+    engine = serial_engine()
+    app = fake_app(engine)
+    said = []
+    app.status = said.append
+    def broken(budget):
+        raise serial.SerialException('gone')
+    engine.poll = broken
+    tick(app)
+    assert said == ['port read failed']
+
+
+def test_poll_budget_reads_until_empty():
+    chunks = []
+    engine = serial_engine(on_rx=chunks.append)
+    engine.open('loop://','3000000') # loop:// times the write at the baud rate
+    try:
+        engine.comport.write(b'x' * 3000)
+        assert engine.poll(0.1) == 3000
+        assert engine.poll(0.1) == 0
+    finally:
+        engine.stop()
@@ -0,0 +1,138 @@
+import os
+import threading
+import time
+import types
+import pytest
+import serial.tools.list_ports
+from stepcomm_engine import port_watcher
+
+
+class fake_ports:
+    def __init__(self,*names):
+        self.names = list(names)
+        self.calls = 0
+    def __call__(self):
+        self.calls += 1
+        if self.names is None:
+            raise OSError('sysfs went away')
+        return [types.SimpleNamespace(device=n) for n in self.names]
+
+
+@pytest.fixture
+def ports(monkeypatch):
+    p = fake_ports('/dev/ttyUSB1','/dev/ttyUSB0')
+    monkeypatch.setattr(serial.tools.list_ports,'comports',p)
+    return p
+
+
+def start(tmp_path,**kw):
+    w = port_watcher(**kw)
+    w.watch_paths = (str(tmp_path),)
+    got = []
+    changed = threading.Event()
+    def subscriber(names):
+        got.append(names)
+        changed.set()
+    w.subscribers.append(subscriber)
+    w.start()
+    assert w.ready.wait(5)
+    return w,got,changed
+
+
+def wait_for(cond,timeout=5):
+    end = time.monotonic() + timeout
+    while not cond():
+        assert time.monotonic() < end
+        time.sleep(0.005)
+
+
+def test_first_scan_is_sorted_and_sent(tmp_path,ports):
+    w,got,changed = start(tmp_path,interval_s=0.01)
+    try:
+        assert w.ports == ['/dev/ttyUSB0','/dev/ttyUSB1']
+        assert got == [['/dev/ttyUSB0','/dev/ttyUSB1']]
+        time.sleep(0.1)
+        assert ports.calls == 1 # nothing changed in the watched directory
+    finally:
+        w.stop()
+        w.join(1)
+    assert not w.is_alive()
+
+
+def test_hotplug_is_seen_through_the_directory(tmp_path,ports):
+    w,got,changed = start(tmp_path,interval_s=0.01)
+    try:
+        changed.clear()
+        ports.names.append('/dev/ttyACM0')
+        (tmp_path / 'ttyACM0').touch()
+        assert changed.wait(5)
+        assert got[-1] == ['/dev/ttyACM0','/dev/ttyUSB0','/dev/ttyUSB1']
+    finally:
+        w.stop()
+
+
+def test_refresh_always_notifies(tmp_path,ports):
+    w,got,changed = start(tmp_path,interval_s=10)
+    try:
+        w.refresh()
+        wait_for(lambda: len(got) == 2)
+        assert got[0] == got[1] and ports.calls == 2
+    finally:
+        w.stop()
+
+
+def test_fallback_without_a_dev_directory(tmp_path,ports):
+    w,got,changed = start(tmp_path / 'missing',interval_s=0.01,fallback_s=0.05)
+    try:
+        wait_for(lambda: ports.calls >= 3)
+        assert len(got) == 1 # scanned again, but the list stayed the same
+    finally:
+        w.stop()
+
+
+def test_failed_scan_keeps_the_list(tmp_path,ports):
+    w,got,changed = start(tmp_path,interval_s=10)
+    try:
+        ports.names = None
+        w.refresh()
+        wait_for(lambda: ports.calls == 2)
+        wait_for(lambda: len(got) == 2)
+        assert w.ports == ['/dev/ttyUSB0','/dev/ttyUSB1'] and got[1] == got[0]
+    finally:
+        w.stop()
+
+
+def test_signature(tmp_path):
+    w = port_watcher()
+    w.watch_paths = (str(tmp_path),str(tmp_path / 'missing'))
+    sig = w.signature()
+    assert sig == (os.stat(tmp_path).st_mtime_ns,None)
+    w.watch_paths = (str(tmp_path / 'missing'),str(tmp_path))
+    assert w.signature() is None
+
+
+class fake_combo:
+    def __init__(self,value=''):
+        self.value = value
+    def get(self):
+        return self.value
+    def set(self,value):
+        self.value = value
+    def configure(self,**kw):
+        self.values = kw['values']
+
+
+@pytest.mark.parametrize('given,opened',[('','/dev/ttyUSB0'),('/dev/ttyUSB1',None),
+        ('/dev/gone','/dev/ttyUSB0')])
+def test_gui_opens_the_first_port_once(given,opened):
+    StepComm = pytest.importorskip('StepComm')
+    said = []
+    app = types.SimpleNamespace(port_combo=fake_combo(given),ports_first=True,status=said.append,
+            opened=[])
+    app.set_port = lambda: app.opened.append(app.port_combo.get())
+    StepComm.pycom_tk.ports_changed(app,['/dev/ttyUSB0','/dev/ttyUSB1'])
+    assert app.opened == ([opened] if opened else [])
+    assert said == ['Found ports: /dev/ttyUSB0, /dev/ttyUSB1']
+    StepComm.pycom_tk.ports_changed(app,[])
+    assert len(app.opened) == (1 if opened else 0)
+    assert said[-1] == 'No Serial Ports Found!'
@@ -0,0 +1,174 @@
+import queue
+import time
+import pytest
+import stepcomm_frames
+from stepcomm_engine import device_queue,queue_feeder,serial_engine
+
+
+def drain(q):
+    items = []
+    while True:
+        try:
+            items.append(q.get_nowait())
+        except queue.Empty:
+            return items
+
+
+def test_unknown_policy():
+    with pytest.raises(ValueError):
+        device_queue(4,policy='drop-random')
+
+
+def test_block_times_out_and_drops():
+    q = device_queue(2,policy='block',timeout=0.01)
+    for item in (b'a',b'bb',b'ccc'):
+        q.put(item)
+    assert drain(q) == [b'a',b'bb']
+    assert q.dropped == 1
+    assert q.dropped_bytes == 3
+    assert q.high_water == 2
+
+
+def test_drop_newest():
+    q = device_queue(2,policy='drop-newest')
+    for item in (b'a',b'bb',b'ccc',b'dddd'):
+        q.put(item)
+    assert drain(q) == [b'a',b'bb']
+    assert q.dropped == 2
+    assert q.dropped_bytes == 7
+
+
+def test_drop_oldest():
+    q = device_queue(2,policy='drop-oldest')
+    for item in (b'a',b'bb',b'ccc',b'dddd',b'e'):
+        q.put(item)
+    assert drain(q) == [b'dddd',b'e']
+    assert q.dropped == 3
+    assert q.dropped_bytes == 6
+    assert q.high_water == 2
+    q.task_done()
+    q.task_done()
+    assert q.unfinished_tasks == 0
+    q.join()
+
+
+def test_coalesce_keeps_everything():
+    q = device_queue(2,policy='coalesce')
+    for item in (b'a',b'bb',b'ccc',b'dddd'):
+        q.put(item)
+    assert drain(q) == [b'a',b'bbcccdddd']
+    assert q.dropped == 0
+    assert q.high_water == 2
+
+
+def test_coalesce_keeps_frames_apart():
+    q = device_queue(2,policy='coalesce')
+    for data in (b'one',b'two',b'three'):
+        q.put(stepcomm_frames.frame(data))
+    items = drain(q)
+    assert items == [b'two',b'three']
+    assert all(isinstance(f,stepcomm_frames.frame) for f in items)
+    assert q.dropped == 1
+    q.task_done()
+    q.task_done()
+    q.join()
+
+
+def test_coalesce_never_joins_str_and_bytes():
+    q = device_queue(1,policy='coalesce')
+    q.put('text')
+    q.put(b'\x00')
+    assert drain(q) == [b'\x00']
+    assert q.dropped_bytes == 4
+
+
+def test_unbounded_never_drops():
+    q = device_queue(0,policy='drop-newest')
+    for i in range(100):
+        q.put(bytes([i]))
+    assert len(drain(q)) == 100
+    assert q.dropped == 0
+    assert q.high_water == 100
+
+
+def test_stamped_sequence():
+    q = device_queue(0,stamp=True)
+    q.put(b'abc')
+    q.put(b'de')
+    (s1,t1,d1),(s2,t2,d2) = drain(q)
+    assert (s1,d1) == (0,b'abc')
+    assert (s2,d2) == (3,b'de')
+    assert t2 >= t1
+
+
+def test_stamped_drop_leaves_a_gap():
+    q = device_queue(1,policy='drop-newest',stamp=True)
+    q.put(b'abc')
+    q.put(b'de')
+    q.get_nowait()
+    q.put(b'f')
+    seq,t,data = q.get_nowait()
+    assert (seq,data) == (5,b'f')
+    assert q.dropped_bytes == 2
+
+
+def test_stamped_coalesce():
+    q = device_queue(1,policy='coalesce',stamp=True)
+    q.put(b'abc')
+    q.put(b'de')
+    assert [(s,d) for s,t,d in drain(q)] == [(0,b'abcde')]
+
+
+class fake_tx:
+    def __init__(self):
+        self.jobs = []
+    def send(self,job):
+        self.jobs.append(job)
+        return job
+
+
+def feed(q,items,**kw):
+    tx = fake_tx()
+    for item in items:
+        q.put(item)
+    feeder = queue_feeder(q,tx,**kw)
+    feeder.start()
+    while q.qsize() or not tx.jobs:
+        time.sleep(0.01)
+    feeder.stop()
+    feeder.join()
+    return tx.jobs
+
+
+def test_feeder_batches_and_translates():
+    jobs = feed(device_queue(),['a\n',b'b\n','c\r\n'],newline=lambda: '\r')
+    assert len(jobs) == 1
+    assert jobs[0].data == b'a\rb\nc\r'
+    assert jobs[0].nl == b'\r'
+
+
+def test_feeder_without_translation_and_stamped():
+    jobs = feed(device_queue(stamp=True,translate_nl=False),['a\n',b'b'])
+    assert [j.data for j in jobs] == [b'a\nb']
+
+
+def test_feeder_batch_limit():
+    jobs = feed(device_queue(),[b'x' * 100] * 10,batch=250)
+    assert [len(j.data) for j in jobs] == [300,300,300,100]
+
+
+def test_data_to_device_q_on_loop():
+    q = device_queue(8,policy='block')
+    engine = serial_engine(data_to_device_q=q)
+    engine.open('loop://')
+    try:
+        q.put('hello\n')
+        q.put(b'\x00\xff')
+        end = time.monotonic() + 5
+        got = b''
+        while len(got) < 9 and time.monotonic() < end:
+            got += engine.comport.read(engine.comport.in_waiting)
+            time.sleep(0.01)
+    finally:
+        engine.stop()
+    assert got == b'hello\r\n\x00\xff'
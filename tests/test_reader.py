@@ -0,0 +1,90 @@
+import queue
+import threading
+import time
+import serial
+from stepcomm_engine import serial_engine,serial_reader,port_fd
+
+
+def collect(q,size,timeout=5):
+    got = b''
+    end = time.monotonic() + timeout
+    while len(got) < size and time.monotonic() < end:
+        try:
+            got += q.get(timeout=0.05)
+        except queue.Empty:
+            pass
+    return got
+
+
+def test_reader_thread_delivers_in_order():
+    port = serial.serial_for_url('loop://',timeout=0.05)
+    q = queue.Queue()
+    reader = serial_reader(q.put,timeout=0.05)
+    reader.set_port(port)
+    reader.start()
+    try:
+        data = b''.join(b'%05d;' % i for i in range(2000))
+        for i in range(0,len(data),700):
+            port.write(data[i:i+700])
+        assert collect(q,len(data)) == data
+    finally:
+        reader.stop()
+        reader.join(1)
+        port.close()
+    assert not reader.is_alive()
+
+
+def test_reader_waits_for_a_port_and_survives_a_closed_one():
+    q = queue.Queue()
+    reader = serial_reader(q.put,timeout=0.01)
+    reader.start()
+    try:
+        time.sleep(0.03) # no port yet
+        first = serial.serial_for_url('loop://',timeout=0.01)
+        reader.set_port(first)
+        first.close()
+        time.sleep(0.03)
+        second = serial.serial_for_url('loop://',timeout=0.01)
+        reader.set_port(second)
+        second.write(b'again')
+        assert collect(q,5) == b'again'
+        second.close()
+    finally:
+        reader.stop()
+        reader.join(1)
+    assert not reader.is_alive()
+
+
+def test_engine_switches_between_thread_and_polling():
+    got = []
+    def on_rx(l):
+        got.append((threading.current_thread().name,l))
+    engine = serial_engine(on_rx=on_rx)
+    engine.open('loop://')
+    try:
+        engine.set_rxthread(True)
+        assert engine.comport.timeout == engine.rx_timeout
+        engine.comport.write(b'threaded')
+        end = time.monotonic() + 5
+        while sum(len(l) for name,l in got) < 8 and time.monotonic() < end:
+            time.sleep(0.01)
+        reader = engine.rx_reader
+        engine.set_rxthread(False)
+        reader.join(1) # a read already waiting may still finish
+        assert engine.comport.timeout == 0
+        engine.comport.write(b'polled')
+        assert engine.poll() == 6
+    finally:
+        engine.stop()
+    assert {name for name,l in got[:-1]} == {'serial_reader'}
+    assert b''.join(l for name,l in got[:-1]) == b'threaded'
+    assert got[-1] == (threading.current_thread().name,b'polled')
+    assert engine.perf.rx_bytes == 14
+
+
+def test_port_fd():
+    port = serial.serial_for_url('loop://')
+    try:
+        assert port_fd(port) is None # nothing to select() on
+    finally:
+        port.close()
@@ -0,0 +1,69 @@
+import time
+import stepcomm_eventlog
+import stepcomm_replay
+
+
+def open_port(path,options='speed=max'):
+    port = stepcomm_replay.replay_port()
+    port.port = 'replay://{}?{}'.format(path,options)
+    port.timeout = 0.1
+    port.open()
+    return port
+
+
+def make_log(path,chunks):
+    log = stepcomm_eventlog.event_log(str(path))
+    log.start()
+    for kind,data in chunks:
+        log.record(kind,data)
+    log.stop()
+
+
+def test_plain_file(tmp_path):
+    path = tmp_path / 'cap.txt'
+    path.write_bytes(b'hello\nworld\n')
+    port = open_port(path)
+    assert port.read(100) == b'hello\nworld\n'
+    assert port.finished
+
+
+def test_event_log_directions(tmp_path):
+    path = tmp_path / 'ev.log'
+    make_log(path,[(stepcomm_eventlog.RX,b'rx1'),(stepcomm_eventlog.TX,b'tx1'),
+            (stepcomm_eventlog.RX,b'rx2')])
+    assert open_port(path).read(100) == b'rx1rx2'
+    assert open_port(path,'speed=max&dir=TX').read(100) == b'tx1'
+
+
+def test_loop_repeats(tmp_path):
+    path = tmp_path / 'cap.txt'
+    path.write_bytes(b'ab')
+    port = open_port(path,'speed=max&loop=1')
+    assert port.read(6) == b'ababab'
+
+
+def test_loop_empty_recording_ends(tmp_path):
+    path = tmp_path / 'empty.txt'
+    path.write_bytes(b'')
+    port = open_port(path,'speed=max&loop=1')
+    start = time.monotonic()
+    assert port.in_waiting == 0
+    assert port.read(10) == b''
+    assert port.finished
+    assert time.monotonic() - start < 1
+
+
+def test_loop_empty_range_ends(tmp_path):
+    path = tmp_path / 'ev.log'
+    make_log(path,[(stepcomm_eventlog.RX,b'data')])
+    port = open_port(path,'speed=max&loop=1&start=100&end=200')
+    assert port.read(10) == b''
+    assert port.finished
+
+
+def test_writes_are_counted(tmp_path):
+    path = tmp_path / 'cap.txt'
+    path.write_bytes(b'x')
+    port = open_port(path)
+    assert port.write(b'abc') == 3
+    assert port.written == 3
@@ -0,0 +1,93 @@
+import random
+import stepcomm_search
+
+
+def make_index(text,block_chars=64,**kw):
+    index = stepcomm_search.search_index(block_chars=block_chars,**kw)
+    pos = 0
+    rnd = random.Random(1)
+    while pos < len(text):
+        n = rnd.randint(1,20)
+        index.append(text[pos:pos+n])
+        pos += n
+    return index
+
+
+def all_text(index):
+    return ''.join(b.text for b in index.blocks) + ''.join(index.open)
+
+
+def lines(n):
+    return ''.join('line {:d} {}\n'.format(i,'BOOT' if i % 17 == 0 else 'x') for i in range(n))
+
+
+def test_required_literals():
+    assert stepcomm_search.required_literals('abc.*def') == ['abc','def']
+    assert stepcomm_search.required_literals('a+bcd') == ['a','bcd']
+    assert stepcomm_search.required_literals('(') == []
+
+
+def test_search_both_ways_matches_str_find():
+    text = lines(200)
+    index = make_index(text)
+    assert len(index.blocks) > 3
+    query = stepcomm_search.search_query('boot')
+    found = []
+    pos = 0
+    while True:
+        hit = index.search(query,pos)
+        if hit is None:
+            break
+        found.append(hit[0])
+        pos = hit[0] + 1
+    expect = [i for i in range(len(text)) if text.startswith('BOOT',i)]
+    assert found == expect
+    back = index.search(query,index.end,backwards=True)
+    assert back[0] == expect[-1]
+
+
+def test_regex_and_case():
+    index = make_index(lines(100))
+    assert index.search(stepcomm_search.search_query(r'line 5\d BOOT',regex=True),0) is not None
+    assert index.search(stepcomm_search.search_query('boot',case=True),0) is None
+
+
+def test_position_and_line_text():
+    text = lines(100)
+    index = make_index(text)
+    offset = text.index('line 51 BOOT')
+    assert index.position(offset + 5) == (51,5)
+    assert index.line_text(offset + 3) == 'line 51 BOOT'
+    assert index.line_offset(51) == offset
+    assert index.line_offset(100) == len(text)
+    assert index.line_offset(101) is None
+
+
+def test_retract_open_text_only():
+    index = make_index(lines(20))
+    tail = len(''.join(index.open))
+    assert index.retract(tail)
+    assert not index.retract(1) or tail == 0
+    assert all_text(index) == lines(20)[:index.end]
+
+
+def test_truncate_into_sealed_blocks():
+    text = lines(100)
+    index = make_index(text)
+    cut = text.index('line 40 ')
+    assert index.truncate(cut)
+    assert index.end == cut
+    assert all_text(index) == text[:cut]
+    index.append(text[cut:])
+    assert all_text(index) == text
+    assert index.position(text.index('line 99 ')) == (99,0)
+
+
+def test_dropped_blocks_keep_offsets():
+    text = lines(500)
+    index = make_index(text,max_chars=1000)
+    assert index.start() > 0
+    offset = text.index('line 498 ')
+    assert index.position(offset) == (498,0)
+    assert index.line_offset(3) is None
+    assert not index.truncate(0)
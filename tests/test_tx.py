@@ -0,0 +1,202 @@
+import time
+import pytest
+from stepcomm_engine import serial_engine,tx_file_job,tx_job
+
+
+def open_engine(encoding='utf-8',baud='115200',on_sent=None):
+    engine = serial_engine(on_sent=on_sent)
+    engine.set_encoding(encoding)
+    engine.open('loop://',baud)
+    return engine
+
+
+class write_log:
+    #on_sent callback keeping (time,block) of every write
+    def __init__(self):
+        self.writes = []
+    def __call__(self,data):
+        self.writes.append((time.monotonic(),data))
+    def gaps(self):
+        return [b[0] - a[0] for a,b in zip(self.writes,self.writes[1:])]
+
+
+def sent(engine,job):
+    assert job.done.wait(5)
+    assert job.error is None
+    return engine.comport.read(engine.comport.in_waiting)
+
+
+@pytest.mark.parametrize('encoding',['utf-8','latin-1','utf-16'])
+def test_text_file_is_encoded_like_typed_text(tmp_path,encoding):
+    text = 'café\nnaïve\r\n€ 5\n'
+    path = tmp_path / 'send.txt'
+    path.write_bytes(text.encode('utf-8'))
+    typed = open_engine(encoding)
+    filed = open_engine(encoding)
+    try:
+        expected = sent(typed,typed.send_text(text))
+        assert sent(filed,filed.send_file(str(path))) == expected
+    finally:
+        typed.comport.close()
+        filed.comport.close()
+
+
+def test_text_file_blocks_split_characters_and_newlines(tmp_path):
+    path = tmp_path / 'send.txt'
+    path.write_bytes('aé\r\nb'.encode('utf-8') * 100)
+    for size in (1,2,3,5):
+        job = tx_file_job(str(path),block=size,nl=b'\n')
+        assert b''.join(job.blocks()) == 'aé\nb'.encode('utf-8') * 100
+
+
+def test_binary_file_is_sent_as_it_is(tmp_path):
+    raw = bytes(range(256)) * 4
+    path = tmp_path / 'send.bin'
+    path.write_bytes(raw)
+    engine = open_engine('utf-16')
+    try:
+        assert sent(engine,engine.send_file(str(path),binary=True)) == raw
+    finally:
+        engine.comport.close()
+
+
+def test_unpaced_chunks_follow_the_baud_rate():
+    log = write_log()
+    engine = open_engine(baud='9600',on_sent=log)
+    try:
+        data = bytes(range(256)) * 4
+        assert sent(engine,engine.tx.send(tx_job(data))) == data
+    finally:
+        engine.comport.close()
+    assert max(len(b) for t,b in log.writes) == 96 # ~100ms of line time
+    assert len(log.writes) == 11
+
+
+def test_byte_order_across_jobs():
+    engine = open_engine()
+    try:
+        jobs = [engine.send_text('line {:d}\n'.format(i)) for i in range(200)]
+        jobs.append(engine.tx.send(tx_job(b'paced\r\n',char_delay=0.001)))
+        jobs.append(engine.send_text('last'))
+        for job in jobs:
+            assert job.done.wait(5)
+        data = engine.comport.read(engine.comport.in_waiting)
+    finally:
+        engine.comport.close()
+    expected = ''.join('line {:d}\r\n'.format(i) for i in range(200)) + 'paced\r\nlast'
+    assert data == expected.encode()
+
+
+def test_write_timeout_fails_only_that_job():
+    engine = open_engine()
+    try:
+        #nobody reads the loop, it takes 4096 bytes and then times the write out
+        job = engine.tx.send(tx_job(b'x' * 10000))
+        assert job.done.wait(5)
+        assert job.error is not None
+        engine.comport.reset_input_buffer()
+        assert sent(engine,engine.send_text('still here')) == b'still here'
+    finally:
+        engine.comport.close()
+
+
+def test_char_delay():
+    log = write_log()
+    engine = open_engine(on_sent=log)
+    try:
+        start = time.monotonic()
+        assert sent(engine,engine.send_text('abcdef',char_delay=0.02)) == b'abcdef'
+        elapsed = time.monotonic() - start
+    finally:
+        engine.comport.close()
+    assert [b for t,b in log.writes] == [b'a',b'b',b'c',b'd',b'e',b'f']
+    assert min(log.gaps()) >= 0.019
+    assert elapsed >= 0.1
+
+
+def test_line_delay_replaces_char_delay_after_newline():
+    log = write_log()
+    engine = open_engine(on_sent=log)
+    try:
+        sent(engine,engine.send_text('ab\ncd\n',char_delay=0.01,line_delay=0.05))
+    finally:
+        engine.comport.close()
+    assert b''.join(b for t,b in log.writes) == b'ab\r\ncd\r\n'
+    gaps = log.gaps()
+    #a, b, CR, LF, c: the gap after LF is the line delay, the others the char delay
+    assert gaps[3] >= 0.049
+    assert all(g >= 0.0099 for g in gaps)
+    assert max(gaps[:3]) < 0.049
+
+
+def test_line_delay_alone_sends_whole_lines():
+    log = write_log()
+    engine = open_engine(on_sent=log)
+    try:
+        sent(engine,engine.send_text('one\ntwo\nthree',line_delay=0.03))
+    finally:
+        engine.comport.close()
+    assert [b for t,b in log.writes] == [b'one\r\n',b'two\r\n',b'three']
+    assert min(log.gaps()) >= 0.029
+
+
+def wait_for(cond,timeout=5):
+    end = time.monotonic() + timeout
+    while not cond():
+        assert time.monotonic() < end
+        time.sleep(0.005)
+
+
+@pytest.mark.parametrize('use_mmap',[False,True])
+def test_file_blocks_and_progress(tmp_path,use_mmap):
+    raw = bytes(range(256)) * 1000
+    path = tmp_path / 'send.bin'
+    path.write_bytes(raw)
+    job = tx_file_job(str(path),binary=True,use_mmap=use_mmap,block=4096)
+    assert job.total == len(raw)
+    blocks = list(job.blocks())
+    assert b''.join(blocks) == raw
+    assert max(len(b) for b in blocks) == 4096
+    assert job.file.closed
+
+
+def test_empty_file(tmp_path):
+    path = tmp_path / 'empty.txt'
+    path.write_bytes(b'')
+    for binary in (False,True):
+        assert list(tx_file_job(str(path),binary=binary,use_mmap=True).blocks()) == []
+
+
+def test_file_pause_resume(tmp_path):
+    path = tmp_path / 'send.bin'
+    path.write_bytes(b'x' * 3000)
+    engine = open_engine()
+    try:
+        engine.tx.pause()
+        job = engine.send_file(str(path),binary=True)
+        wait_for(lambda: engine.tx.job is job)
+        time.sleep(0.05)
+        assert job.sent == 0 and not job.done.is_set()
+        engine.tx.resume()
+        assert sent(engine,job) == b'x' * 3000
+        assert job.sent == job.total
+    finally:
+        engine.comport.close()
+
+
+def test_file_cancel_keeps_later_jobs(tmp_path):
+    path = tmp_path / 'send.bin'
+    path.write_bytes(b'x' * 3000)
+    engine = open_engine()
+    try:
+        engine.tx.pause()
+        job = engine.send_file(str(path),binary=True)
+        after = engine.send_text('next')
+        wait_for(lambda: engine.tx.job is job)
+        engine.tx.cancel()
+        assert job.done.wait(5)
+        assert job.cancelled and job.error is None and job.sent == 0
+        assert job.file.closed
+        assert sent(engine,after) == b'next'
+    finally:
+        engine.comport.close()
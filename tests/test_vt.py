@@ -0,0 +1,106 @@
+import stepcomm_vt
+
+
+def screen(text,rows=5,cols=20):
+    scr = stepcomm_vt.vt_screen(rows,cols)
+    scr.feed(text)
+    return scr
+
+
+def rows(scr):
+    return [scr.text(y).rstrip() for y in range(scr.rows)]
+
+
+def test_text_and_newlines():
+    scr = screen('hello\r\nworld')
+    assert rows(scr)[:2] == ['hello','world']
+    assert (scr.y,scr.x) == (1,5)
+
+
+def test_autowrap():
+    scr = screen('x'*25,cols=20)
+    assert rows(scr)[:2] == ['x'*20,'x'*5]
+
+
+def test_cursor_moves_and_erase():
+    scr = screen('abcdef\x1b[1;3H\x1b[K\x1b[3;2Hz\x1b[2D\x1b[Cq')
+    assert rows(scr)[0] == 'ab'
+    assert rows(scr)[2] == ' q'
+
+
+def test_escape_split_across_chunks():
+    scr = stepcomm_vt.vt_screen(5,20)
+    for c in 'a\x1b[31mb\x1b]0;title\x07c':
+        scr.feed(c)
+    assert rows(scr)[0] == 'abc'
+    assert scr.styles[scr.attrs[0][1]][0] == stepcomm_vt.palette[1]
+
+
+def test_sgr_colors():
+    scr = screen('\x1b[1;4;7;38;5;196;48;2;1;2;3mx\x1b[0my')
+    assert scr.styles[scr.attrs[0][0]] == (stepcomm_vt.palette[196],'#010203',True,True,True)
+    assert scr.attrs[0][1] == 0
+    assert scr.runs(0) == [('x',scr.attrs[0][0]),('y',0)]
+
+
+def test_scroll_keeps_scrolled_rows_and_shifts_dirty():
+    scr = stepcomm_vt.vt_screen(3,10)
+    scr.take()
+    scr.feed('a\r\nb\r\nc\r\nd\r\ne')
+    scrolled,dirty = scr.take()
+    assert [''.join(c).rstrip() for c,a,changed in scrolled] == ['a','b']
+    assert all(changed for c,a,changed in scrolled)
+    assert rows(scr) == ['c','d','e']
+    assert dirty == {0,1,2}
+    scr.feed('\x1b[1;1HX')
+    assert scr.take() == ([],{0})
+
+
+def test_scroll_region():
+    scr = screen('1\r\n2\r\n3\r\n4\r\n5\x1b[2;4r\x1b[4;1H\nX',rows=5)
+    assert rows(scr) == ['1','3','4','X','5']
+    assert scr.scrolled == []
+
+
+def test_insert_delete_chars_and_lines():
+    scr = screen('abcdef\x1b[1;2H\x1b[2P')
+    assert rows(scr)[0] == 'adef'
+    scr.feed('\x1b[2@')
+    assert rows(scr)[0] == 'a  def'
+    scr = screen('1\r\n2\r\n3\x1b[2;1H\x1b[L')
+    assert rows(scr)[:4] == ['1','','2','3']
+    scr.feed('\x1b[2M')
+    assert rows(scr)[:3] == ['1','3','']
+
+
+def test_alternate_screen():
+    scr = screen('main\x1b[?1049h\x1b[2J\x1b[Halt')
+    assert rows(scr)[0] == 'alt'
+    scr.feed('\x1b[?1049l')
+    assert rows(scr)[0] == 'main'
+    assert (scr.y,scr.x) == (0,4)
+
+
+def test_dec_graphics():
+    assert rows(screen('\x1b(0lqk\x1b(Bq'))[0] == '┌─┐q'
+
+
+def test_replies():
+    scr = screen('\x1b[3;7H\x1b[6n\x1b[c\x1b[5n')
+    assert scr.replies == ['\x1b[3;7R','\x1b[?1;2c','\x1b[0n']
+
+
+def test_keys():
+    scr = stepcomm_vt.vt_screen()
+    assert scr.key('Up') == '\x1b[A'
+    scr.feed('\x1b[?1h')
+    assert scr.key('Up') == '\x1bOA'
+    assert scr.key('Next') == '\x1b[6~'
+    assert scr.key('a') is None
+
+
+def test_junk_does_not_raise():
+    scr = stepcomm_vt.vt_screen(4,8)
+    scr.feed('\x1b[999;999H\x1b[99A\x1b[;r\x1b[0;0r\x1b[?m\x1b[38;5m\x1bZ\x9b\x00\x1b')
+    scr.feed('')
+    assert 0 <= scr.y < 4 and 0 <= scr.x <= 8